@@ -0,0 +1,100 @@
+"""Last-seen and blocked-bot tracking.
+
+Every update marks its user as seen in an in-memory dirty map; sends that
+fail because the user blocked the bot or deleted the chat mark them
+unreachable. Every ACTIVITY_FLUSH_SECONDS the maps are swapped out and
+written in one batch through the write coalescer, so a busy bot makes one
+transaction per interval instead of a write per update.
+"""
+import asyncio
+import logging
+import time
+from telegram import Update
+from telegram.error import BadRequest, Forbidden
+from telegram.ext import ContextTypes
+from config import ACTIVITY_FLUSH_SECONDS
+from coalescer import write_coalescer
+from database import record_activity
+from metrics import GaugeFunc, register
+
+logger = logging.getLogger(__name__)
+
+def _timestamp(epoch):
+    # Same UTC format as SQLite's CURRENT_TIMESTAMP, so the columns compare as text
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch))
+
+def is_unreachable(error: Exception) -> bool:
+    """True for send errors that mean the chat will not accept messages from the bot again"""
+    if isinstance(error, Forbidden):
+        return True
+    return isinstance(error, BadRequest) and 'chat not found' in str(error).lower()
+
+class ActivityTracker:
+    """Dirty maps of seen and unreachable users, flushed in batches"""
+
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._seen = {}
+        self._blocked = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._seen) + len(self._blocked)
+
+    def touch(self, user_id: int):
+        """Record that a user was just heard from"""
+        self._blocked.pop(user_id, None)
+        self._seen[user_id] = time.time()
+
+    def mark_blocked(self, user_id: int):
+        """Record that a send to the user failed for good"""
+        self._seen.pop(user_id, None)
+        self._blocked[user_id] = time.time()
+
+    def start(self):
+        """Start the periodic flush on the running loop"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic flush and write whatever is still pending"""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def flush(self):
+        """Write the pending sightings and marks in one batch; returns the number of users written"""
+        seen, self._seen = self._seen, {}
+        blocked, self._blocked = self._blocked, {}
+        if not seen and not blocked:
+            return 0
+        try:
+            return await write_coalescer.submit(
+                record_activity,
+                [(user_id, _timestamp(ts)) for user_id, ts in seen.items()],
+                [(user_id, _timestamp(ts)) for user_id, ts in blocked.items()],
+            )
+        except Exception as e:
+            logger.error(f"Failed to write activity for {len(seen) + len(blocked)} users: {e}")
+            # Keep them for the next flush unless something newer has been recorded since
+            for user_id, ts in seen.items():
+                if user_id not in self._blocked:
+                    self._seen.setdefault(user_id, ts)
+            for user_id, ts in blocked.items():
+                if user_id not in self._seen:
+                    self._blocked.setdefault(user_id, ts)
+            return 0
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+activity_tracker = ActivityTracker()
+register(GaugeFunc('bot_activity_pending_users', 'Users with activity not yet written to the database', lambda: len(activity_tracker)))
+
+async def track_activity(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Mark the sender of every update as seen"""
+    if update.effective_user:
+        activity_tracker.touch(update.effective_user.id)
@@ -0,0 +1,269 @@
+"""Priority admission control for incoming updates.
+
+PTB hands every update to the Application's update processor. This one
+sorts updates into classes, highest priority first:
+
+  admin     anything an admin sends
+  money     purchases and deposits, including a user part-way through either flow
+  code      Get Code sessions and their buttons
+  default   everything else, e.g. Balance, Referral, /start
+  static    menu navigation and fixed texts like About and Support
+
+ADMISSION_WORKERS updates are handled at once, always taken from the
+highest non-empty class. Each user has at most one update in a class
+queue or in a handler. Later updates from the same user wait behind it
+in arrival order and are classified once they reach the front, against
+the user_data the earlier ones left behind. Per-user flows like
+Deposit -> method -> amount -> transaction ID therefore see their steps
+in order, as with sequential processing.
+
+Load is shed three ways:
+- a full class queue refuses new updates;
+- an update that waited past its class deadline is dropped when a
+  worker reaches it, because the user has likely moved on;
+- static requests are answered from cached replies without queueing, if
+  a cached reply exists, while the smallest queueing delay over the last
+  ADMISSION_INTERVAL is above ADMISSION_TARGET_DELAY.
+Users whose updates are dropped are told the bot is busy, at most once
+per ADMISSION_NOTICE_COOLDOWN.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from config import (ADMIN_IDS, SERVICE_NAMES, DEPOSIT_METHODS, ADMISSION_WORKERS, ADMISSION_QUEUE_LIMITS,
+                    ADMISSION_DEADLINES, ADMISSION_TARGET_DELAY, ADMISSION_INTERVAL, ADMISSION_USER_BACKLOG,
+                    ADMISSION_NOTICE_COOLDOWN)
+from handlers import STATIC_MESSAGE_REPLIES, STATIC_CALLBACK_REPLIES
+from metrics import ADMISSION_CLASSES, ADMISSION_UPDATES, ADMISSION_WAIT_SECONDS, GaugeFunc, register
+from ratelimit import CODE_CALLBACKS
+from utils import user_sessions
+
+logger = logging.getLogger(__name__)
+
+MONEY_TEXTS = frozenset(["Buy Accounts", "Deposit", *SERVICE_NAMES.values(), *DEPOSIT_METHODS])
+# user_data keys set while a purchase or deposit waits for the user's next message
+MONEY_STATES = ('purchase_service', 'deposit_method', 'awaiting_transaction_id')
+CODE_CALLBACK_DATA = CODE_CALLBACKS | {'get_code_menu', 'stop_watch'}
+STATIC_TEXTS = frozenset(["About", "Support", "Main Menu", "Back", "Cancel", "Back to Services"])
+STATIC_CALLBACK_DATA = frozenset(['main_menu', 'code_links', *STATIC_CALLBACK_REPLIES])
+
+BUSY_MESSAGE = "The bot is very busy right now. Please try again in a minute."
+
+def admission_class(update, user_state=None) -> str:
+    """Admission class of an update; user_state is its sender's user_data, if any"""
+    user = update.effective_user if isinstance(update, Update) else None
+    if user is None:
+        return 'default'
+    if user.id in ADMIN_IDS:
+        return 'admin'
+    if user.id in user_sessions:
+        return 'code'
+    if user_state and any(key in user_state for key in MONEY_STATES):
+        return 'money'
+    if update.callback_query:
+        data = update.callback_query.data
+        if data in CODE_CALLBACK_DATA:
+            return 'code'
+        return 'static' if data in STATIC_CALLBACK_DATA else 'default'
+    text = update.message.text if update.message else None
+    if text in MONEY_TEXTS or (text and text.startswith("Buy ") and " - $" in text):
+        return 'money'
+    if text == "Get Code":
+        return 'code'
+    return 'static' if text in STATIC_TEXTS else 'default'
+
+def cached_reply(update):
+    """Reply text a static request gets without running its handler, or None"""
+    if update.callback_query:
+        return STATIC_CALLBACK_REPLIES.get(update.callback_query.data)
+    return STATIC_MESSAGE_REPLIES.get(update.message.text) if update.message else None
+
+class _Entry:
+    __slots__ = ('update', 'user_id', 'arrived', 'cls', 'admitted', 'held', 'running')
+
+    def __init__(self, update, user_id, arrived, admitted):
+        self.update = update
+        self.user_id = user_id
+        self.arrived = arrived
+        self.cls = 'default'
+        self.admitted = admitted
+        self.held = False
+        self.running = False
+
+class AdmissionController(BaseUpdateProcessor):
+    """Bounded per-class queues in front of a fixed number of handler slots"""
+
+    def __init__(self, workers: int = ADMISSION_WORKERS, queue_limits=ADMISSION_QUEUE_LIMITS,
+                 deadlines=ADMISSION_DEADLINES, target_delay: float = ADMISSION_TARGET_DELAY,
+                 interval: float = ADMISSION_INTERVAL, user_backlog: int = ADMISSION_USER_BACKLOG,
+                 notice_cooldown: float = ADMISSION_NOTICE_COOLDOWN, clock=time.monotonic):
+        # PTB's own semaphore must never be what holds an update back, so it covers everything held here
+        super().__init__((workers + sum(queue_limits.values())) * (1 + user_backlog))
+        self.workers = workers
+        self.queue_limits = queue_limits
+        self.deadlines = deadlines
+        self.target_delay = target_delay
+        self.interval = interval
+        self.user_backlog = user_backlog
+        self.notice_cooldown = notice_cooldown
+        self.clock = clock
+        self.user_data = {}
+        self._queues = {cls: deque() for cls in ADMISSION_CLASSES}
+        self._users = {}
+        self._running = 0
+        self._overloaded = False
+        self._interval_start = clock()
+        self._interval_min = float('inf')
+        self._noticed = OrderedDict()
+        self._closing = False
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def overloaded(self):
+        """True while queued updates keep waiting longer than the target delay"""
+        if self._overloaded:
+            return True
+        # Nothing leaves the queues while every slot is stuck, so look at the oldest waiting update too
+        if self._running < self.workers:
+            return False
+        oldest = min((queue[0].arrived for queue in self._queues.values() if queue), default=None)
+        return oldest is not None and self.clock() - oldest > self.target_delay
+
+    async def initialize(self):
+        self._closing = False
+
+    async def shutdown(self):
+        # Let the tasks of updates still queued finish without running their handlers
+        self._closing = True
+        for queue in self._queues.values():
+            while queue:
+                entry = queue.popleft()
+                if not entry.admitted.done():
+                    entry.admitted.set_result('shed')
+
+    async def do_process_update(self, update, coroutine):
+        entry = self._arrive(update)
+        outcome = 'shed'
+        try:
+            outcome = await entry.admitted
+            if outcome == 'processed':
+                await coroutine
+            else:
+                await self._answer_shed(entry, outcome)
+        finally:
+            if outcome != 'processed':
+                coroutine.close()
+            ADMISSION_UPDATES.labels(entry.cls, outcome).inc()
+            self._finish(entry)
+
+    def _arrive(self, update):
+        user = update.effective_user if isinstance(update, Update) else None
+        entry = _Entry(update, user.id if user else None, self.clock(), asyncio.get_running_loop().create_future())
+        if entry.user_id is not None:
+            backlog = self._users.get(entry.user_id)
+            if backlog is not None:
+                if len(backlog) > self.user_backlog:
+                    entry.cls = admission_class(update, self.user_data.get(entry.user_id))
+                    entry.admitted.set_result('shed')
+                    return entry
+                entry.held = True
+                backlog.append(entry)
+                return entry
+            entry.held = True
+            self._users[entry.user_id] = deque([entry])
+        self._enqueue(entry)
+        return entry
+
+    def _enqueue(self, entry):
+        entry.cls = cls = admission_class(entry.update, self.user_data.get(entry.user_id))
+        if cls == 'static' and self.overloaded and cached_reply(entry.update):
+            entry.admitted.set_result('degraded')
+            return
+        queue = self._queues[cls]
+        if self._closing or len(queue) >= self.queue_limits[cls]:
+            entry.admitted.set_result('shed')
+            return
+        queue.append(entry)
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._running < self.workers:
+            entry = next((queue.popleft() for queue in self._queues.values() if queue), None)
+            if entry is None:
+                return
+            if entry.admitted.done():
+                # Its task was cancelled while it waited
+                continue
+            now = self.clock()
+            waited = now - entry.arrived
+            self._track_delay(now, waited)
+            deadline = self.deadlines[entry.cls]
+            if deadline is not None and waited > deadline:
+                entry.admitted.set_result('degraded' if entry.cls == 'static' and cached_reply(entry.update) else 'expired')
+                continue
+            ADMISSION_WAIT_SECONDS.labels(entry.cls).observe(waited)
+            self._running += 1
+            entry.running = True
+            entry.admitted.set_result('processed')
+
+    def _track_delay(self, now, waited):
+        # CoDel-style: a queue is only overloaded if even its shortest wait over an interval was too long
+        self._interval_min = min(self._interval_min, waited)
+        if now - self._interval_start >= self.interval:
+            self._overloaded = self._interval_min > self.target_delay
+            self._interval_start = now
+            self._interval_min = float('inf')
+
+    def _finish(self, entry):
+        if entry.running:
+            self._running -= 1
+        if entry.held:
+            backlog = self._users[entry.user_id]
+            was_head = backlog[0] is entry
+            backlog.remove(entry)
+            if not backlog:
+                del self._users[entry.user_id]
+            elif was_head:
+                self._enqueue(backlog[0])
+        self._dispatch()
+
+    def _should_notify(self, user_id):
+        now = self.clock()
+        noticed = self._noticed
+        while noticed:
+            _, at = next(iter(noticed.items()))
+            if now - at < self.notice_cooldown:
+                break
+            noticed.popitem(last=False)
+        if user_id is None or user_id in noticed:
+            return False
+        noticed[user_id] = now
+        return True
+
+    async def _answer_shed(self, entry, outcome):
+        update = entry.update
+        try:
+            if outcome == 'degraded':
+                text = cached_reply(update)
+                if update.callback_query:
+                    await update.callback_query.answer()
+                    await update.callback_query.message.reply_text(text)
+                else:
+                    await update.message.reply_text(text)
+            elif self._should_notify(entry.user_id):
+                if update.callback_query:
+                    await update.callback_query.answer(BUSY_MESSAGE)
+                elif update.effective_message:
+                    await update.effective_message.reply_text(BUSY_MESSAGE)
+        except Exception as e:
+            logger.error(f"Failed to answer a {outcome} update from user {entry.user_id}: {e}")
+
+admission_controller = AdmissionController()
+register(GaugeFunc('bot_admission_queued', 'Updates waiting for a handler slot', lambda: len(admission_controller)))
+register(GaugeFunc('bot_admission_overloaded', '1 while static requests are served from cached replies',
+                   lambda: int(admission_controller.overloaded)))
@@ -0,0 +1,86 @@
+"""Sales and usage analytics kept as hourly and daily rollups.
+
+Events that already write to the database (deposit requests and
+decisions, sales, discounts, refunds, signups) add to stats_rollups in
+the same transaction. Events that do not, like the outcome of a Get Code
+session, are counted here in memory and written in one batch through the
+write coalescer every ANALYTICS_FLUSH_SECONDS. The Stats view then reads
+a bounded number of rollup rows, however much history there is.
+
+Metrics, with the dimension each is split by:
+  deposit_requests, deposits_approved, deposits_rejected  method; amount
+  sales, discounts, refunds                                service; orders, accounts, amount
+  signups                                                  direct or referral
+  code_sessions                                            service; sessions, sessions that got a code
+"""
+import asyncio
+import logging
+from config import ANALYTICS_FLUSH_SECONDS
+from coalescer import write_coalescer
+from database import record_rollups, rollup_hour
+from metrics import GaugeFunc, register
+
+logger = logging.getLogger(__name__)
+
+class StatsRecorder:
+    """In-memory rollup increments, flushed in batches"""
+
+    def __init__(self, flush_interval: float = ANALYTICS_FLUSH_SECONDS):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._task = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def record(self, metric: str, dimension: str = '', quantity: int = 0, amount_cents: int = 0):
+        """Count one event in the current hour"""
+        key = (rollup_hour(), metric, dimension)
+        totals = self._pending.get(key)
+        if totals is None:
+            totals = self._pending[key] = [0, 0, 0]
+        totals[0] += 1
+        totals[1] += quantity
+        totals[2] += amount_cents
+
+    def record_code_session(self, service_type: str, found: bool):
+        """Count a finished Get Code session and whether it produced a code"""
+        self.record('code_sessions', service_type, quantity=int(found))
+
+    def start(self):
+        """Start the periodic flush on the running loop"""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the periodic flush and write whatever is still pending"""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def flush(self):
+        """Write the pending increments in one batch; returns the number of rollup keys written"""
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            return await write_coalescer.submit(
+                record_rollups, [(*key, events, quantity, amount) for key, (events, quantity, amount) in pending.items()]
+            )
+        except Exception as e:
+            logger.error(f"Failed to write {len(pending)} analytics rollups: {e}")
+            # Keep them for the next flush, added to anything recorded since
+            for key, totals in pending.items():
+                current = self._pending.setdefault(key, [0, 0, 0])
+                for i, value in enumerate(totals):
+                    current[i] += value
+            return 0
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+stats_recorder = StatsRecorder()
+register(GaugeFunc('bot_analytics_pending_rollups', 'Analytics rollup increments not yet written to the database', lambda: len(stats_recorder)))
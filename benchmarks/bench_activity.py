@@ -0,0 +1,166 @@
+"""Activity tracking: last-seen writes per update vs. batched flushes, and segment counts with vs. without indexes.
+
+    python benchmarks/bench_activity.py --users 1000000 --updates 20000
+
+Writes. --updates updates from --active distinct users arrive with
+--concurrency in flight, and every update records its sender as seen.
+
+  per_update  one UPDATE transaction per update, in a worker thread
+  batched     ActivityTracker.touch per update, with the dirty map flushed
+              through the write coalescer every --flush-interval seconds
+
+Segments. The users table is filled with --users rows with spread-out
+last_seen, balance and blocked_at values. Each broadcast audience is
+then counted the way the preview counts it, with the partial indexes and
+again after dropping them. The query plan of each count is printed.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import coalescer
+import database
+from activity import ActivityTracker
+
+INDEXES = ('idx_users_last_seen', 'idx_users_balance', 'idx_users_blocked')
+
+
+@contextlib.contextmanager
+def count_transactions():
+    """Counts write transactions by wrapping db_transaction and db_execute"""
+    counter = {'transactions': 0}
+    transaction, execute = database.db_transaction, database.db_execute
+
+    def counted(func):
+        def wrapper(*args, **kwargs):
+            counter['transactions'] += 1
+            return func(*args, **kwargs)
+        return wrapper
+    database.db_transaction, database.db_execute = counted(transaction), counted(execute)
+    try:
+        yield counter
+    finally:
+        database.db_transaction, database.db_execute = transaction, execute
+
+
+async def writes(args, mode):
+    rng = random.Random(1)
+    senders = [rng.randrange(args.active) + 1 for _ in range(args.updates)]
+    slots = asyncio.Semaphore(args.concurrency)
+    tracker = ActivityTracker(args.flush_interval)
+
+    async def update(user_id):
+        async with slots:
+            if mode == 'per_update':
+                await asyncio.to_thread(database.db_execute, 'UPDATE users SET last_seen = CURRENT_TIMESTAMP WHERE user_id = ?',
+                                        (user_id,))
+            else:
+                tracker.touch(user_id)
+                # The rest of the handler's work yields to the loop at least once
+                await asyncio.sleep(0)
+
+    with count_transactions() as counter:
+        if mode == 'batched':
+            coalescer.write_coalescer.start()
+            tracker.start()
+        try:
+            started = time.perf_counter()
+            await asyncio.gather(*(update(user_id) for user_id in senders))
+            handled = time.perf_counter() - started
+            if mode == 'batched':
+                await tracker.stop()
+            elapsed = time.perf_counter() - started
+        finally:
+            if mode == 'batched':
+                await coalescer.write_coalescer.stop()
+    seen = database.db_execute('SELECT COUNT(*) FROM users WHERE user_id <= ? AND last_seen IS NOT NULL',
+                               (args.active,), fetchone=True)[0]
+    return {
+        'updates_per_s': round(args.updates / handled, 1),
+        'elapsed_s_including_final_flush': round(elapsed, 3),
+        'write_transactions': counter['transactions'],
+        'users_marked_seen': seen,
+    }
+
+
+def seed(count):
+    rng = random.Random(2)
+    conn = database.get_db_connection()
+    now = time.time()
+
+    def ts(age_days):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - age_days * 86400))
+
+    def rows():
+        for user_id in range(1, count + 1):
+            last_seen = ts(rng.expovariate(1 / 60))
+            balance = round(rng.uniform(1, 50), 2) if rng.random() < 0.1 else 0
+            blocked_at = ts(rng.uniform(0, 90)) if rng.random() < 0.05 else None
+            yield user_id, f'user{user_id}', balance, last_seen, blocked_at
+    conn.executemany('INSERT OR REPLACE INTO users (user_id, username, balance, last_seen, blocked_at) VALUES (?, ?, ?, ?, ?)',
+                     rows())
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+
+def segments(repeat):
+    results = {}
+    conn = database.get_db_connection()
+    for segment, condition in database.USER_SEGMENTS.items():
+        query = f'SELECT COUNT(*) FROM users WHERE blocked_at IS NULL {condition}'
+        plan = ' / '.join(row[-1] for row in conn.execute(f'EXPLAIN QUERY PLAN {query}'))
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            count = database.count_segment(segment)
+            timings.append(time.perf_counter() - started)
+        results[segment] = {'users': count, 'best_ms': round(min(timings) * 1000, 2), 'plan': plan}
+    started = time.perf_counter()
+    blocked = database.count_blocked_users()
+    results['blocked'] = {'users': blocked, 'ms': round((time.perf_counter() - started) * 1000, 2)}
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1_000_000, help='rows in the users table for the segment counts')
+    parser.add_argument('--updates', type=int, default=20_000)
+    parser.add_argument('--active', type=int, default=5_000, help='distinct users sending the updates')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--flush-interval', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {'updates': args.updates, 'active_users': args.active, 'users': args.users}
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        conn = database.get_db_connection()
+        conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)',
+                         ((user_id, f'user{user_id}') for user_id in range(1, args.active + 1)))
+        conn.commit()
+        conn.close()
+        for mode in ('per_update', 'batched'):
+            database.db_execute('UPDATE users SET last_seen = NULL')
+            results[mode] = asyncio.run(writes(args, mode))
+
+        seed(args.users)
+        results['indexed'] = segments(args.repeat)
+        for index in INDEXES:
+            database.db_execute(f'DROP INDEX {index}')
+        results['unindexed'] = segments(args.repeat)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
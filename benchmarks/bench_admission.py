@@ -0,0 +1,212 @@
+"""Goodput under overload: priority admission control vs. first-come-first-served.
+
+    python benchmarks/bench_admission.py --overload 10 --seconds 10 --workers 16
+
+Updates go through an update processor exactly as PTB's update fetcher
+sends them, against the fake transport with --transport-latency per Bot
+API call. Users arrive open-loop, each running one session:
+
+  money    10%  Deposit -> BKash -> 10, each step sent once the previous was answered
+  admin     1%  Pending Deposits, from the admin
+  code      9%  Get Code
+  default  30%  Balance
+  static   50%  About, Support or Main Menu
+
+The first phase measures capacity: a burst of sessions through a FIFO
+processor. The arrival rate is then set to --overload times that. Each
+processor then takes --seconds of arrivals plus up to --drain seconds to
+catch up:
+
+  fifo        PTB's SimpleUpdateProcessor with --workers slots, in arrival order
+  admission   admission.AdmissionController with --workers slots
+
+An update counts toward goodput if its handler ran and the answer came
+within --patience seconds of its arrival. Updates answered from a cached
+static reply count as good too. Per class the report gives offered,
+good, late (handled after --patience), shed (never handled) and the
+latency of the good ones.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram.ext import SimpleUpdateProcessor
+
+from harness import ADMIN_ID, BotHarness, seed_users
+
+from admission import AdmissionController
+from metrics import ADMISSION_UPDATES
+
+SESSIONS = [
+    ('money', 0.10, [('Deposit', 'BKash', '10')]),
+    ('admin', 0.01, [('Pending Deposits',)]),
+    ('code', 0.09, [('Get Code',)]),
+    ('default', 0.30, [('Balance',)]),
+    ('static', 0.50, [('About',), ('Support',), ('Main Menu',)]),
+]
+USER_START_ID = 10_000_000
+
+
+class Tally:
+    """Per-class outcome counts and good latencies"""
+
+    def __init__(self, patience):
+        self.patience = patience
+        self.classes = {}
+
+    def add(self, cls, ran, latency):
+        entry = self.classes.setdefault(cls, {'offered': 0, 'good': 0, 'late': 0, 'shed': 0, 'latencies': []})
+        entry['offered'] += 1
+        if not ran:
+            entry['shed'] += 1
+        elif latency > self.patience:
+            entry['late'] += 1
+        else:
+            entry['good'] += 1
+            entry['latencies'].append(latency)
+
+    def summary(self, seconds):
+        result = {}
+        for cls, entry in sorted(self.classes.items()):
+            latencies = sorted(entry.pop('latencies'))
+            if latencies:
+                entry['good_p50_ms'] = round(latencies[len(latencies) // 2] * 1000, 1)
+                entry['good_p99_ms'] = round(latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000, 1)
+            result[cls] = entry
+        result['goodput_per_s'] = round(sum(entry['good'] for entry in self.classes.values()) / seconds, 1)
+        return result
+
+
+class TrackedController(AdmissionController):
+    """AdmissionController that remembers which updates got a cached reply"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.degraded = set()
+
+    async def _answer_shed(self, entry, outcome):
+        if outcome == 'degraded':
+            self.degraded.add(entry.update.update_id)
+        await super()._answer_shed(entry, outcome)
+
+
+async def deliver(h, processor, update):
+    """Send one update through the processor; returns (handler ran or cached reply sent, latency)"""
+    ran = []
+
+    async def handle():
+        ran.append(True)
+        await h.app.process_update(update)
+
+    coroutine = handle()
+    started = time.perf_counter()
+    try:
+        await processor.process_update(update, coroutine)
+    finally:
+        # FIFO updates cancelled while waiting for a slot never started theirs
+        coroutine.close()
+    latency = time.perf_counter() - started
+    # A cached static reply is a full answer
+    return bool(ran) or update.update_id in getattr(processor, 'degraded', ()), latency
+
+
+async def session(h, processor, tally, cls, steps, user_id):
+    for text in steps:
+        ran, latency = await deliver(h, processor, h.updates.message(user_id, text))
+        tally.add(cls, ran, latency)
+        if not ran:
+            # The user was told to come back later
+            return
+
+
+def pick_session(rng, users):
+    roll = rng.random()
+    for cls, weight, choices in SESSIONS:
+        roll -= weight
+        if roll < 0:
+            break
+    user_id = ADMIN_ID if cls == 'admin' else next(users)
+    return cls, rng.choice(choices), user_id
+
+
+async def capacity(h, args, users):
+    rng = random.Random(1)
+    processor = SimpleUpdateProcessor(args.workers)
+    tally = Tally(float('inf'))
+    started = time.perf_counter()
+    await asyncio.gather(*(session(h, processor, tally, *pick_session(rng, users)) for _ in range(args.calibrate)))
+    elapsed = time.perf_counter() - started
+    return sum(entry['offered'] for entry in tally.classes.values()) / elapsed
+
+
+async def run_mode(h, args, mode, rate, users):
+    rng = random.Random(2)
+    if mode == 'fifo':
+        processor = SimpleUpdateProcessor(args.workers)
+    else:
+        processor = TrackedController(workers=args.workers)
+        processor.user_data = h.app.user_data
+    outcomes = {key: child.value for key, child in ADMISSION_UPDATES._children.items()}
+    tally = Tally(args.patience)
+    tasks = []
+    tick = 0.01
+    carry = 0.0
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.seconds:
+        # Updates per session average about 1.2, so sessions arrive a little slower than updates
+        carry += rate / 1.2 * tick
+        while carry >= 1:
+            carry -= 1
+            tasks.append(asyncio.create_task(session(h, processor, tally, *pick_session(rng, users))))
+        await asyncio.sleep(tick)
+    done, pending = await asyncio.wait(tasks, timeout=args.drain)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    result = tally.summary(time.perf_counter() - started)
+    result['unfinished_sessions'] = len(pending)
+    if mode == 'admission':
+        result['controller_outcomes'] = {'/'.join(key): child.value - outcomes[key]
+                                         for key, child in ADMISSION_UPDATES._children.items()
+                                         if child.value > outcomes[key]}
+    return result
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        async with BotHarness(tmp, transport_latency=args.transport_latency) as h:
+            seed_users(args.users, USER_START_ID)
+            users = itertools.cycle(range(USER_START_ID, USER_START_ID + args.users))
+            cap = await capacity(h, args, users)
+            rate = cap * args.overload
+            results = {'capacity_updates_per_s': round(cap, 1), 'offered_updates_per_s': round(rate, 1)}
+            for mode in args.modes.split(','):
+                results[mode] = await run_mode(h, args, mode, rate, users)
+            return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--overload', type=float, default=10.0)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--drain', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--patience', type=float, default=5.0)
+    parser.add_argument('--transport-latency', type=float, default=0.02)
+    parser.add_argument('--calibrate', type=int, default=2000, help='sessions in the capacity burst')
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--modes', default='fifo,admission')
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""End-to-end benchmarks of the bot's hot paths, emitted as JSON for comparison across commits.
+
+    python benchmarks/bench_bot.py                       # every scenario, default sizes
+    python benchmarks/bench_bot.py --scenarios start_burst,broadcast --broadcast-users 100000
+    python benchmarks/bench_bot.py --inventory-rows 10000,100000,1000000 --output bench.json
+
+Scenarios:
+    start_burst      N new users send /start
+    menu_navigation  N users walk the main menus (including a service page with its stock count)
+    code_fetch       N users fetch a Hotmail and a Gmail code from a local mock of the hsmail API
+    deposits         N users file a deposit, then the admin approves them in bulk
+    purchases        N funded users buy --purchase-quantity Hotmail accounts each (charge, reserve, delivery)
+    broadcast        the admin broadcasts one message to --broadcast-users seeded users
+    inventory        get_stock_count / reserve_stock of 10 accounts per inventory size
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import ADMIN_ID, BotHarness, MockCodeAPI, generate_inventory, git_commit, seed_users, summarize
+
+import config
+import database
+import utils
+from workers import drain_file_jobs
+
+MENU_PATH = ['/start', 'Buy Accounts', 'Hotmail', 'Back to Services', 'Get Code', 'Balance',
+             'Special Offers', 'Support', 'About', 'Main Menu']
+
+
+async def start_burst(h, args):
+    users = range(1, args.users + 1)
+    return summarize(*await h.run_sessions([lambda uid=uid: [h.updates.message(uid, '/start')] for uid in users],
+                                           args.concurrency))
+
+
+async def menu_navigation(h, args):
+    users = range(100_001, 100_001 + args.users)
+    return summarize(*await h.run_sessions(
+        [lambda uid=uid: (h.updates.message(uid, text) for text in MENU_PATH) for uid in users], args.concurrency))
+
+
+async def code_fetch(h, args):
+    api = MockCodeAPI(latency=args.api_latency)
+    await api.start()
+    try:
+        users = range(200_001, 200_001 + args.users)
+
+        def steps(uid):
+            yield h.updates.callback(uid, 'get_hotmail_code')
+            yield h.updates.message(uid, f'user{uid}@hotmail.com|secret|token|client')
+            yield h.updates.callback(uid, 'get_gmail_code')
+            yield h.updates.message(uid, f'user{uid}@gmail.com')
+
+        result = summarize(*await h.run_sessions([lambda uid=uid: steps(uid) for uid in users], args.concurrency))
+        result['api_requests'] = api.requests
+        return result
+    finally:
+        await api.stop()
+
+
+async def deposits(h, args):
+    users = range(300_001, 300_001 + args.users)
+
+    def steps(uid):
+        for text in ('/start', 'Deposit', 'BKash', '100', f'TXN{uid}'):
+            yield h.updates.message(uid, text)
+
+    result = summarize(*await h.run_sessions([lambda uid=uid: steps(uid) for uid in users], args.concurrency))
+    ids = [row[0] for row in database.db_execute("SELECT id FROM deposit_requests WHERE status = 'pending'", fetchall=True)]
+    start = time.perf_counter()
+    for i in range(0, len(ids), 50):
+        await h.process(h.updates.message(ADMIN_ID, '/approve ' + ' '.join(map(str, ids[i:i + 50]))))
+    result['approve_elapsed_s'] = round(time.perf_counter() - start, 4)
+    result['approved'] = database.db_execute("SELECT COUNT(*) FROM deposit_requests WHERE status = 'approved'",
+                                             fetchone=True)[0]
+    return result
+
+
+async def purchases(h, args):
+    users = range(400_001, 400_001 + args.users)
+    generate_inventory(config.SERVICE_FILES['hotmail'], args.users * args.purchase_quantity)
+    seed_users(args.users, start_id=users[0])
+    price = database.get_price('hotmail')
+    database.apply_balance_changes([(uid, database.to_cents(price * args.purchase_quantity), 'bench', None) for uid in users])
+
+    def steps(uid):
+        yield h.updates.message(uid, f'Buy Hotmail - ${price}')
+        yield h.updates.message(uid, str(args.purchase_quantity))
+
+    result = summarize(*await h.run_sessions([lambda uid=uid: steps(uid) for uid in users], args.concurrency))
+    result['delivered'] = database.db_execute("SELECT COUNT(*) FROM purchases WHERE status = 'delivered'",
+                                              fetchone=True)[0]
+    result['documents_sent'] = h.request.calls['sendDocument']
+    # Selling out starts a workbook rewrite on the file pool; let it finish before the work directory goes
+    await asyncio.to_thread(drain_file_jobs)
+    result['stock_left'] = utils.get_stock_count('hotmail')
+    return result
+
+
+async def broadcast(h, args):
+    seed_users(args.broadcast_users)
+    await h.process(h.updates.message(ADMIN_ID, '/start'))
+    await h.process(h.updates.message(ADMIN_ID, 'Broadcast'))
+    await h.process(h.updates.message(ADMIN_ID, 'Benchmark broadcast'))
+    sent_before = h.request.calls['sendMessage']
+    start = time.perf_counter()
+    await h.process(h.updates.message(ADMIN_ID, 'Confirm Broadcast'))
+    elapsed = time.perf_counter() - start
+    sent = h.request.calls['sendMessage'] - sent_before
+    return {'recipients': args.broadcast_users, 'send_calls': sent, 'elapsed_s': round(elapsed, 4),
+            'messages_per_s': round(sent / elapsed, 1) if elapsed else None}
+
+
+async def inventory(h, args):
+    results = {}
+    filename = config.SERVICE_FILES['hotmail']
+    for rows in args.inventory_rows:
+        start = time.perf_counter()
+        generate_inventory(filename, rows)
+        generate_s = time.perf_counter() - start
+        timings = {'generate_s': round(generate_s, 3)}
+        for name, func in (('get_stock_count', lambda: utils.get_stock_count('hotmail')),
+                           ('reserve_stock_10', lambda: list(utils.reserve_stock('hotmail', 10).chunks(10)))):
+            start = time.perf_counter()
+            func()
+            timings[f'{name}_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        results[str(rows)] = timings
+    return results
+
+
+SCENARIOS = {
+    'start_burst': start_burst,
+    'menu_navigation': menu_navigation,
+    'code_fetch': code_fetch,
+    'deposits': deposits,
+    'purchases': purchases,
+    'broadcast': broadcast,
+    'inventory': inventory,
+}
+
+
+async def run(args):
+    results = {}
+    for name in args.scenarios:
+        with tempfile.TemporaryDirectory() as tmp:
+            async with BotHarness(tmp, transport_latency=args.transport_latency) as h:
+                results[name] = await SCENARIOS[name](h, args)
+        print(f'{name}: done', file=sys.stderr)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--broadcast-users', type=int, default=100_000)
+    parser.add_argument('--inventory-rows', default='10000,100000')
+    parser.add_argument('--purchase-quantity', type=int, default=5)
+    parser.add_argument('--transport-latency', type=float, default=0.0, help='seconds added to every Bot API call')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='seconds added to every mock API call')
+    parser.add_argument('--output')
+    args = parser.parse_args()
+    args.scenarios = [s for s in args.scenarios.split(',') if s]
+    args.inventory_rows = [int(n) for n in args.inventory_rows.split(',') if n]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    report = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'params': {k: v for k, v in vars(args).items() if k != 'output'},
+        'scenarios': asyncio.run(run(args)),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""Thousands of users waiting for a code: one polling loop per watcher vs. the shared code watch scheduler.
+
+    python benchmarks/bench_code_watch.py --watchers 2000 --arrival 60
+
+Each watcher's code shows up at a random time within --arrival seconds.
+Until then the mock code API answers without a code. Reported per mode:
+upstream requests (total and peak per second), how long after a code
+appeared it reached the user, and the peak number of asyncio tasks.
+
+  per_user  one task per watcher, polling every --interval seconds, as a naive watch mode would
+  shared    CodeWatchScheduler with the configured backoff, request budget (or --rate) and concurrency cap
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from harness import MockCodeAPI, summarize
+
+import handlers
+from code_watch import CodeWatchScheduler
+from utils import fetch_code_from_api
+
+
+class RecordingBot:
+    """Stands in for the bot: records when each user was sent their result"""
+
+    def __init__(self):
+        self.delivered = {}
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        self.delivered[chat_id] = asyncio.get_running_loop().time()
+
+
+class RequestMeter:
+    """Wraps the mock API handler to count requests per second"""
+
+    def __init__(self, api):
+        self.per_second = Counter()
+        handle = api._handle
+
+        async def counted(request):
+            self.per_second[int(time.monotonic())] += 1
+            return await handle(request)
+        api._handle = counted
+
+
+async def per_user(api, bot, watchers, args):
+    import aiohttp
+    async with aiohttp.ClientSession() as session:
+        async def poll(user_id, email, expires_at):
+            loop = asyncio.get_running_loop()
+            while loop.time() < expires_at:
+                code, _ = await fetch_code_from_api(handlers.GMAIL_API_URL, {'email': email}, session=session)
+                if code:
+                    await bot.send_message(user_id, code)
+                    return
+                await asyncio.sleep(args.interval)
+
+        expires_at = asyncio.get_running_loop().time() + args.ttl
+        await asyncio.gather(*(poll(user_id, email, expires_at) for user_id, email in watchers))
+
+
+async def shared(api, bot, watchers, args):
+    scheduler = CodeWatchScheduler(rate=args.rate) if args.rate else CodeWatchScheduler()
+    scheduler.start(bot)
+    try:
+        for user_id, email in watchers:
+            scheduler.watch(user_id, 'gmail', handlers.GMAIL_API_URL, {'email': email}, email, '{code}', args.ttl)
+        while len(scheduler):
+            await asyncio.sleep(0.1)
+    finally:
+        await scheduler.stop()
+
+
+async def run(args, mode):
+    api = MockCodeAPI(latency=args.api_latency)
+    meter = RequestMeter(api)
+    await api.start()
+    try:
+        loop = asyncio.get_running_loop()
+        rng = random.Random(1)
+        bot = RecordingBot()
+        watchers = [(user_id, f'watch{user_id}@gmail.com') for user_id in range(1, args.watchers + 1)]
+        started = loop.time()
+        appears = {}
+        for user_id, email in watchers:
+            appears[user_id] = api.code_times[email] = started + rng.uniform(0, args.arrival)
+
+        peak_tasks = 0
+
+        async def sample_tasks():
+            nonlocal peak_tasks
+            while True:
+                peak_tasks = max(peak_tasks, len(asyncio.all_tasks()))
+                await asyncio.sleep(0.5)
+
+        sampler = asyncio.create_task(sample_tasks())
+        await (per_user if mode == 'per_user' else shared)(api, bot, watchers, args)
+        elapsed = loop.time() - started
+        sampler.cancel()
+
+        delays = [bot.delivered[user_id] - appears[user_id] for user_id in bot.delivered]
+        delivery = summarize(delays, elapsed)
+        delivery.pop('updates_per_s')
+        return {
+            'delivered': f'{len(bot.delivered)}/{args.watchers}',
+            'delivery_delay': delivery,
+            'upstream_requests': api.requests,
+            'upstream_peak_per_s': max(meter.per_second.values(), default=0),
+            'peak_tasks': peak_tasks,
+        }
+    finally:
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--watchers', type=int, default=2000)
+    parser.add_argument('--arrival', type=float, default=60, help='codes appear uniformly within this many seconds')
+    parser.add_argument('--ttl', type=float, default=600, help='watch lifetime in seconds')
+    parser.add_argument('--interval', type=float, default=5, help='poll interval of the per-user mode')
+    parser.add_argument('--rate', type=float, help='request budget of the shared mode (default: config)')
+    parser.add_argument('--api-latency', type=float, default=0.02)
+    parser.add_argument('--modes', default='per_user,shared')
+    args = parser.parse_args()
+
+    results = {'watchers': args.watchers, 'arrival_s': args.arrival}
+    for mode in args.modes.split(','):
+        results[mode] = asyncio.run(run(args, mode))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
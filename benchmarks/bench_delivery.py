@@ -0,0 +1,98 @@
+"""Peak memory of purchase delivery: materialized download file vs. the streaming delivery pipeline.
+
+    python benchmarks/bench_delivery.py --orders 1000,10000,100000 --part-mb 1
+
+The stock is a generated text stock file. The "materialized" path is the
+old one, kept here: decode every row of the order, then write them all
+into one spooled download file. The streaming path is
+reserve_stock + delivery.deliver_accounts, feeding a fake bot that reads
+and discards each part. Both peaks are measured with tracemalloc.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+import utils
+from delivery import deliver_accounts
+from stockfile import get_stock_file, write_stock_file
+
+
+class DiscardingBot:
+    def __init__(self):
+        self.parts = 0
+        self.bytes = 0
+
+    async def send_document(self, chat_id, document, filename=None, caption=None):
+        self.parts += 1
+        self.bytes += len(document)
+
+
+def materialized_download(service_key, quantity):
+    rows = get_stock_file(service_key).peek(quantity)
+    download = tempfile.SpooledTemporaryFile(max_size=config.DOWNLOAD_SPOOL_MAX_BYTES, mode='w+b')
+    download.write(utils.format_account_lines(rows))
+    download.close()
+
+
+def measure(func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(peak / 1024 / 1024, 2), round(elapsed, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', default='1000,10000,100000')
+    parser.add_argument('--part-mb', type=float, default=1.0)
+    parser.add_argument('--format', default='txt', choices=['txt', 'zip'])
+    args = parser.parse_args()
+    orders = [int(n) for n in args.orders.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.STOCK_TEXT_FILES['hotmail'] = os.path.join(tmp, 'hotmail.txt')
+        utils.STOCK_FORMAT = 'text'
+        write_stock_file(config.STOCK_TEXT_FILES['hotmail'], utils.SERVICE_HEADERS['hotmail'], (
+            (f'acct{i}@hotmail.com', f'pw{i:08d}', f'recovery{i}@mail.com', f'+1555{i:07d}') for i in range(2 * sum(orders))
+        ))
+
+        results = []
+        for quantity in orders:
+            def materialized():
+                materialized_download('hotmail', quantity)
+
+            bot = DiscardingBot()
+
+            def streaming():
+                reserved = utils.reserve_stock('hotmail', quantity)
+                asyncio.run(deliver_accounts(bot, 1, 'hotmail', reserved, quantity, fmt=args.format,
+                                             part_max_bytes=int(args.part_mb * 1024 * 1024)))
+
+            materialized_peak, materialized_s = measure(materialized)
+            streaming_peak, streaming_s = measure(streaming)
+            results.append({
+                'quantity': quantity,
+                'materialized_peak_mb': materialized_peak,
+                'materialized_s': materialized_s,
+                'streaming_peak_mb': streaming_peak,
+                'streaming_s': streaming_s,
+                'parts': bot.parts,
+                'delivered_mb': round(bot.bytes / 1024 / 1024, 2),
+            })
+
+    print(json.dumps({'format': args.format, 'part_mb': args.part_mb, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Inventory memory footprint and purchase cost: tuple lists vs. the packed inventory cache.
+
+    python benchmarks/bench_inventory.py --accounts 1000000 --purchase 10
+
+Memory is measured with tracemalloc as the bytes still allocated after
+each structure is built. The tuple list is the list of row tuples the
+old workbook reader returned for a whole sheet. "pop" compares the
+list rebuild the old purchase path did (header plus every row after
+the sold ones) with PackedInventory.pop.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from inventory import PackedInventory
+
+HEADER = ('Email', 'Password', 'Recovery Email', 'Phone')
+
+
+def make_rows(count):
+    return [HEADER] + [
+        (f'acct{i}@hotmail.com', f'pw{i:08d}', f'recovery{i}@mail.com', f'+1555{i:07d}') for i in range(count)
+    ]
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=1_000_000)
+    parser.add_argument('--purchase', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    mb = 1024 * 1024
+
+    rows, rows_bytes, _ = measure(lambda: make_rows(args.accounts))
+    packed, packed_bytes, packed_peak = measure(lambda: PackedInventory.from_rows(rows))
+
+    started = time.perf_counter()
+    data = rows
+    for _ in range(args.rounds):
+        data = [data[0]] + data[args.purchase + 1:]
+    list_pop = (time.perf_counter() - started) / args.rounds
+    del data
+
+    started = time.perf_counter()
+    for _ in range(args.rounds):
+        packed.pop(args.purchase)
+    packed_pop = (time.perf_counter() - started) / args.rounds
+
+    print(json.dumps({
+        'accounts': args.accounts,
+        'tuple_list_mb': round(rows_bytes / mb, 1),
+        'packed_mb': round(packed_bytes / mb, 1),
+        'packed_build_peak_mb': round(packed_peak / mb, 1),
+        'packed_nbytes_mb': round(packed.nbytes() / mb, 1),
+        'memory_ratio': round(rows_bytes / packed_bytes, 1),
+        'pop_list_ms': round(list_pop * 1000, 3),
+        'pop_packed_ms': round(packed_pop * 1000, 3),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Join burst: /start throughput with one commit per write vs. the group-commit write coalescer.
+
+    python benchmarks/bench_joins.py --joins 2000 --referral-share 0.5 --concurrency 200
+
+--joins new users send /start at once, and --referral-share of them
+arrive through a referral link. Three modes are compared:
+
+  legacy     the previous path, kept here: an INSERT OR IGNORE plus the
+             referral updates, up to three commits per join, run inline on
+             the event loop
+  unbatched  register_user as one transaction per join (coalescer not started)
+  coalesced  register_user through the started write coalescer
+
+Every mode then checks that each referrer's total matches the joins it referred.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from harness import BotHarness, seed_users, summarize
+
+import coalescer
+import database
+import handlers
+import ratelimit
+import utils
+
+REFERRERS = 20
+REFERRER_START_ID = 500_000
+JOIN_START_ID = 1_000_000
+
+
+def seed_referrers():
+    seed_users(REFERRERS, REFERRER_START_ID)
+    return [utils.get_or_create_referral_code(uid) for uid in range(REFERRER_START_ID, REFERRER_START_ID + REFERRERS)]
+
+
+def check_referrals(expected):
+    rows = database.db_execute('SELECT SUM(total_referrals) FROM users WHERE user_id BETWEEN ? AND ?',
+                               (REFERRER_START_ID, REFERRER_START_ID + REFERRERS), fetchone=True)
+    return (rows[0] or 0) == expected
+
+
+async def legacy_register(_func, user_id, username, referral_code=None):
+    database.db_execute('INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)', (user_id, username))
+    if referral_code:
+        referrer = database.db_execute('SELECT user_id FROM users WHERE referral_code = ?', (referral_code,), fetchone=True)
+        if referrer:
+            database.db_execute('UPDATE users SET total_referrals = total_referrals + 1 WHERE user_id = ?', (referrer[0],))
+            database.db_execute('UPDATE users SET referred_by = ? WHERE user_id = ?', (referrer[0], user_id))
+
+
+async def run(args, mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        async with BotHarness(tmp) as h:
+            ratelimit.limiter = ratelimit.TokenBucketLimiter()
+            codes = seed_referrers()
+            writer = coalescer.WriteCoalescer()
+            handlers.write_coalescer = writer
+            if mode == 'coalesced':
+                writer.start()
+            elif mode == 'legacy':
+                writer.submit = legacy_register
+            referred = int(args.joins * args.referral_share)
+            updates = []
+            for i in range(args.joins):
+                uid = JOIN_START_ID + i
+                text = f'/start {codes[i % REFERRERS]}' if i < referred else '/start'
+                updates.append(h.updates.message(uid, text))
+
+            semaphore = asyncio.Semaphore(args.concurrency)
+            latencies = []
+
+            async def join(update):
+                async with semaphore:
+                    latencies.append(await h.process(update))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(join(update) for update in updates))
+            elapsed = time.perf_counter() - started
+            await writer.stop()
+
+            # Replay the referral joins: a repeated /start must not count twice
+            for update in updates[:referred]:
+                await h.process(h.updates.message(update.effective_user.id, update.message.text))
+            await writer.stop()
+            result = summarize(latencies, elapsed)
+            result['joins_per_s'] = result.pop('updates_per_s')
+            result['referrals_consistent'] = check_referrals(referred)
+            return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--joins', type=int, default=2000)
+    parser.add_argument('--referral-share', type=float, default=0.5)
+    parser.add_argument('--concurrency', type=int, default=200, help='joins in flight at once')
+    parser.add_argument('--modes', default='legacy,unbatched,coalesced')
+    args = parser.parse_args()
+
+    original = handlers.write_coalescer
+    results = {'joins': args.joins, 'referral_share': args.referral_share}
+    try:
+        for mode in args.modes.split(','):
+            results[mode] = asyncio.run(run(args, mode))
+    finally:
+        handlers.write_coalescer = original
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Balance ledger write throughput: one transaction per entry vs. LedgerWriter posts group-committed by the write coalescer.
+
+    python benchmarks/bench_ledger_writes.py --entries 5000 --users 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import database
+from harness import seed_users
+from coalescer import write_coalescer
+from ledger import LedgerWriter
+
+
+async def run_group_commit(entries):
+    writer = LedgerWriter()
+    write_coalescer.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(writer.post(user_id, amount, 'bench') for user_id, amount in entries))
+    elapsed = time.perf_counter() - started
+    await write_coalescer.stop()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entries', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=500)
+    args = parser.parse_args()
+
+    entries = [(random.randint(1, args.users), random.randint(-500, 5000) / 100) for _ in range(args.entries)]
+    results = {'entries': args.entries, 'users': args.users}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'ledger.db')
+        database.init_db()
+        seed_users(args.users, 1)
+
+        started = time.perf_counter()
+        for user_id, amount in entries:
+            database.update_user_balance(user_id, amount, 'bench')
+        elapsed = time.perf_counter() - started
+        results['per_entry_commit'] = {'elapsed_s': round(elapsed, 4), 'entries_per_s': round(args.entries / elapsed, 1)}
+
+        elapsed = asyncio.run(run_group_commit(entries))
+        results['group_commit'] = {'elapsed_s': round(elapsed, 4), 'entries_per_s': round(args.entries / elapsed, 1)}
+
+        results['snapshots_taken'] = database.take_balance_snapshots()
+        started = time.perf_counter()
+        mismatches = database.reconcile_ledger()
+        results['reconcile_s'] = round(time.perf_counter() - started, 4)
+        results['mismatches'] = mismatches[:10]
+
+        expected = {}
+        for user_id, amount in entries:
+            expected[user_id] = expected.get(user_id, 0) + 2 * database.to_cents(amount)
+        results['balances_exact'] = all(database.get_balance_cents(u) == c for u, c in expected.items())
+
+    print(json.dumps(results, indent=2))
+    return 0 if results['balances_exact'] and not mismatches else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
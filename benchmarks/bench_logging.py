@@ -0,0 +1,76 @@
+"""Handler latency with logging off, with synchronous file logging, and with the queue pipeline.
+
+Runs the code_fetch scenario (the chattiest hot path) through the harness.
+The "sync" mode reproduces the old setup: a FileHandler on the root logger
+writing on the event loop, with no sampling. "queue" and "queue_sampled"
+use logging_setup.setup_logging(); records are redacted and written by the
+listener thread. Every event is kept in "queue" and config.LOG_SAMPLE_RATES
+applies in "queue_sampled".
+
+    python benchmarks/bench_logging.py --users 500 --api-latency 0.005
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from harness import BotHarness, git_commit
+from bench_bot import code_fetch
+
+import config
+import logging_setup
+
+
+def configure(mode, log_path):
+    root = logging.getLogger()
+    logging_setup.stop_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    logging.disable(logging.NOTSET)
+    if mode == 'off':
+        logging.disable(logging.CRITICAL)
+    elif mode == 'sync':
+        handler = logging.FileHandler(log_path)
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+    else:
+        rates = config.LOG_SAMPLE_RATES if mode == 'queue_sampled' else None
+        logging_setup.setup_logging(logging.INFO, 'json', rates, stream=open(log_path, 'a'))
+
+
+async def run_mode(mode, args, workdir):
+    log_path = os.path.join(workdir, f'{mode}.log')
+    configure(mode, log_path)
+    async with BotHarness(workdir) as h:
+        result = await code_fetch(h, args)
+    logging_setup.stop_logging()
+    result['log_bytes'] = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--api-latency', type=float, default=0.0)
+    parser.add_argument('--modes', default='off,sync,queue,queue_sampled')
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes.split(','):
+        with tempfile.TemporaryDirectory() as tmp:
+            results[mode] = asyncio.run(run_mode(mode, args, tmp))
+    logging.disable(logging.CRITICAL)
+    print(json.dumps({'commit': git_commit(), 'scenario': 'code_fetch', 'users': args.users, 'modes': results},
+                     indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Event-loop watchdog: what it costs and what it catches.
+
+    python benchmarks/bench_loop_monitor.py --load-users 100 --phase-seconds 5
+
+--load-users users keep tapping Balance, Buy Accounts and Deposit in
+each phase:
+
+  off      no monitor, the baseline
+  on       loop_monitor.LoopMonitor running with its default interval
+  blocked  the monitor running while an admin sends /block every second.
+           /block is a @timed handler that calls time.sleep(--block-seconds)
+           on the loop, like a synchronous workbook or database call would
+
+Each phase reports handler latency percentiles and throughput. For
+'blocked' it also reports the stalls the monitor caught, the labels they
+were counted under, and whether the captured stack shows the sleeping
+handler.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram.ext import CommandHandler
+
+from harness import ADMIN_ID, BotHarness, summarize
+
+import loop_monitor
+from metrics import LOOP_LAG_SECONDS, LOOP_STALLS, timed
+
+LOAD_START_ID = 5_000_000
+TAPS = ('Balance', 'Buy Accounts', 'Deposit', 'Main Menu')
+
+
+class StackCatcher:
+    """Keeps the stacks the monitor logs"""
+
+    def __init__(self):
+        self.stacks = []
+
+    def warning(self, message):
+        self.stacks.append(message)
+
+
+def add_block_handler(h, seconds):
+    @timed('bench_block')
+    async def block(update, context):
+        time.sleep(seconds)
+    h.app.add_handler(CommandHandler('block', block))
+
+
+async def run_phase(h, args, mode):
+    latencies = []
+    stop = asyncio.Event()
+
+    async def user(uid):
+        rng = random.Random(uid)
+        while not stop.is_set():
+            latencies.append(await h.process(h.updates.message(uid, rng.choice(TAPS))))
+            await asyncio.sleep(args.interval)
+
+    async def admin():
+        while not stop.is_set():
+            await h.process(h.updates.message(ADMIN_ID, '/block'))
+            await asyncio.sleep(1)
+
+    monitor = loop_monitor.LoopMonitor() if mode != 'off' else None
+    catcher = StackCatcher()
+    logger, loop_monitor.logger = loop_monitor.logger, catcher
+    lag_before = LOOP_LAG_SECONDS._default.count
+    if monitor:
+        monitor.start()
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(user(uid)) for uid in range(LOAD_START_ID, LOAD_START_ID + args.load_users)]
+    if mode == 'blocked':
+        tasks.append(asyncio.create_task(admin()))
+    try:
+        await asyncio.sleep(args.phase_seconds)
+    finally:
+        stop.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        # Let the last stall be reported
+        await asyncio.sleep(0.3)
+        if monitor:
+            await monitor.stop()
+        loop_monitor.logger = logger
+    result = summarize(latencies, elapsed)
+    if monitor:
+        result['lag_samples'] = LOOP_LAG_SECONDS._default.count - lag_before
+        result['stalls'] = monitor.stalls
+    if mode == 'blocked':
+        result['stall_labels'] = {'/'.join(key): child.value for key, child in LOOP_STALLS._children.items()}
+        result['stack_shows_handler'] = sum('in block' in stack and 'time.sleep' in stack for stack in catcher.stacks)
+    return result
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        async with BotHarness(tmp) as h:
+            add_block_handler(h, args.block_seconds)
+            for uid in range(LOAD_START_ID, LOAD_START_ID + args.load_users):
+                await h.process(h.updates.message(uid, '/start'))
+            return {mode: await run_phase(h, args, mode) for mode in args.phases.split(',')}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load-users', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between taps per load user')
+    parser.add_argument('--phase-seconds', type=float, default=5.0)
+    parser.add_argument('--block-seconds', type=float, default=0.5)
+    parser.add_argument('--phases', default='off,on,blocked')
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Handler latency while backups and database maintenance run.
+
+    python benchmarks/bench_maintenance.py --users 200000 --deposits 300000 --load-users 50
+
+The database is filled with --users users (with ledger entries) and
+--deposits settled deposits from the past year. --load-users users then
+keep tapping Balance, submitting deposits and new users keep joining,
+while one job runs per phase:
+
+  idle              no maintenance, the baseline
+  backup            maintenance.run_backup on a worker thread: page steps from a pinned snapshot
+  backup_one_step   the whole database copied in one backup step on the event loop, as a naive job would
+  housekeeping      maintenance.run_housekeeping on a worker thread: archive, incremental vacuum, optimize
+
+Each phase reports handler latency percentiles and how long the job took.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from harness import BotHarness, summarize
+
+import database
+import maintenance
+
+LOAD_START_ID = 5_000_000
+JOIN_START_ID = 6_000_000
+
+
+def seed(args):
+    rng = random.Random(4)
+    now = time.time()
+
+    def old_ts():
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.uniform(100, 365) * 86400))
+
+    conn = database.get_db_connection()
+    conn.executemany('INSERT INTO users (user_id, username, balance) VALUES (?, ?, 10)',
+                     ((uid, f'user{uid}') for uid in range(1, args.users + 1)))
+    conn.executemany('INSERT INTO balance_ledger (user_id, delta_cents, balance_cents, reason) VALUES (?, 1000, 1000, ?)',
+                     ((uid, 'opening') for uid in range(1, args.users + 1)))
+    conn.executemany('INSERT INTO deposit_requests (user_id, amount, method, transaction_id, status, created_at) '
+                     'VALUES (?, ?, ?, ?, ?, ?)',
+                     ((rng.randrange(args.users) + 1, rng.randint(5, 500), 'BKash', f'TX{i:012d}',
+                       rng.choice(('approved', 'rejected')), old_ts()) for i in range(args.deposits)))
+    conn.executemany('INSERT INTO broadcast_messages (admin_id, message_text, sent_count, created_at) VALUES (1, ?, 100, ?)',
+                     ((f'Broadcast {i} ' + 'x' * 500, old_ts()) for i in range(2000)))
+    conn.commit()
+    conn.close()
+
+
+def backup_one_step(dest_dir):
+    src = database.get_db_connection()
+    dst = sqlite3.connect(os.path.join(dest_dir, 'one_step.db'))
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+async def run_phase(h, args, job, joins):
+    latencies = []
+    stop = asyncio.Event()
+
+    async def user(uid):
+        rng = random.Random(uid)
+        await asyncio.sleep(rng.uniform(0, args.interval))
+        while not stop.is_set():
+            roll = rng.random()
+            if roll < 0.1:
+                latencies.append(await h.process(h.updates.message(next(joins), '/start')))
+            elif roll < 0.2:
+                for text in ('Deposit', 'BKash', '10'):
+                    latencies.append(await h.process(h.updates.message(uid, text)))
+            else:
+                latencies.append(await h.process(h.updates.message(uid, 'Balance')))
+            await asyncio.sleep(args.interval)
+
+    users = [asyncio.create_task(user(uid)) for uid in range(LOAD_START_ID, LOAD_START_ID + args.load_users)]
+    started = time.perf_counter()
+    job_seconds = None
+    try:
+        if job is None:
+            await asyncio.sleep(args.phase_seconds)
+        else:
+            await job()
+            job_seconds = round(time.perf_counter() - started, 3)
+            # Keep measuring for at least the minimum phase length
+            await asyncio.sleep(max(0.0, args.phase_seconds - (time.perf_counter() - started)))
+    finally:
+        stop.set()
+        await asyncio.gather(*users)
+    result = summarize(latencies, time.perf_counter() - started)
+    result['job_s'] = job_seconds
+    return result
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        async with BotHarness(tmp) as h:
+            seed(args)
+            for uid in range(LOAD_START_ID, LOAD_START_ID + args.load_users):
+                await h.process(h.updates.message(uid, '/start'))
+            joins = itertools.count(JOIN_START_ID)
+            backup_dir = os.path.join(tmp, 'backups')
+            results = {'db_mb': round(os.path.getsize(database.DB_PATH) / 2 ** 20, 1)}
+            jobs = {
+                'idle': None,
+                'backup': lambda: asyncio.to_thread(maintenance.run_backup, backup_dir),
+                'backup_one_step': lambda: asyncio.sleep(0, backup_one_step(tmp)),
+                'housekeeping': lambda: asyncio.to_thread(maintenance.run_housekeeping),
+            }
+            for phase in args.phases.split(','):
+                results[phase] = await run_phase(h, args, jobs[phase], joins)
+            results['archived'] = {table: database.db_execute(f'SELECT COUNT(*) FROM {table}_archive', fetchone=True)[0]
+                                   for table in database.ARCHIVED_TABLES}
+            results['db_mb_after'] = round(os.path.getsize(database.DB_PATH) / 2 ** 20, 1)
+            return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--deposits', type=int, default=300_000)
+    parser.add_argument('--load-users', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between taps per load user')
+    parser.add_argument('--phase-seconds', type=float, default=5.0, help='minimum length of each phase')
+    parser.add_argument('--phases', default='idle,backup,backup_one_step,housekeeping')
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
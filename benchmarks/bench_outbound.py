@@ -0,0 +1,133 @@
+"""Broadcast under flood control: lost messages and reply latency with and without the outbound scheduler.
+
+    python benchmarks/bench_outbound.py --recipients 600 --users 20 --duration 10
+
+The fake transport enforces Telegram-like flood limits: at most
+--global-rate sends in any one second and --chat-burst per chat. Above
+either limit it answers 429 with retry_after=1. While the admin
+broadcasts to --recipients users, --users interactive users tap Balance
+every --interval seconds. Two modes are compared:
+
+  unpaced  sends go straight out and a 429 fails the send, as before the scheduler
+  paced    the default OutboundScheduler with its priority classes and retries
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict, deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from harness import ADMIN_ID, BotHarness, FakeTelegramRequest, seed_users, summarize
+
+from metrics import OUTBOUND_REQUESTS
+from outbound import OutboundScheduler, PACED_ENDPOINTS
+
+INTERACTIVE_START_ID = 900_000
+
+
+class FloodControlRequest(FakeTelegramRequest):
+    """Fake transport that answers 429 once a sliding one-second window is over budget"""
+
+    def __init__(self, latency, global_rate, chat_burst):
+        super().__init__(latency)
+        self.global_rate = global_rate
+        self.chat_burst = chat_burst
+        self.recent = deque()
+        self.per_chat = defaultdict(deque)
+        self.flood_errors = 0
+
+    def _over_limit(self, window, limit, now):
+        while window and now - window[0] >= 1:
+            window.popleft()
+        return len(window) >= limit
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        if endpoint in PACED_ENDPOINTS:
+            now = time.monotonic()
+            chat = self.per_chat[(request_data.parameters if request_data else {}).get('chat_id')]
+            if self._over_limit(self.recent, self.global_rate, now) or self._over_limit(chat, self.chat_burst, now):
+                self.flood_errors += 1
+                return 429, json.dumps({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                                        'parameters': {'retry_after': 1}}).encode()
+            self.recent.append(now)
+            chat.append(now)
+        return await super().do_request(url, method, request_data, read_timeout, write_timeout,
+                                        connect_timeout, pool_timeout)
+
+
+async def run(args, mode):
+    with tempfile.TemporaryDirectory() as tmp:
+        request = FloodControlRequest(args.transport_latency, args.global_rate, args.chat_burst)
+        if mode == 'unpaced':
+            unlimited = (1e9, 1e9)
+            scheduler = OutboundScheduler(unlimited, unlimited, unlimited, max_retries=0)
+        else:
+            scheduler = OutboundScheduler()
+        async with BotHarness(tmp, request=request, rate_limiter=scheduler) as h:
+            seed_users(args.recipients)
+            for uid in range(INTERACTIVE_START_ID, INTERACTIVE_START_ID + args.users):
+                await h.process(h.updates.message(uid, '/start'))
+            await h.process(h.updates.message(ADMIN_ID, '/start'))
+            await h.process(h.updates.message(ADMIN_ID, 'Broadcast'))
+            await h.process(h.updates.message(ADMIN_ID, 'Benchmark broadcast'))
+            # Let the setup replies drain out of the flood window
+            await asyncio.sleep(1.5)
+            flood_before = request.flood_errors
+            before = {(priority, result): count for priority, outcomes in send_outcomes().items()
+                      for result, count in outcomes.items()}
+
+            started = time.perf_counter()
+            broadcast = asyncio.create_task(h.process(h.updates.message(ADMIN_ID, 'Confirm Broadcast')))
+            latencies = []
+
+            async def interactive(i):
+                # Spread the users' taps across the interval, as independent users would
+                uid = INTERACTIVE_START_ID + i
+                await asyncio.sleep(args.interval * i / args.users)
+                while time.perf_counter() - started < args.duration:
+                    latencies.append(await h.process(h.updates.message(uid, 'Balance')))
+                    await asyncio.sleep(args.interval)
+
+            await asyncio.gather(*(interactive(i) for i in range(args.users)))
+            broadcast_elapsed = await broadcast
+            return {
+                'interactive': summarize(latencies, time.perf_counter() - started),
+                'broadcast_elapsed_s': round(broadcast_elapsed, 3),
+                'sends': {priority: {result: count - before[priority, result] for result, count in outcomes.items()}
+                          for priority, outcomes in send_outcomes().items()},
+                'flood_errors': request.flood_errors - flood_before,
+            }
+
+
+def send_outcomes():
+    return {priority: {result: OUTBOUND_REQUESTS.labels(priority, result).value for result in ('sent', 'failed')}
+            for priority in ('interactive', 'bulk')}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--recipients', type=int, default=600)
+    parser.add_argument('--users', type=int, default=20, help='interactive users active during the broadcast')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between taps per interactive user')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds the interactive users keep tapping')
+    parser.add_argument('--global-rate', type=int, default=30)
+    parser.add_argument('--chat-burst', type=int, default=3)
+    parser.add_argument('--transport-latency', type=float, default=0.02)
+    parser.add_argument('--modes', default='unpaced,paced')
+    args = parser.parse_args()
+
+    results = {'recipients': args.recipients, 'interactive_users': args.users}
+    for mode in args.modes.split(','):
+        results[mode] = asyncio.run(run(args, mode))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
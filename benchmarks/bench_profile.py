@@ -0,0 +1,107 @@
+"""Cost of /profile to the handlers it is watching.
+
+    python benchmarks/bench_profile.py --load-users 100 --phase-seconds 5
+
+--load-users users keep tapping Balance, Buy Accounts and Deposit while
+one profiler runs per phase:
+
+  off          no profiler, the baseline
+  sampling     profiler.SamplingProfiler alone, stacks only
+  full         what /profile runs: the sampler plus tracemalloc
+  cprofile     cProfile enabled for the phase, a deterministic profiler hooking every call
+
+Each phase reports handler latency percentiles and throughput. Last, an
+admin sends /profile through the real handler and the documents it
+returns are counted.
+"""
+import argparse
+import asyncio
+import cProfile
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from harness import ADMIN_ID, BotHarness, summarize
+
+from profiler import SamplingProfiler, sampler
+
+LOAD_START_ID = 5_000_000
+TAPS = ('Balance', 'Buy Accounts', 'Deposit', 'Main Menu')
+
+
+async def run_phase(h, args, mode):
+    latencies = []
+    stop = asyncio.Event()
+
+    async def user(uid):
+        rng = random.Random(uid)
+        while not stop.is_set():
+            latencies.append(await h.process(h.updates.message(uid, rng.choice(TAPS))))
+            await asyncio.sleep(args.interval)
+
+    profile = SamplingProfiler() if mode in ('sampling', 'full') else cProfile.Profile() if mode == 'cprofile' else None
+    if mode == 'full':
+        tracemalloc.start()
+    if mode == 'cprofile':
+        profile.enable()
+    elif profile:
+        profile.start()
+    started = time.perf_counter()
+    users = [asyncio.create_task(user(uid)) for uid in range(LOAD_START_ID, LOAD_START_ID + args.load_users)]
+    try:
+        await asyncio.sleep(args.phase_seconds)
+    finally:
+        stop.set()
+        await asyncio.gather(*users)
+        elapsed = time.perf_counter() - started
+        if mode == 'cprofile':
+            profile.disable()
+        elif profile:
+            profile.stop()
+        if mode == 'full':
+            tracemalloc.stop()
+    result = summarize(latencies, elapsed)
+    if isinstance(profile, SamplingProfiler):
+        result['samples'] = profile.samples
+    return result
+
+
+async def profile_command(h, seconds, mode):
+    before = h.request.calls['sendDocument']
+    await h.process(h.updates.message(ADMIN_ID, f'/profile {seconds} {mode}'))
+    # The handler runs as its own task
+    await asyncio.sleep(0.1)
+    while sampler.running:
+        await asyncio.sleep(0.1)
+    await asyncio.sleep(1)
+    return h.request.calls['sendDocument'] - before
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        async with BotHarness(tmp) as h:
+            for uid in range(LOAD_START_ID, LOAD_START_ID + args.load_users):
+                await h.process(h.updates.message(uid, '/start'))
+            results = {mode: await run_phase(h, args, mode) for mode in args.phases.split(',')}
+            results['profile_command_documents'] = {mode: await profile_command(h, 2, mode) for mode in ('full', 'stacks')}
+            return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--load-users', type=int, default=100)
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between taps per load user')
+    parser.add_argument('--phase-seconds', type=float, default=5.0)
+    parser.add_argument('--phases', default='off,sampling,full,cprofile')
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""Spam-flood load test: fair service for normal users with and without the per-user rate limiter.
+
+    python benchmarks/bench_rate_limit.py --users 200 --spammers 5 --spam 1000 --spam-rate 100
+
+Normal users each run one Get Code flow (Hotmail, then Gmail). At the
+same time, each spammer sends get_hotmail_code plus a credentials
+message --spam-rate times per second, without waiting for replies. The
+mock code API serves --api-concurrency requests at a time with a fixed
+latency and counts requests per email. The report shows how much of the
+API budget each group used and what latency normal users saw.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from harness import BotHarness, MockCodeAPI, summarize
+
+import ratelimit
+
+
+async def run(args, limited):
+    original_allow = ratelimit.limiter.allow
+    ratelimit.limiter = ratelimit.TokenBucketLimiter()
+    if not limited:
+        ratelimit.limiter.allow = lambda user_id, action: True
+    with tempfile.TemporaryDirectory() as tmp:
+        async with BotHarness(tmp) as h:
+            api = MockCodeAPI(latency=args.api_latency, concurrency=args.api_concurrency)
+            await api.start()
+            try:
+                normal_latencies = []
+                normal_emails = [f'user{uid}@hotmail.com' for uid in range(1, args.users + 1)]
+
+                async def normal_user(uid):
+                    for update in (h.updates.callback(uid, 'get_hotmail_code'),
+                                   h.updates.message(uid, f'user{uid}@hotmail.com|pw|token|client'),
+                                   h.updates.callback(uid, 'get_gmail_code'),
+                                   h.updates.message(uid, f'user{uid}@gmail.com')):
+                        normal_latencies.append(await h.process(update))
+
+                async def spammer(uid):
+                    # Updates arrive at a fixed rate and are processed concurrently, as a real flood would be
+                    inflight = []
+                    for i in range(args.spam):
+                        inflight.append(asyncio.create_task(h.process(h.updates.callback(uid, 'get_hotmail_code'))))
+                        inflight.append(asyncio.create_task(
+                            h.process(h.updates.message(uid, f'spam{uid}@hotmail.com|pw|token|client'))))
+                        await asyncio.sleep(1 / args.spam_rate)
+                    await asyncio.gather(*inflight)
+
+                started = time.perf_counter()
+                spam = [asyncio.create_task(spammer(900_000 + i)) for i in range(args.spammers)]
+                await asyncio.sleep(0)
+                await asyncio.gather(*(normal_user(uid) for uid in range(1, args.users + 1)))
+                normal_elapsed = time.perf_counter() - started
+                await asyncio.gather(*spam)
+                total_elapsed = time.perf_counter() - started
+
+                spam_calls = sum(n for email, n in api.by_email.items() if email and email.startswith('spam'))
+                served = sum(1 for email in normal_emails if api.by_email[email])
+                return {
+                    'normal': summarize(normal_latencies, normal_elapsed),
+                    'normal_users_served': f'{served}/{args.users}',
+                    'api_calls_normal': api.requests - spam_calls,
+                    'api_calls_spam': spam_calls,
+                    'spam_updates': args.spammers * args.spam * 2,
+                    'total_elapsed_s': round(total_elapsed, 3),
+                    'limiter_users_tracked': len(ratelimit.limiter),
+                }
+            finally:
+                await api.stop()
+                ratelimit.limiter.allow = original_allow
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--spammers', type=int, default=5)
+    parser.add_argument('--spam', type=int, default=1000, help='code requests per spammer')
+    parser.add_argument('--spam-rate', type=float, default=100, help='code requests per second per spammer')
+    parser.add_argument('--api-latency', type=float, default=0.05)
+    parser.add_argument('--api-concurrency', type=int, default=10, help='requests the mock API serves at once')
+    args = parser.parse_args()
+
+    results = {
+        'users': args.users, 'spammers': args.spammers, 'spam_per_spammer': args.spam,
+        'unlimited': asyncio.run(run(args, limited=False)),
+        'limited': asyncio.run(run(args, limited=True)),
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Deposit reconciliation against a payment statement export.
+
+    python benchmarks/bench_reconcile.py --lines 50000 --formats csv,xlsx
+
+Fills deposit_requests with --lines pending requests carrying transaction
+IDs (plus as many approved ones), then builds a statement with one line
+per pending request. A few lines per thousand are made to disagree (wrong
+amount, repeated in the statement, already approved, unclaimed). Each
+format is reconciled with reconcile.reconcile_statement; reported per
+format:
+
+  parse_s       reading the file and building the transaction ID table
+  reconcile_s   the whole run: parse, match, one approval transaction
+  per_request   the old way, one update_deposit_transaction_id lookup and one
+                settle_deposit_requests call per approved request
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import database
+import reconcile
+from utils import write_export_file
+
+APPROVED_START_ID = 10_000_000
+
+
+def seed(args):
+    rng = random.Random(5)
+    conn = database.get_db_connection()
+    conn.executemany('INSERT INTO users (user_id, username) VALUES (?, ?)',
+                     ((uid, f'user{uid}') for uid in range(1, args.users + 1)))
+    conn.executemany('INSERT INTO deposit_requests (id, user_id, amount, method, transaction_id, status) VALUES (?, ?, ?, ?, ?, ?)',
+                     ((APPROVED_START_ID + i, rng.randrange(args.users) + 1, rng.randint(5, 500), 'BKash', f'AP{i:08d}', 'approved')
+                      for i in range(args.lines)))
+    conn.executemany('INSERT INTO deposit_requests (id, user_id, amount, method, transaction_id) VALUES (?, ?, ?, ?, ?)',
+                     ((i + 1, rng.randrange(args.users) + 1, rng.randint(5, 500), 'BKash', f'TX{i:08d}')
+                      for i in range(args.lines)))
+    conn.commit()
+    conn.close()
+
+
+def statement_rows(args):
+    rng = random.Random(6)
+    rows = [['Date', 'TrxID', 'Sender', 'Amount (BDT)', 'Balance']]
+    for request_id, amount, transaction_id in database.db_execute(
+            "SELECT id, amount, transaction_id FROM deposit_requests WHERE status = 'pending' ORDER BY id", fetchall=True):
+        roll = rng.random()
+        if roll < 0.002:
+            amount += 1
+        elif roll < 0.004:
+            rows.append(['2026-01-01 10:00', transaction_id.lower(), '01700000000', f'{amount:,.2f}', ''])
+        rows.append(['2026-01-01 10:00', transaction_id.lower(), '01700000000', f'{amount:,.2f}', ''])
+    for i in range(args.lines // 500):
+        rows.append(['2026-01-01 10:00', f'AP{i:08d}', '01700000000', '10.00', ''])
+        rows.append(['2026-01-01 10:00', f'UN{i:08d}', '01700000000', '10.00', ''])
+    return rows
+
+
+def build_statement(rows, fmt):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode('utf-8-sig')
+    path = write_export_file(rows[1:], rows[0], 'xlsx')
+    try:
+        with open(path, 'rb') as xlsx_file:
+            return xlsx_file.read()
+    finally:
+        os.remove(path)
+
+
+def reset_pending():
+    conn = database.get_db_connection()
+    conn.execute("UPDATE deposit_requests SET status = 'pending' WHERE id < ?", (APPROVED_START_ID,))
+    conn.execute('UPDATE users SET balance = 0')
+    conn.commit()
+    conn.close()
+
+
+def per_request(approved_ids):
+    started = time.perf_counter()
+    for request_id, transaction_id in database.db_execute(
+            f"SELECT id, transaction_id FROM deposit_requests WHERE id IN ({', '.join('?' * len(approved_ids))})",
+            approved_ids, fetchall=True):
+        database.update_deposit_transaction_id(request_id, transaction_id)
+        database.settle_deposit_requests([request_id], 'approved')
+    return round(time.perf_counter() - started, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', type=int, default=50_000)
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--formats', default='csv,xlsx')
+    args = parser.parse_args()
+
+    results = {'lines': args.lines}
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        seed(args)
+        rows = statement_rows(args)
+        for fmt in args.formats.split(','):
+            reset_pending()
+            content = build_statement(rows, fmt)
+            filename = f'bkash_statement.{fmt}'
+            started = time.perf_counter()
+            reconcile.parse_statement(reconcile.read_statement_rows(content, filename))
+            parse_s = time.perf_counter() - started
+            started = time.perf_counter()
+            result = reconcile.reconcile_statement(content, filename)
+            results[fmt] = {
+                'file_kb': len(content) // 1024,
+                'parse_s': round(parse_s, 2),
+                'reconcile_s': round(time.perf_counter() - started, 2),
+                'approved': len(result.settled),
+                'flags': result.flag_counts(),
+            }
+        reset_pending()
+        sample = [request_id for request_id, _, _ in result.settled[:2000]]
+        results['per_request_2000_s'] = per_request(sample)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
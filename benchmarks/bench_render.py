@@ -0,0 +1,69 @@
+"""Keyboard and message rendering cost: fresh builds vs. the memoized keyboards in keyboards.py.
+
+    python benchmarks/bench_render.py --calls 10000
+
+For each keyboard, the undecorated builder (lru_cache's __wrapped__) is
+compared with the cached function. Timing runs without tracemalloc. The
+allocation pass keeps every result alive, so tracemalloc's traced memory
+shows the bytes each call allocates. A cache hit allocates nothing.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import database
+import keyboards
+from config import ADMIN_IDS
+
+
+def measure(func, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    elapsed = time.perf_counter() - started
+
+    results = []
+    tracemalloc.start()
+    for _ in range(calls):
+        results.append(func())
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {'bytes_per_call': round(allocated / calls), 'us_per_call': round(elapsed / calls * 1e6, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=10000)
+    args = parser.parse_args()
+    admin_id = ADMIN_IDS[0]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'render.db')
+        database.init_db()
+        cases = {
+            'main_keyboard_user': (lambda: keyboards._main_keyboard.__wrapped__(False), lambda: keyboards.get_main_keyboard(1)),
+            'main_keyboard_admin': (lambda: keyboards._main_keyboard.__wrapped__(True),
+                                    lambda: keyboards.get_main_keyboard(admin_id)),
+            'admin_panel': (keyboards.get_admin_panel_keyboard.__wrapped__, keyboards.get_admin_panel_keyboard),
+            'code_menu': (keyboards.get_code_menu_keyboard.__wrapped__, keyboards.get_code_menu_keyboard),
+            'code_action': (lambda: keyboards.get_code_action_keyboard.__wrapped__('hotmail', True),
+                            lambda: keyboards.get_code_action_keyboard('hotmail', True)),
+            'service_buy': (lambda: keyboards._service_buy_keyboard.__wrapped__('hotmail', database.get_price('hotmail'), 42),
+                            lambda: keyboards.get_service_buy_keyboard('hotmail', 42)),
+        }
+        results = {}
+        for name, (fresh, cached) in cases.items():
+            cached()
+            results[name] = {'fresh': measure(fresh, args.calls), 'cached': measure(cached, args.calls)}
+
+    print(json.dumps({'calls': args.calls, 'keyboards': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
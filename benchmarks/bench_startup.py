@@ -0,0 +1,87 @@
+"""Cold-start profile: `python -X importtime` breakdown of `import main` plus startup wall time.
+
+Each run is a fresh interpreter so nothing is cached between samples.
+Startup covers what happens before polling begins: importing main,
+init_db() on a scratch database and ensure_service_files(). The scratch
+directory starts empty, so ensure_service_files() does create workbooks
+(the worst case for a fresh deploy).
+
+    python benchmarks/bench_startup.py --runs 5 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+STARTUP_SCRIPT = '''
+import os, sys, time
+t0 = time.perf_counter()
+import database
+database.DB_PATH = os.path.join(sys.argv[1], 'startup.db')
+import utils
+utils.SERVICE_FILES = {k: os.path.join(sys.argv[1], os.path.basename(v)) for k, v in utils.SERVICE_FILES.items()}
+import main
+t1 = time.perf_counter()
+loaded = f"{'openpyxl' in sys.modules} {'aiohttp' in sys.modules}"
+main.init_db()
+main.ensure_service_files()
+t2 = time.perf_counter()
+print(f"{t1 - t0} {t2 - t1} {loaded}")
+'''
+
+
+def parse_importtime(stderr):
+    """Return {module: (self_us, cumulative_us)} from -X importtime output"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    import_samples = []
+    startup_samples = []
+    cumulative = {}
+    lazy = {}
+    for _ in range(args.runs):
+        profile = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'],
+                                 cwd=ROOT, capture_output=True, text=True, check=True)
+        for name, (_, cumulative_us) in parse_importtime(profile.stderr).items():
+            cumulative.setdefault(name, []).append(cumulative_us)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            run = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, tmp],
+                                 cwd=ROOT, capture_output=True, text=True, check=True)
+        import_s, init_s, openpyxl_loaded, aiohttp_loaded = run.stdout.split()
+        import_samples.append(float(import_s))
+        startup_samples.append(float(import_s) + float(init_s))
+        lazy = {'openpyxl_loaded_at_import': openpyxl_loaded == 'True', 'aiohttp_loaded_at_import': aiohttp_loaded == 'True'}
+
+    top = sorted(((statistics.median(v), k) for k, v in cumulative.items()), reverse=True)[:args.top]
+    result = {
+        'python': sys.version.split()[0],
+        'runs': args.runs,
+        'import_main_ms': round(statistics.median(import_samples) * 1000, 1),
+        'startup_ms': round(statistics.median(startup_samples) * 1000, 1),
+        'import_main_cumulative_ms': round(statistics.median(cumulative.get('main', [0])) / 1000, 1),
+        'top_cumulative_imports_ms': {name: round(us / 1000, 1) for us, name in top},
+        **lazy,
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Admin Stats view: rollup tables vs. ad-hoc aggregation over the live tables.
+
+    python benchmarks/bench_stats.py --purchases 1000000 --deposits 500000 --days 365
+
+Fills purchases, deposit_requests and users with --days of history,
+then builds the rollups the way an upgraded database does (the backfill
+in init_db). Reported:
+
+  backfill_s   one-time seeding of stats_rollups from the history
+  rollups      render_stats_message, three windows read from stats_rollups
+  adhoc        the same windows aggregated straight from the live tables
+  write cost   charge_purchase with and without its rollup upsert
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import database
+import handlers
+from config import DEPOSIT_METHODS, SERVICE_NAMES
+
+ADHOC_QUERIES = [
+    '''SELECT service, COUNT(*), SUM(quantity), SUM(total_cents) FROM purchases
+       WHERE created_at >= datetime('now', ?) GROUP BY service''',
+    '''SELECT service, COUNT(*), SUM(quantity), SUM(total_cents) FROM purchases
+       WHERE created_at >= datetime('now', ?) AND status = 'refunded' GROUP BY service''',
+    '''SELECT method, status, COUNT(*), SUM(amount) FROM deposit_requests
+       WHERE created_at >= datetime('now', ?) GROUP BY method, status''',
+    '''SELECT referred_by IS NULL, COUNT(*) FROM users WHERE created_at >= datetime('now', ?) GROUP BY 1''',
+]
+
+
+def seed(args):
+    rng = random.Random(3)
+    now = time.time()
+    services = list(SERVICE_NAMES)
+
+    def ts():
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(now - rng.uniform(0, args.days * 86400)))
+
+    conn = database.get_db_connection()
+    conn.executemany('INSERT INTO users (user_id, username, referred_by, created_at) VALUES (?, ?, ?, ?)',
+                     ((uid, f'user{uid}', 1 if uid % 4 == 0 else None, ts()) for uid in range(1, args.users + 1)))
+    conn.executemany('INSERT INTO purchases (user_id, service, quantity, total_cents, status, created_at) VALUES (?, ?, ?, ?, ?, ?)',
+                     ((rng.randrange(args.users) + 1, rng.choice(services), q, q * 5000,
+                       'refunded' if rng.random() < 0.02 else 'delivered', ts())
+                      for q in (rng.randint(1, 20) for _ in range(args.purchases))))
+    conn.executemany('INSERT INTO deposit_requests (user_id, amount, method, status, created_at) VALUES (?, ?, ?, ?, ?)',
+                     ((rng.randrange(args.users) + 1, rng.randint(5, 500), rng.choice(DEPOSIT_METHODS),
+                       rng.choice(('approved', 'approved', 'rejected', 'pending')), ts())
+                      for _ in range(args.deposits)))
+    conn.execute('DROP TABLE stats_rollups')
+    conn.commit()
+    conn.close()
+
+
+def best(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 2)
+
+
+def adhoc():
+    conn = database.get_db_connection()
+    try:
+        for window in ('-1 days', '-7 days', '-30 days'):
+            for query in ADHOC_QUERIES:
+                conn.execute(query, (window,)).fetchall()
+    finally:
+        conn.close()
+
+
+def write_cost(repeat):
+    database.apply_balance_changes([(2, 10 ** 12, 'bench', None)])
+    record = database.record_rollups
+    results = {}
+    for mode in ('with_rollup', 'without_rollup'):
+        if mode == 'without_rollup':
+            database.record_rollups = lambda conn, events: len(events)
+        try:
+            started = time.perf_counter()
+            for _ in range(repeat):
+                database.charge_purchase(2, 'hotmail', 5, 25000, 2500)
+            results[mode] = round((time.perf_counter() - started) / repeat * 1000, 3)
+        finally:
+            database.record_rollups = record
+    return {f'{mode}_ms': value for mode, value in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--purchases', type=int, default=1_000_000)
+    parser.add_argument('--deposits', type=int, default=500_000)
+    parser.add_argument('--users', type=int, default=200_000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    results = {'purchases': args.purchases, 'deposits': args.deposits, 'users': args.users, 'days': args.days}
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        seed(args)
+        started = time.perf_counter()
+        database.init_db()
+        results['backfill_s'] = round(time.perf_counter() - started, 2)
+        results['rollup_rows'] = database.db_execute('SELECT COUNT(*) FROM stats_rollups', fetchone=True)[0]
+        results['rollups_ms'] = best(handlers.render_stats_message, args.repeat)
+        results['adhoc_ms'] = best(adhoc, args.repeat)
+        results['charge_purchase'] = write_cost(200)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Purchase latency: the old XLSX read-and-rewrite vs. XLSX and text stock through reserve_stock.
+
+    python benchmarks/bench_stock_formats.py --accounts 100000 --purchase 5 --rounds 5
+
+All three start from the same generated accounts. The "rewrite" baseline
+is the old remove_purchased_rows, kept here: load the whole workbook,
+drop the sold rows and save it again. "xlsx" and "text" buy --purchase
+accounts through utils.reserve_stock and decode them, with STOCK_FORMAT
+switched between the two.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import config
+import utils
+from openpyxl import Workbook, load_workbook
+from stockfile import workbook_to_stock
+
+
+def rewrite_purchase(filename, count):
+    wb = load_workbook(filename)
+    data = list(wb.active.iter_rows(values_only=True))
+    bought = data[1:count + 1]
+    new_wb = Workbook()
+    for row in [data[0]] + data[count + 1:]:
+        new_wb.active.append(row)
+    new_wb.save(filename)
+    return bought
+
+
+def summarize(timings, remaining):
+    return {
+        'median_ms': round(statistics.median(timings) * 1000, 2),
+        'max_ms': round(max(timings) * 1000, 2),
+        'remaining': remaining,
+    }
+
+
+def run_purchases(fmt, rounds, purchase):
+    utils.STOCK_FORMAT = fmt
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        list(utils.reserve_stock('hotmail', purchase).chunks(purchase))
+        timings.append(time.perf_counter() - started)
+    return summarize(timings, utils.get_stock_count('hotmail'))
+
+
+def run_rewrites(filename, rounds, purchase):
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        rewrite_purchase(filename, purchase)
+        timings.append(time.perf_counter() - started)
+    return summarize(timings, load_workbook(filename, read_only=True).active.max_row - 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accounts', type=int, default=100_000)
+    parser.add_argument('--purchase', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.SERVICE_FILES['hotmail'] = os.path.join(tmp, 'hotmail.xlsx')
+        config.STOCK_TEXT_FILES['hotmail'] = os.path.join(tmp, 'hotmail.txt')
+        rows = [utils.SERVICE_HEADERS['hotmail']] + [
+            [f'acct{i}@hotmail.com', f'pw{i:08d}', f'recovery{i}@mail.com', f'+1555{i:07d}'] for i in range(args.accounts)
+        ]
+        started = time.perf_counter()
+        utils._write_excel(config.SERVICE_FILES['hotmail'], rows)
+        result = {'accounts': args.accounts, 'purchase': args.purchase, 'write_xlsx_s': round(time.perf_counter() - started, 2)}
+
+        rewrite_path = os.path.join(tmp, 'hotmail-rewrite.xlsx')
+        shutil.copyfile(config.SERVICE_FILES['hotmail'], rewrite_path)
+        result['rewrite'] = run_rewrites(rewrite_path, args.rounds, args.purchase)
+
+        started = time.perf_counter()
+        workbook_to_stock(config.SERVICE_FILES['hotmail'], config.STOCK_TEXT_FILES['hotmail'])
+        result['convert_to_text_s'] = round(time.perf_counter() - started, 2)
+
+        started = time.perf_counter()
+        utils.STOCK_FORMAT = 'text'
+        utils.get_stock_count('hotmail')
+        result['text_open_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        result['text'] = run_purchases('text', args.rounds, args.purchase)
+
+        started = time.perf_counter()
+        utils.STOCK_FORMAT = 'xlsx'
+        utils.get_stock_count('hotmail')
+        result['xlsx_load_s'] = round(time.perf_counter() - started, 2)
+        result['xlsx'] = run_purchases('xlsx', args.rounds, args.purchase)
+        for fmt in ('xlsx', 'text'):
+            result[f'{fmt}_speedup'] = round(result['rewrite']['median_ms'] / max(result[fmt]['median_ms'], 1e-3))
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""XLSX import throughput: openpyxl in-process vs. the xlsx_import worker pool at each process count.
+
+    python benchmarks/bench_xlsx_import.py --rows 500000 --sheets 1
+    python benchmarks/bench_xlsx_import.py --file big.xlsx --workers 1,2,4,8 --skip-openpyxl
+
+The workbook is generated once (or taken from --file). Pool start-up is
+timed separately from parsing, so the parse numbers show steady-state
+throughput. The speedup is relative to one worker process.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import xlsx_import
+
+
+def generate(path, rows, sheets):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    per_sheet = -(-rows // sheets)
+    for s in range(sheets):
+        ws = wb.create_sheet(f'Sheet{s + 1}')
+        ws.append(['Email', 'Password', 'Recovery Email', 'Phone'])
+        for i in range(s * per_sheet, min(rows, (s + 1) * per_sheet)):
+            ws.append([f'acct{i}@hotmail.com', f'pw{i:08d}', f'recovery{i}@mail.com', f'+1555{i:07d}'])
+    wb.save(path)
+
+
+def _warm_up(_):
+    return os.getpid()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500_000)
+    parser.add_argument('--sheets', type=int, default=1)
+    parser.add_argument('--file')
+    parser.add_argument('--workers', default=','.join(str(n) for n in sorted({1, 2, 4, os.cpu_count() or 1})))
+    parser.add_argument('--chunk-mb', type=float, default=xlsx_import.IMPORT_CHUNK_BYTES / 1024 / 1024)
+    parser.add_argument('--skip-openpyxl', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        result = {'cpu_count': os.cpu_count(), 'chunk_mb': args.chunk_mb}
+        if not path:
+            path = os.path.join(tmp, 'bench.xlsx')
+            start = time.perf_counter()
+            generate(path, args.rows, args.sheets)
+            result['generate_s'] = round(time.perf_counter() - start, 2)
+        result['sheets'] = [(name, size) for name, _, size in xlsx_import.list_sheets(path)]
+
+        if not args.skip_openpyxl:
+            from openpyxl import load_workbook
+            start = time.perf_counter()
+            wb = load_workbook(path, read_only=True)
+            rows = sum(1 for ws in wb.worksheets for _ in ws.iter_rows(values_only=True))
+            wb.close()
+            result['openpyxl_read_only'] = {'rows': rows, 'elapsed_s': round(time.perf_counter() - start, 2)}
+
+        chunk_bytes = int(args.chunk_mb * 1024 * 1024)
+        runs = {}
+        for workers in [int(n) for n in args.workers.split(',')]:
+            start = time.perf_counter()
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            list(pool.map(_warm_up, range(workers)))
+            startup = time.perf_counter() - start
+
+            start = time.perf_counter()
+            rows = 0
+            for _, batch in xlsx_import.iter_workbook_batches(path, chunk_bytes=chunk_bytes, pool=pool, workers=workers,
+                                                              all_sheets=True):
+                rows += len(batch)
+            elapsed = time.perf_counter() - start
+            pool.shutdown()
+            runs[workers] = {'rows': rows, 'pool_startup_s': round(startup, 2), 'elapsed_s': round(elapsed, 2),
+                             'rows_per_s': round(rows / elapsed)}
+        base = runs[min(runs)]['elapsed_s']
+        for run in runs.values():
+            run['speedup'] = round(base / run['elapsed_s'], 2)
+        result['pool'] = runs
+        if 'openpyxl_read_only' in result:
+            result['speedup_vs_openpyxl'] = {
+                w: round(result['openpyxl_read_only']['elapsed_s'] / run['elapsed_s'], 2) for w, run in runs.items()
+            }
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
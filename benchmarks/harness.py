@@ -0,0 +1,248 @@
+"""Benchmark harness: drives the real Application and handlers through a fake Telegram transport.
+
+Nothing touches the network. FakeTelegramRequest answers Bot API calls in
+process. MockCodeAPI serves the hsmail endpoints from a local aiohttp
+server. BotHarness points the database and the service workbooks at a
+scratch directory.
+"""
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import config
+import database
+import handlers
+import utils
+
+BOT_USER = {'id': 1000000001, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+ADMIN_ID = config.ADMIN_IDS[0]
+
+
+class FakeTelegramRequest(BaseRequest):
+    """In-process stand-in for the Bot API HTTP transport"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({'ok': True, 'result': self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == 'getMe':
+            return {**BOT_USER, 'can_join_groups': False, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if endpoint in ('sendMessage', 'editMessageText', 'sendDocument'):
+            chat_id = int(params.get('chat_id', 0) or 0)
+            return {'message_id': next(self._message_ids), 'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'}, 'from': BOT_USER,
+                    'text': params.get('text', '')}
+        return True
+
+
+class UpdateFactory:
+    """Builds private-chat updates as Telegram would deliver them"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+
+    def _message(self, user_id, text, from_user=None):
+        message = {'message_id': next(self._message_ids), 'date': int(time.time()),
+                   'chat': {'id': user_id, 'type': 'private'}, 'from': from_user or self._user(user_id),
+                   'text': text}
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return message
+
+    def message(self, user_id, text):
+        return Update.de_json({'update_id': next(self._update_ids), 'message': self._message(user_id, text)}, self.bot)
+
+    def callback(self, user_id, data):
+        update_id = next(self._update_ids)
+        return Update.de_json({'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self._user(user_id), 'chat_instance': str(user_id), 'data': data,
+            'message': self._message(user_id, 'menu', from_user=BOT_USER),
+        }}, self.bot)
+
+
+class MockCodeAPI:
+    """Local stand-in for the hsmail code API"""
+
+    def __init__(self, latency: float = 0.0, code: str = '123456', concurrency: int = 0):
+        self.latency = latency
+        self.code = code
+        # Upstream capacity: with concurrency set, requests beyond it queue as they would on a saturated API
+        self._slots = asyncio.Semaphore(concurrency) if concurrency else None
+        self.requests = 0
+        self.by_email = Counter()
+        # email -> loop time its code appears; until then the API answers without a code
+        self.code_times = {}
+        self._runner = None
+
+    async def _handle(self, request):
+        from aiohttp import web
+        self.requests += 1
+        self.by_email[request.query.get('email')] += 1
+        if self._slots:
+            async with self._slots:
+                await asyncio.sleep(self.latency)
+        elif self.latency:
+            await asyncio.sleep(self.latency)
+        appears = self.code_times.get(request.query.get('email'))
+        if appears is not None and asyncio.get_running_loop().time() < appears:
+            return web.json_response({'status': 'error', 'message': 'No code found'})
+        return web.json_response({'status': 'success', 'code': self.code})
+
+    async def start(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/api2.php', self._handle)
+        app.router.add_get('/api.php', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        hotmail_url = f'http://127.0.0.1:{port}/api2.php'
+        gmail_url = f'http://127.0.0.1:{port}/api.php'
+        handlers.HOTMAIL_API_URL, handlers.GMAIL_API_URL = hotmail_url, gmail_url
+        utils.API_LABELS.update({hotmail_url: 'hotmail', gmail_url: 'gmail'})
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+def generate_inventory(filename, rows, service='hotmail'):
+    """Write a synthetic service workbook with a header and `rows` accounts"""
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(utils.SERVICE_HEADERS[service])
+    width = len(utils.SERVICE_HEADERS[service])
+    for i in range(rows):
+        ws.append([f'acct{i}@hotmail.com', f'pw{i:08d}', f'recovery{i}@mail.com', f'+1555{i:07d}', 'US'][:width])
+    wb.save(filename)
+
+
+def seed_users(count, start_id=10_000_000):
+    """Bulk-insert users directly, bypassing the handlers"""
+    conn = database.get_db_connection()
+    conn.executemany('INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)',
+                     ((uid, f'user{uid}') for uid in range(start_id, start_id + count)))
+    conn.commit()
+    conn.close()
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles (ms) and throughput for one scenario"""
+    latencies = sorted(latencies)
+    if not latencies:
+        return {'updates': 0, 'elapsed_s': round(elapsed, 4)}
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 3)
+
+    return {
+        'updates': len(latencies),
+        'elapsed_s': round(elapsed, 4),
+        'updates_per_s': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'p50_ms': pct(0.50),
+        'p90_ms': pct(0.90),
+        'p99_ms': pct(0.99),
+        'max_ms': round(latencies[-1] * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class BotHarness:
+    """Runs the bot's Application against a scratch directory and the fake transport"""
+
+    def __init__(self, workdir, transport_latency: float = 0.0, request=None, rate_limiter=None):
+        self.workdir = workdir
+        database.DB_PATH = os.path.join(workdir, 'bench.db')
+        database._price_cache.clear()
+        for service, filename in list(config.SERVICE_FILES.items()):
+            config.SERVICE_FILES[service] = os.path.join(workdir, os.path.basename(filename))
+        for service, filename in list(config.STOCK_TEXT_FILES.items()):
+            config.STOCK_TEXT_FILES[service] = os.path.join(workdir, 'stock', os.path.basename(filename))
+        database.init_db()
+        utils.ensure_service_files()
+
+        import main
+        from outbound import OutboundScheduler
+        self.request = request or FakeTelegramRequest(transport_latency)
+        # Sends are unpaced unless a scheduler is passed in, so handler benchmarks measure the handlers
+        unlimited = (1e9, 1e9)
+        self.app = main.build_application(request=self.request, rate_limiter=rate_limiter or OutboundScheduler(
+            global_limit=unlimited, private_limit=unlimited, group_limit=unlimited))
+        self.updates = None
+
+    async def __aenter__(self):
+        await self.app.initialize()
+        self.updates = UpdateFactory(self.app.bot)
+        return self
+
+    async def __aexit__(self, *exc):
+        for task in list(utils.session_timeouts.values()):
+            task.cancel()
+        utils.session_timeouts.clear()
+        utils.user_sessions.clear()
+        await self.app.shutdown()
+
+    async def process(self, update):
+        """Process one update end to end and return its latency in seconds"""
+        start = time.perf_counter()
+        await self.app.process_update(update)
+        return time.perf_counter() - start
+
+    async def run_sessions(self, sessions, concurrency=100):
+        """Run each user's update sequence in order, users interleaved; returns (latencies, elapsed)"""
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def run_one(make_updates):
+            async with semaphore:
+                for update in make_updates():
+                    latencies.append(await self.process(update))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(run_one(s) for s in sessions))
+        return latencies, time.perf_counter() - start
@@ -0,0 +1,77 @@
+"""Stress test for deposit settlement: many threads approving the same requests at once.
+
+Every request must be credited exactly once no matter how many concurrent
+/approve calls (single or bulk) race for it.
+
+    python benchmarks/stress_deposit_approval.py --requests 500 --threads 16
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import database
+from harness import seed_users
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--users', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, 'stress.db')
+        database.init_db()
+
+        seed_users(args.users, 1)
+        expected = {}
+        for i in range(args.requests):
+            user_id = random.randint(1, args.users)
+            amount = float(random.randint(1, 500))
+            database.save_deposit_request(user_id, amount, 'BKash')
+            expected[user_id] = expected.get(user_id, 0.0) + amount
+        request_ids = [row[0] for row in database.db_execute('SELECT id FROM deposit_requests', fetchall=True)]
+
+        def worker(seed):
+            rng = random.Random(seed)
+            ids = request_ids[:]
+            rng.shuffle(ids)
+            settled = 0
+            while ids:
+                if rng.random() < 0.5:
+                    settled += len(database.settle_deposit_requests([ids.pop()], 'approved'))
+                else:
+                    batch, ids = ids[:10], ids[10:]
+                    settled += len(database.settle_deposit_requests(batch, 'approved'))
+            return settled
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            settled_counts = list(pool.map(worker, range(args.threads)))
+        elapsed = time.perf_counter() - started
+
+        balances = dict(database.db_execute('SELECT user_id, balance FROM users', fetchall=True))
+        mismatched = [u for u, amount in expected.items() if abs(balances.get(u, 0.0) - amount) > 1e-6]
+        result = {
+            'requests': args.requests,
+            'threads': args.threads,
+            'settled_total': sum(settled_counts),
+            'elapsed_s': round(elapsed, 4),
+            'attempts_per_s': round(args.requests * args.threads / elapsed, 1),
+            'mismatched_users': mismatched,
+            'ok': sum(settled_counts) == args.requests and not mismatched,
+        }
+        print(json.dumps(result, indent=2))
+        return 0 if result['ok'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
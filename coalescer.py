@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from database import run_write_batch
+
+logger = logging.getLogger(__name__)
+
+class WriteCoalescer:
+    """Write-behind group commit: small writes submitted within a few milliseconds share one transaction"""
+    
+    def __init__(self, flush_interval: float = 0.005, max_batch: int = 500):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = None
+        self._task = None
+    
+    def start(self):
+        """Start the background flush task on the running loop"""
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Flush pending writes and stop the background task"""
+        task, self._task = self._task, None
+        if task:
+            self._queue.put_nowait(None)
+            await task
+    
+    async def submit(self, func, *args):
+        """Run func(conn, *args) in the next batch and return its result once the batch has committed"""
+        op = (func, args)
+        if not self._task:
+            ok, result = (await asyncio.to_thread(run_write_batch, [op]))[0]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._queue.put_nowait((op, future))
+            ok, result = await future
+        if not ok:
+            raise result
+        return result
+    
+    async def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            results = await asyncio.to_thread(run_write_batch, [op for op, _ in batch])
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} writes failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+    
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            await asyncio.sleep(self.flush_interval)
+            batch = [first]
+            stopping = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stopping:
+                return
+
+write_coalescer = WriteCoalescer()
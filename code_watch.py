@@ -0,0 +1,187 @@
+"""Watch mode for Get Code: keep checking for a code until it arrives or the session expires.
+
+One scheduler serves every watcher. Watches wait in a heap ordered by
+their next poll time. A single task pops the due ones and polls the code
+API through a shared connection pool, within a global request budget and
+a concurrency cap. Each watch backs off from CODE_WATCH_MIN_INTERVAL to
+CODE_WATCH_MAX_INTERVAL while no code shows up. A found code is pushed
+to the user straight away. Waiting costs one heap entry per watcher, not
+a task or a timer.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from analytics import stats_recorder
+from config import (CODE_WATCH_MIN_INTERVAL, CODE_WATCH_MAX_INTERVAL, CODE_WATCH_BACKOFF,
+                    CODE_WATCH_REQUESTS_PER_SECOND, CODE_WATCH_CONCURRENCY)
+from keyboards import get_code_action_keyboard
+from metrics import CODE_WATCH_RESULTS, GaugeFunc, register
+from utils import fetch_code_from_api
+
+logger = logging.getLogger(__name__)
+
+class CodeWatch:
+    """One user's pending code lookup"""
+    __slots__ = ('user_id', 'service_type', 'api_url', 'params', 'email', 'success_template',
+                 'expires_at', 'interval', 'polls', 'active')
+
+    def __init__(self, user_id, service_type, api_url, params, email, success_template, expires_at, interval):
+        self.user_id = user_id
+        self.service_type = service_type
+        self.api_url = api_url
+        self.params = params
+        self.email = email
+        self.success_template = success_template
+        self.expires_at = expires_at
+        self.interval = interval
+        self.polls = 0
+        self.active = True
+
+class CodeWatchScheduler:
+    """Polls the code API for all watched sessions from a single task"""
+
+    def __init__(self, min_interval=CODE_WATCH_MIN_INTERVAL, max_interval=CODE_WATCH_MAX_INTERVAL,
+                 backoff=CODE_WATCH_BACKOFF, rate=CODE_WATCH_REQUESTS_PER_SECOND, concurrency=CODE_WATCH_CONCURRENCY):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.rate = rate
+        self.concurrency = concurrency
+        self._watches = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._bot = None
+        self._session = None
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+        self._inflight = set()
+
+    def __len__(self):
+        return len(self._watches)
+
+    def start(self, bot):
+        """Start the scheduler on the running loop"""
+        import aiohttp
+        self._bot = bot
+        self._session = aiohttp.ClientSession()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop polling; watches still waiting are dropped"""
+        tasks = [task for task in (self._task, *self._inflight) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._inflight.clear()
+        self._watches.clear()
+        self._heap.clear()
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def watch(self, user_id, service_type, api_url, params, email, success_template, ttl):
+        """Keep looking for the user's code for `ttl` seconds; replaces any watch the user already has"""
+        if self._task is None:
+            return False
+        self.cancel(user_id, record=False)
+        now = asyncio.get_running_loop().time()
+        watch = self._watches[user_id] = CodeWatch(
+            user_id, service_type, api_url, params, email, success_template, now + ttl, self.min_interval
+        )
+        self._schedule(watch, now)
+        self._wakeup.set()
+        return True
+
+    def cancel(self, user_id, record=True):
+        """Stop watching for a user's code; returns True if a watch was active"""
+        watch = self._watches.pop(user_id, None)
+        if watch is None:
+            return False
+        # The heap entry is skipped lazily when it comes due
+        watch.active = False
+        if record:
+            CODE_WATCH_RESULTS.labels('cancelled').inc()
+            stats_recorder.record_code_session(watch.service_type, False)
+        return True
+
+    def _schedule(self, watch, now):
+        due = min(now + watch.interval, watch.expires_at)
+        heapq.heappush(self._heap, (due, next(self._seq), watch))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_slot = 0.0
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            due, _, watch = self._heap[0]
+            if not watch.active:
+                heapq.heappop(self._heap)
+                continue
+            now = loop.time()
+            wait = max(due, next_slot) - now
+            if wait > 0:
+                # A new watch may come due sooner than the current head
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            if now >= watch.expires_at:
+                self._finish(watch, None)
+                continue
+            await self._slots.acquire()
+            next_slot = max(next_slot, now) + 1 / self.rate
+            task = asyncio.create_task(self._poll(watch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _poll(self, watch):
+        try:
+            code, _ = await fetch_code_from_api(watch.api_url, watch.params, session=self._session)
+        finally:
+            self._slots.release()
+        if not watch.active:
+            return
+        watch.polls += 1
+        if code:
+            self._finish(watch, code)
+            return
+        watch.interval = min(self.max_interval, watch.interval * self.backoff)
+        self._schedule(watch, asyncio.get_running_loop().time())
+        self._wakeup.set()
+
+    def _finish(self, watch, code):
+        """Close a watch and tell the user the code, or that none arrived"""
+        self._watches.pop(watch.user_id, None)
+        watch.active = False
+        stats_recorder.record_code_session(watch.service_type, bool(code))
+        if code:
+            CODE_WATCH_RESULTS.labels('code').inc()
+            text = watch.success_template.format(email=watch.email, code=code)
+            reply_markup = get_code_action_keyboard(watch.service_type)
+        else:
+            CODE_WATCH_RESULTS.labels('expired').inc()
+            text = f"No code arrived for {watch.email} before the session expired. Please start again."
+            reply_markup = get_code_action_keyboard(watch.service_type, True)
+        task = asyncio.create_task(self._send(watch.user_id, text, reply_markup))
+        self._inflight.add(task)
+        task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, user_id, text, reply_markup):
+        try:
+            await self._bot.send_message(chat_id=user_id, text=text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Failed to deliver code watch result to {user_id}: {e}")
+
+code_watcher = CodeWatchScheduler()
+register(GaugeFunc('bot_code_watches', 'Sessions waiting for a code to arrive', lambda: len(code_watcher)))
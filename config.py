@@ -4,6 +4,110 @@ ADMIN_IDS = [7867235273]
 SUPPORT_CONTACTS = ["@Ibrahim543678", "@Ibrahim_2006_fb_sel"]
 HOTMAIL_API_URL = 'https://hsmail.shop/api2.php'
 GMAIL_API_URL = 'https://hsmail.shop/api.php'
+DB_PATH = 'bot_data.db'
+
+# Logging: records go through a background queue; sampled events keep roughly this fraction
+LOG_LEVEL = 'INFO'
+LOG_FORMAT = 'json'
+LOG_SAMPLE_RATES = {
+    'api_response': 0.05,
+    'broadcast_failure': 0.01,
+}
+
+# Blocking file work (XLSX parsing, download files, exports) runs on a bounded thread pool
+FILE_WORKER_THREADS = 4
+FILE_MAX_PENDING = 32
+
+# Purchases are streamed to the buyer as 'txt' or 'zip' parts, each sent as soon as it reaches
+# DELIVERY_PART_MAX_BYTES (bots may upload up to 50 MB); rows are decoded DELIVERY_CHUNK_ROWS at a time
+DELIVERY_FORMAT = 'txt'
+DELIVERY_PART_MAX_BYTES = 45 * 1024 * 1024
+DELIVERY_CHUNK_ROWS = 2000
+# Each part is built in memory until it passes DOWNLOAD_SPOOL_MAX_BYTES, then spills to a temp file
+DOWNLOAD_SPOOL_MAX_BYTES = 4 * 1024 * 1024
+
+# Workbook parsing runs in worker processes; 0 means one per CPU. Sheets are split every IMPORT_CHUNK_BYTES of XML
+IMPORT_WORKER_PROCESSES = 0
+IMPORT_CHUNK_BYTES = 16 * 1024 * 1024
+
+# Local Prometheus-style metrics endpoint; set METRICS_PORT = 0 to disable
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9108
+
+# Per-user token buckets: action class -> (burst capacity, tokens refilled per second). Users idle for
+# RATE_LIMIT_IDLE_SECONDS are evicted; a limited user is told to slow down at most once per cooldown
+RATE_LIMITS = {
+    "start": (3, 1 / 30),
+    "code": (5, 1 / 20),
+    "default": (20, 2),
+}
+RATE_LIMIT_IDLE_SECONDS = 600
+RATE_LIMIT_NOTICE_COOLDOWN = 10
+
+# Last-seen and blocked-bot marks are kept in memory and written in one batch this often
+ACTIVITY_FLUSH_SECONDS = 30
+
+# Analytics rollups for events that make no database write of their own are flushed this often
+ANALYTICS_FLUSH_SECONDS = 60
+
+# Balances are snapshotted and the ledger reconciled against the snapshots this often
+LEDGER_MAINTENANCE_INTERVAL = 3600
+
+# Maintenance runs on worker threads a few pages or rows at a time, sleeping MAINTENANCE_STEP_PAUSE
+# between steps. Every BACKUP_INTERVAL the database and the stock files are copied into a new folder
+# under BACKUP_DIR, keeping the newest BACKUP_KEEP. Every MAINTENANCE_INTERVAL settled deposits and
+# broadcasts older than ARCHIVE_AFTER_DAYS move to archive tables, free pages are released and
+# planner statistics are refreshed
+BACKUP_DIR = 'backups'
+BACKUP_INTERVAL = 6 * 3600
+BACKUP_KEEP = 8
+BACKUP_PAGES_PER_STEP = 256
+MAINTENANCE_INTERVAL = 3600
+MAINTENANCE_STEP_PAUSE = 0.01
+ARCHIVE_AFTER_DAYS = 90
+ARCHIVE_BATCH_SIZE = 500
+VACUUM_PAGES_PER_STEP = 256
+ANALYSIS_LIMIT = 1000
+
+# /profile samples every thread's stack each PROFILE_SAMPLE_INTERVAL seconds and traces allocations with
+# tracemalloc (PROFILE_TRACEMALLOC_FRAMES deep) for at most PROFILE_MAX_SECONDS; nothing runs between profiles
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_TRACEMALLOC_FRAMES = 1
+PROFILE_TOP_ALLOCATIONS = 30
+
+# Event-loop watchdog: a timer on the loop is due every LOOP_LAG_INTERVAL and its lateness is recorded.
+# When the loop has not run it for LOOP_STALL_THRESHOLD seconds, the stack that blocks the loop is captured
+# and logged with the handler and update it belongs to. Stalls longer than LOOP_STALL_ALERT_SECONDS are sent
+# to admins, at most once per LOOP_STALL_ALERT_COOLDOWN; 0 disables alerts
+LOOP_LAG_INTERVAL = 0.1
+LOOP_STALL_THRESHOLD = 0.25
+LOOP_STALL_ALERT_SECONDS = 2.0
+LOOP_STALL_ALERT_COOLDOWN = 600
+
+# Admission control: ADMISSION_WORKERS updates are handled at once, one at a time per user, the highest class
+# first: admin, money (purchases and deposits), code (Get Code), default, static (menus and fixed texts).
+# Each class queues at most ADMISSION_QUEUE_LIMITS users and drops updates that waited longer than its
+# ADMISSION_DEADLINES entry (None waits as long as it takes). When the smallest queueing delay over an
+# ADMISSION_INTERVAL stays above ADMISSION_TARGET_DELAY, static requests are answered from cached replies
+# without queueing. A user may have ADMISSION_USER_BACKLOG updates waiting behind the one being handled
+ADMISSION_WORKERS = 16
+ADMISSION_QUEUE_LIMITS = {'admin': 1000, 'money': 5000, 'code': 2000, 'default': 2000, 'static': 500}
+ADMISSION_DEADLINES = {'admin': None, 'money': None, 'code': 10, 'default': 10, 'static': 3}
+ADMISSION_TARGET_DELAY = 0.5
+ADMISSION_INTERVAL = 1.0
+ADMISSION_USER_BACKLOG = 10
+ADMISSION_NOTICE_COOLDOWN = 10
+
+# Outbound scheduler: every message the bot sends is paced by a global and a per-chat budget,
+# (messages per second, burst). Interactive replies go first, then admin messages, then bulk sends
+OUTBOUND_GLOBAL_LIMIT = (25, 5)
+OUTBOUND_PRIVATE_CHAT_LIMIT = (1, 2)
+OUTBOUND_GROUP_CHAT_LIMIT = (20 / 60, 3)
+OUTBOUND_MAX_RETRIES = 3
+# Broadcast sends queued with the scheduler at a time
+BROADCAST_BATCH_SIZE = 1000
 
 # Service Names and Files
 SERVICE_NAMES = {
@@ -18,7 +122,45 @@ SERVICE_FILES = {
     "fb_gmail": "xlsx_files/fb_gmail_data.xlsx"
 }
 
+# Stock storage: 'xlsx' keeps accounts in SERVICE_FILES; 'text' keeps them in pipe-delimited stock files
+# (converted from the workbooks on first start) where a purchase only advances a head pointer
+STOCK_FORMAT = 'xlsx'
+STOCK_TEXT_FILES = {
+    "hotmail": "stock_files/hotmail.txt",
+    "outlook": "stock_files/outlook.txt",
+    "fb_gmail": "stock_files/fb_gmail.txt"
+}
+STOCK_COMPACT_MIN_BYTES = 1024 * 1024
+# In 'xlsx' mode a purchase only records how many workbook rows are sold; the workbook is rewritten without
+# them once they outnumber the unsold rows and this minimum
+STOCK_REWRITE_MIN_ROWS = 5000
+
+# Admins are alerted when a service drops below its threshold; back-in-stock notices go out at this rate
+LOW_STOCK_THRESHOLDS = {
+    "hotmail": 20,
+    "outlook": 20,
+    "fb_gmail": 20
+}
+NOTIFY_MESSAGES_PER_SECOND = 25
+
 CODE_FORMATS = {
     "hotmail": "email|password|token|client_id",
     "gmail": "email"
-}
\ No newline at end of file
+}
+
+# Get Code sessions last this many minutes. When the first lookup finds no code, the session is
+# watched: one scheduler polls the code API for every watcher, starting CODE_WATCH_MIN_INTERVAL
+# apart and backing off to CODE_WATCH_MAX_INTERVAL, within a shared request budget
+CODE_SESSION_MINUTES = {
+    "hotmail": 15,
+    "gmail": 10
+}
+CODE_WATCH_MIN_INTERVAL = 5
+CODE_WATCH_MAX_INTERVAL = 60
+CODE_WATCH_BACKOFF = 1.5
+CODE_WATCH_REQUESTS_PER_SECOND = 20
+CODE_WATCH_CONCURRENCY = 20
+
+# Deposit methods offered to users
+DEPOSIT_METHODS = ["BKash", "Nagad", "Rocket", "Bank Transfer", "Card"]
+PENDING_DEPOSITS_PAGE_SIZE = 10
\ No newline at end of file
@@ -1,16 +1,47 @@
 import sqlite3
 import os
+import logging
+from contextlib import contextmanager
+from decimal import Decimal, ROUND_HALF_UP
 from typing import List, Tuple, Optional, Dict, Any
+from time import perf_counter, gmtime, strftime, sleep
+from config import DB_PATH
+from metrics import DB_QUERY_SECONDS, DB_QUERY_ERRORS
+
+logger = logging.getLogger(__name__)
 
 def get_db_connection():
     """Create and return a database connection"""
-    return sqlite3.connect('bot_data.db', check_same_thread=False)
+    return sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+
+@contextmanager
+def db_transaction():
+    """Yield a connection inside one IMMEDIATE transaction, committed on success"""
+    conn = get_db_connection()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 def init_db():
     """Initialize the database with required tables"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    # Incremental auto-vacuum lets maintenance hand free pages back a few at a time. A database
+    # created without it only switches over after one full VACUUM, done here once at startup
+    if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        if cursor.execute('SELECT 1 FROM sqlite_master').fetchone():
+            cursor.execute('VACUUM')
+    # WAL: readers never block the writer, so a backup can hold its snapshot while writes carry on
+    cursor.execute('PRAGMA journal_mode = WAL')
+    
     # Users table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -21,10 +52,25 @@ def init_db():
         referred_by INTEGER,
         total_referrals INTEGER DEFAULT 0,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_seen TIMESTAMP,
+        blocked_at TIMESTAMP,
         FOREIGN KEY (referred_by) REFERENCES users (user_id)
     )
     ''')
     
+    # Activity columns for databases created before they existed; joins count as the first sighting
+    columns = {row[1] for row in cursor.execute('PRAGMA table_info(users)')}
+    for column in ('last_seen', 'blocked_at'):
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE users ADD COLUMN {column} TIMESTAMP')
+    if 'last_seen' not in columns:
+        cursor.execute('UPDATE users SET last_seen = created_at')
+    
+    # Segment indexes cover only reachable users, which is all any broadcast or preview asks for
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_last_seen ON users (last_seen) WHERE blocked_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_balance ON users (balance) WHERE blocked_at IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_blocked ON users (blocked_at) WHERE blocked_at IS NOT NULL')
+    
     # Prices table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS prices (
@@ -72,6 +118,45 @@ def init_db():
     )
     ''')
     
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_deposit_requests_status ON deposit_requests (status, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_deposit_requests_status_method ON deposit_requests (status, method, id)')
+    
+    # A transaction ID can back only one deposit that has not been rejected
+    try:
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_deposit_requests_txid ON deposit_requests (transaction_id) "
+                       "WHERE transaction_id IS NOT NULL AND status != 'rejected'")
+    except sqlite3.IntegrityError:
+        # Claims made before the index existed; new ones are still checked by update_deposit_transaction_id
+        logger.warning("Duplicate deposit transaction IDs on record; using a non-unique index")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_deposit_requests_txid_any ON deposit_requests (transaction_id)')
+    
+    # Cold copies of settled deposits and old broadcasts, moved out by the maintenance job
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS deposit_requests_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        amount REAL,
+        method TEXT,
+        transaction_id TEXT,
+        status TEXT,
+        created_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE INDEX IF NOT EXISTS idx_deposit_requests_archive_txid ON deposit_requests_archive (transaction_id)
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_messages_archive (
+        id INTEGER PRIMARY KEY,
+        admin_id INTEGER,
+        message_text TEXT,
+        sent_count INTEGER,
+        created_at TIMESTAMP,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
     # Broadcast messages table
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS broadcast_messages (
@@ -97,23 +182,140 @@ def init_db():
     )
     ''')
     
+    # Balance ledger: append-only, integer cents, running balance per user
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS balance_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        delta_cents INTEGER NOT NULL,
+        balance_cents INTEGER NOT NULL,
+        reason TEXT,
+        ref_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_balance_ledger_user ON balance_ledger (user_id, id)')
+    
+    # Periodic balance snapshots checked by the reconciliation job
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS balance_snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        ledger_id INTEGER NOT NULL,
+        balance_cents INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_balance_snapshots_user ON balance_snapshots (user_id, id)')
+    
+    # Account purchases; the charge is the ledger entry with reason 'purchase' and ref_id = purchase id
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS purchases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        service TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        total_cents INTEGER NOT NULL,
+        status TEXT DEFAULT 'paid',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_purchases_user ON purchases (user_id, id)')
+    
+    # Accounts reserved for a partly delivered purchase that never reached the buyer; kept for support to resolve
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS undelivered_accounts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        purchase_id INTEGER NOT NULL,
+        account TEXT NOT NULL,
+        FOREIGN KEY (purchase_id) REFERENCES purchases (id)
+    )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_undelivered_accounts_purchase ON undelivered_accounts (purchase_id)')
+    
+    # Users waiting for a sold-out service to be restocked
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS restock_subscriptions (
+        user_id INTEGER NOT NULL,
+        service TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (service, user_id)
+    )
+    ''')
+    
+    # Hourly and daily analytics rollups, kept up to date as events happen so reports never scan the live tables
+    stats_existed = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stats_rollups'").fetchone()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stats_rollups (
+        period TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        dimension TEXT NOT NULL DEFAULT '',
+        events INTEGER NOT NULL DEFAULT 0,
+        quantity INTEGER NOT NULL DEFAULT 0,
+        amount_cents INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (period, bucket, metric, dimension)
+    ) WITHOUT ROWID
+    ''')
+    if not stats_existed:
+        # Seed the rollups from the history already on record; discounts and code lookups were never stored
+        for period, bucket in ROLLUP_PERIODS.items():
+            cursor.execute(f'''
+            INSERT INTO stats_rollups (period, bucket, metric, dimension, events, quantity, amount_cents)
+            SELECT '{period}', strftime('{bucket}', created_at), 'deposit_requests', COALESCE(method, ''),
+                   COUNT(*), 0, SUM(CAST(ROUND(amount * 100) AS INTEGER))
+            FROM deposit_requests GROUP BY 2, 4
+            UNION ALL
+            SELECT '{period}', strftime('{bucket}', created_at), 'deposits_' || status, COALESCE(method, ''),
+                   COUNT(*), 0, SUM(CAST(ROUND(amount * 100) AS INTEGER))
+            FROM deposit_requests WHERE status IN ('approved', 'rejected') GROUP BY 2, 3, 4
+            UNION ALL
+            SELECT '{period}', strftime('{bucket}', created_at), 'sales', service, COUNT(*), SUM(quantity), SUM(total_cents)
+            FROM purchases GROUP BY 2, 4
+            UNION ALL
+            SELECT '{period}', strftime('{bucket}', created_at), 'refunds', service, COUNT(*), SUM(quantity), SUM(total_cents)
+            FROM purchases WHERE status = 'refunded' GROUP BY 2, 4
+            UNION ALL
+            SELECT '{period}', strftime('{bucket}', created_at), 'signups',
+                   CASE WHEN referred_by IS NULL THEN 'direct' ELSE 'referral' END, COUNT(*), 0, 0
+            FROM users GROUP BY 2, 4
+            ''')
+    
+    # Open the ledger for balances that predate it
+    cursor.execute('''
+    INSERT INTO balance_ledger (user_id, delta_cents, balance_cents, reason)
+    SELECT user_id, CAST(ROUND(balance * 100) AS INTEGER), CAST(ROUND(balance * 100) AS INTEGER), 'opening'
+    FROM users
+    WHERE balance != 0 AND user_id NOT IN (SELECT user_id FROM balance_ledger)
+    ''')
+    
     conn.commit()
     conn.close()
 
 def db_execute(query: str, params: Tuple = (), fetchone: bool = False, fetchall: bool = False):
     """Execute a database query with parameters"""
+    start = perf_counter()
     conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(query, params)
-    
-    result = None
-    if fetchone:
-        result = cursor.fetchone()
-    elif fetchall:
-        result = cursor.fetchall()
-    
-    conn.commit()
-    conn.close()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        
+        result = None
+        if fetchone:
+            result = cursor.fetchone()
+        elif fetchall:
+            result = cursor.fetchall()
+        
+        conn.commit()
+    except Exception:
+        DB_QUERY_ERRORS.inc()
+        raise
+    finally:
+        conn.close()
+        DB_QUERY_SECONDS.observe(perf_counter() - start)
     
     return result
 
@@ -125,27 +327,243 @@ def get_user_data(user_id: int):
         fetchone=True
     )
 
-def create_user(user_id: int, username: str):
-    """Create a new user if not exists"""
-    db_execute('INSERT OR IGNORE INTO users (user_id, username) VALUES (?, ?)', (user_id, username))
+def register_user(conn, user_id: int, username: str, referral_code: Optional[str] = None):
+    """Insert a user on an open transaction and record their referrer, if any; returns True for new users"""
+    created = conn.execute(
+        'INSERT OR IGNORE INTO users (user_id, username, last_seen) VALUES (?, ?, CURRENT_TIMESTAMP)', (user_id, username)
+    ).rowcount == 1
+    referred = False
+    if referral_code:
+        referrer = conn.execute('SELECT user_id FROM users WHERE referral_code = ?', (referral_code,)).fetchone()
+        # Only the first referral counts, so repeated /start with a link cannot inflate the referrer's total
+        if referrer and referrer[0] != user_id and conn.execute(
+            'UPDATE users SET referred_by = ? WHERE user_id = ? AND referred_by IS NULL', (referrer[0], user_id)
+        ).rowcount == 1:
+            conn.execute('UPDATE users SET total_referrals = total_referrals + 1 WHERE user_id = ?', (referrer[0],))
+            referred = True
+    if created:
+        record_rollups(conn, [(rollup_hour(), 'signups', 'referral' if referred else 'direct', 1, 0, 0)])
+    return created
+
+def run_write_batch(ops: List[Tuple[Any, Tuple]]):
+    """Run (func, args) writes in one transaction, each func called as func(conn, *args) inside its own savepoint.
+
+    Returns one (ok, result or exception) per op; a failing op is rolled back alone.
+    """
+    results = []
+    with db_transaction() as conn:
+        for func, args in ops:
+            conn.execute('SAVEPOINT write_op')
+            try:
+                results.append((True, func(conn, *args)))
+                conn.execute('RELEASE write_op')
+            except Exception as e:
+                conn.execute('ROLLBACK TO write_op')
+                conn.execute('RELEASE write_op')
+                results.append((False, e))
+    return results
+
+# Rollup periods and the strftime format of their bucket start (UTC)
+ROLLUP_PERIODS = {'hour': '%Y-%m-%d %H:00:00', 'day': '%Y-%m-%d 00:00:00'}
+
+def rollup_bucket(period: str, epoch: Optional[float] = None) -> str:
+    """Start of the UTC hour or day containing `epoch` (default now), in the rollup bucket format"""
+    return strftime(ROLLUP_PERIODS[period], gmtime(epoch))
+
+def rollup_hour(epoch: Optional[float] = None) -> str:
+    """Start of the UTC hour containing `epoch` (default now)"""
+    return rollup_bucket('hour', epoch)
+
+def record_rollups(conn, events: List[Tuple[str, str, str, int, int, int]]):
+    """Add (hour, metric, dimension, events, quantity, amount_cents) to the hourly and daily rollups on an open transaction"""
+    rows = []
+    for hour, metric, dimension, count, quantity, amount_cents in events:
+        rows.append(('hour', hour, metric, dimension, count, quantity, amount_cents))
+        rows.append(('day', hour[:10] + ' 00:00:00', metric, dimension, count, quantity, amount_cents))
+    conn.executemany('''INSERT INTO stats_rollups (period, bucket, metric, dimension, events, quantity, amount_cents)
+                      VALUES (?, ?, ?, ?, ?, ?, ?)
+                      ON CONFLICT (period, bucket, metric, dimension) DO UPDATE SET
+                      events = events + excluded.events, quantity = quantity + excluded.quantity,
+                      amount_cents = amount_cents + excluded.amount_cents''', rows)
+    return len(events)
+
+def get_rollup_totals(period: str, since: str):
+    """Totals per (metric, dimension) over the buckets of a period starting at or after `since`"""
+    rows = db_execute('''SELECT metric, dimension, SUM(events), SUM(quantity), SUM(amount_cents) FROM stats_rollups
+                         WHERE period = ? AND bucket >= ? GROUP BY metric, dimension''', (period, since), fetchall=True)
+    return {(metric, dimension): (events, quantity, amount_cents) for metric, dimension, events, quantity, amount_cents in rows}
+
+def iter_rollups(period: str, batch_size: int = 1000):
+    """Yield every rollup row of a period in bucket order, for exports"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute('''SELECT bucket, metric, dimension, events, quantity, amount_cents / 100.0
+                              FROM stats_rollups WHERE period = ? ORDER BY bucket, metric, dimension''', (period,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def to_cents(amount: float) -> int:
+    """Convert a currency amount to integer cents"""
+    return int(Decimal(str(amount)).scaleb(2).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def post_ledger_entry(conn, user_id: int, delta_cents: int, reason: str, ref_id: Optional[int] = None):
+    """Append a ledger entry on an open transaction and return the new balance in cents, or None for unknown users"""
+    if not conn.execute('SELECT 1 FROM users WHERE user_id = ?', (user_id,)).fetchone():
+        return None
+    last = conn.execute(
+        'SELECT balance_cents FROM balance_ledger WHERE user_id = ? ORDER BY id DESC LIMIT 1', (user_id,)
+    ).fetchone()
+    balance_cents = (last[0] if last else 0) + delta_cents
+    conn.execute(
+        'INSERT INTO balance_ledger (user_id, delta_cents, balance_cents, reason, ref_id) VALUES (?, ?, ?, ?, ?)',
+        (user_id, delta_cents, balance_cents, reason, ref_id)
+    )
+    conn.execute('UPDATE users SET balance = ? WHERE user_id = ?', (balance_cents / 100, user_id))
+    return balance_cents
+
+def apply_balance_changes(entries: List[Tuple[int, int, str, Optional[int]]]):
+    """Post (user_id, delta_cents, reason, ref_id) entries in one transaction, returning each new balance in cents"""
+    with db_transaction() as conn:
+        return [post_ledger_entry(conn, *entry) for entry in entries]
 
-def update_user_balance(user_id: int, amount: float):
+def update_user_balance(user_id: int, amount: float, reason: str = 'adjustment'):
     """Update user balance"""
-    db_execute('UPDATE users SET balance = balance + ? WHERE user_id = ?', (amount, user_id))
+    return apply_balance_changes([(user_id, to_cents(amount), reason, None)])[0]
+
+def get_balance_cents(user_id: int) -> int:
+    """Get user balance in cents from the latest ledger entry"""
+    row = db_execute(
+        'SELECT balance_cents FROM balance_ledger WHERE user_id = ? ORDER BY id DESC LIMIT 1', (user_id,), fetchone=True
+    )
+    return row[0] if row else 0
 
 def get_balance(user_id: int):
     """Get user balance"""
-    balance_data = db_execute('SELECT balance FROM users WHERE user_id = ?', (user_id,), fetchone=True)
-    return balance_data[0] if balance_data else 0.0
+    return get_balance_cents(user_id) / 100
+
+def take_balance_snapshots():
+    """Snapshot every balance that changed since its last snapshot, returning the number of rows written"""
+    with db_transaction() as conn:
+        cursor = conn.execute('''
+        INSERT INTO balance_snapshots (user_id, ledger_id, balance_cents)
+        SELECT l.user_id, l.id, l.balance_cents
+        FROM balance_ledger l
+        JOIN (SELECT user_id, MAX(id) AS max_id FROM balance_ledger GROUP BY user_id) latest ON l.id = latest.max_id
+        WHERE l.id > COALESCE((SELECT ledger_id FROM balance_snapshots s WHERE s.user_id = l.user_id ORDER BY s.id DESC LIMIT 1), 0)
+        ''')
+        return cursor.rowcount
+
+def reconcile_ledger():
+    """Verify ledger sums against snapshots and running balances, returning a list of mismatch descriptions"""
+    conn = get_db_connection()
+    try:
+        mismatches = []
+        # Each snapshot must equal the previous snapshot plus the entries in between
+        rows = conn.execute('''
+        SELECT s.user_id, s.id, s.balance_cents,
+               COALESCE(p.balance_cents, 0) + COALESCE((
+                   SELECT SUM(delta_cents) FROM balance_ledger l
+                   WHERE l.user_id = s.user_id AND l.id > COALESCE(p.ledger_id, 0) AND l.id <= s.ledger_id
+               ), 0)
+        FROM balance_snapshots s
+        LEFT JOIN balance_snapshots p ON p.id = (
+            SELECT MAX(id) FROM balance_snapshots WHERE user_id = s.user_id AND id < s.id
+        )
+        ''').fetchall()
+        for user_id, snapshot_id, balance_cents, expected_cents in rows:
+            if balance_cents != expected_cents:
+                mismatches.append(f"user {user_id}: snapshot #{snapshot_id} is {balance_cents} cents, ledger sums to {expected_cents}")
+        
+        # The running balance and the users table must agree with the latest snapshot plus newer entries
+        rows = conn.execute('''
+        SELECT u.user_id, u.balance, l.balance_cents,
+               COALESCE(s.balance_cents, 0) + COALESCE((
+                   SELECT SUM(delta_cents) FROM balance_ledger
+                   WHERE user_id = u.user_id AND id > COALESCE(s.ledger_id, 0)
+               ), 0)
+        FROM users u
+        LEFT JOIN balance_ledger l ON l.id = (SELECT MAX(id) FROM balance_ledger WHERE user_id = u.user_id)
+        LEFT JOIN balance_snapshots s ON s.id = (SELECT MAX(id) FROM balance_snapshots WHERE user_id = u.user_id)
+        ''').fetchall()
+        for user_id, balance, running_cents, expected_cents in rows:
+            running_cents = running_cents or 0
+            if running_cents != expected_cents:
+                mismatches.append(f"user {user_id}: running balance is {running_cents} cents, ledger sums to {expected_cents}")
+            elif to_cents(balance or 0) != running_cents:
+                mismatches.append(f"user {user_id}: users.balance is {balance}, ledger balance is {running_cents / 100}")
+        return mismatches
+    finally:
+        conn.close()
+
+def charge_purchase(user_id: int, service: str, quantity: int, total_cents: int, discount_cents: int = 0):
+    """Record a purchase and debit its total in one transaction; returns (purchase_id, balance_cents) or None if funds are short"""
+    with db_transaction() as conn:
+        last = conn.execute(
+            'SELECT balance_cents FROM balance_ledger WHERE user_id = ? ORDER BY id DESC LIMIT 1', (user_id,)
+        ).fetchone()
+        if (last[0] if last else 0) < total_cents:
+            return None
+        purchase_id = conn.execute(
+            'INSERT INTO purchases (user_id, service, quantity, total_cents) VALUES (?, ?, ?, ?)',
+            (user_id, service, quantity, total_cents)
+        ).lastrowid
+        balance_cents = post_ledger_entry(conn, user_id, -total_cents, 'purchase', purchase_id)
+        if balance_cents is None:
+            raise ValueError(f"Unknown user {user_id}")
+        hour = rollup_hour()
+        record_rollups(conn, [(hour, 'sales', service, 1, quantity, total_cents)] +
+                       ([(hour, 'discounts', service, 1, quantity, discount_cents)] if discount_cents else []))
+        return purchase_id, balance_cents
+
+def settle_purchase(purchase_id: int, status: str):
+    """Mark a purchase delivered or refunded; a refund credits the total back through the ledger"""
+    with db_transaction() as conn:
+        row = conn.execute(
+            "UPDATE purchases SET status = ? WHERE id = ? AND status = 'paid' RETURNING user_id, total_cents, service, quantity",
+            (status, purchase_id)
+        ).fetchone()
+        if row and status == 'refunded':
+            record_rollups(conn, [(rollup_hour(), 'refunds', row[2], 1, row[3], row[1])])
+            return post_ledger_entry(conn, row[0], row[1], 'purchase_refund', purchase_id)
+        return None
+
+def settle_partial_purchase(purchase_id: int, delivered: int, undelivered: List[str]):
+    """Mark a purchase partly delivered, refund the undelivered share and record the undelivered accounts; returns the refund in cents"""
+    with db_transaction() as conn:
+        row = conn.execute(
+            "UPDATE purchases SET status = 'partial' WHERE id = ? AND status = 'paid' RETURNING user_id, total_cents, service, quantity",
+            (purchase_id,)
+        ).fetchone()
+        if not row:
+            return None
+        user_id, total_cents, service, quantity = row
+        conn.executemany('INSERT INTO undelivered_accounts (purchase_id, account) VALUES (?, ?)',
+                         ((purchase_id, account) for account in undelivered))
+        refund_cents = total_cents - total_cents * delivered // quantity
+        if refund_cents:
+            record_rollups(conn, [(rollup_hour(), 'refunds', service, 1, quantity - delivered, refund_cents)])
+            post_ledger_entry(conn, user_id, refund_cents, 'purchase_refund', purchase_id)
+        return refund_cents
+
+# Prices only change through set_price, so they are read from the database once per change
+_price_cache = {}
 
 def get_price(service: str):
     """Get price for a service"""
-    price_data = db_execute('SELECT price FROM prices WHERE service = ?', (service,), fetchone=True)
-    return price_data[0] if price_data else 0.0
+    if service not in _price_cache:
+        price_data = db_execute('SELECT price FROM prices WHERE service = ?', (service,), fetchone=True)
+        _price_cache[service] = price_data[0] if price_data else 0.0
+    return _price_cache[service]
 
 def set_price(service: str, price: float):
     """Set price for a service"""
     db_execute('UPDATE prices SET price = ? WHERE service = ?', (price, service))
+    _price_cache.pop(service, None)
 
 def get_discount_settings():
     """Get all discount settings"""
@@ -175,37 +593,180 @@ def update_referral_settings_db(referrer_bonus: float, referred_bonus: float):
 
 def save_deposit_request(user_id: int, amount: float, method: str):
     """Save a deposit request"""
-    return db_execute('INSERT INTO deposit_requests (user_id, amount, method) VALUES (?, ?, ?)', 
-                     (user_id, amount, method))
-
-def update_deposit_transaction_id(request_id: int, transaction_id: str):
-    """Update deposit transaction ID"""
-    db_execute('UPDATE deposit_requests SET transaction_id = ? WHERE id = ?', (transaction_id, request_id))
-
-def process_deposit_decision_db(request_id: int, status: str):
-    """Process deposit decision (approve/reject)"""
-    if status == 'approved':
-        request = db_execute('SELECT user_id, amount FROM deposit_requests WHERE id = ?', (request_id,), fetchone=True)
-        if request:
-            user_id, amount = request
-            update_user_balance(user_id, amount)
-            db_execute('UPDATE deposit_requests SET status = ? WHERE id = ?', ('approved', request_id))
-            return user_id, amount
-    elif status == 'rejected':
-        db_execute('UPDATE deposit_requests SET status = ? WHERE id = ?', ('rejected', request_id))
-    return None, None
-
-def get_pending_deposits():
-    """Get all pending deposits"""
-    return db_execute('''SELECT dr.id, dr.user_id, u.username, dr.amount, dr.method, dr.transaction_id 
-                      FROM deposit_requests dr 
-                      JOIN users u ON dr.user_id = u.user_id 
-                      WHERE dr.status = 'pending' ''', fetchall=True)
+    with db_transaction() as conn:
+        conn.execute('INSERT INTO deposit_requests (user_id, amount, method) VALUES (?, ?, ?)', (user_id, amount, method))
+        record_rollups(conn, [(rollup_hour(), 'deposit_requests', method, 1, 0, to_cents(amount))])
+
+def update_deposit_transaction_id(request_id: int, transaction_id: str) -> bool:
+    """Record the transaction ID of a deposit request; False if another deposit already claims it"""
+    with db_transaction() as conn:
+        for table in ('deposit_requests', 'deposit_requests_archive'):
+            if conn.execute(
+                f"SELECT 1 FROM {table} WHERE transaction_id = ? AND status != 'rejected' AND id != ?",
+                (transaction_id, request_id)
+            ).fetchone():
+                return False
+        try:
+            conn.execute('UPDATE deposit_requests SET transaction_id = ? WHERE id = ?', (transaction_id, request_id))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+def get_pending_claims():
+    """(id, user_id, amount, method, transaction_id) of every pending deposit that has a transaction ID"""
+    return db_execute('''SELECT id, user_id, amount, method, transaction_id FROM deposit_requests
+                         WHERE status = 'pending' AND transaction_id IS NOT NULL''', fetchall=True)
+
+def get_approved_claims(transaction_ids: List[str], chunk_size: int = 500):
+    """Map each given transaction ID that backs an approved (possibly archived) deposit to its request ID"""
+    claims = {}
+    conn = get_db_connection()
+    try:
+        for start in range(0, len(transaction_ids), chunk_size):
+            chunk = transaction_ids[start:start + chunk_size]
+            marks = ', '.join('?' * len(chunk))
+            # The status terms let the live table use its partial transaction ID index
+            for table in ('deposit_requests', 'deposit_requests_archive'):
+                claims.update(conn.execute(
+                    f"SELECT transaction_id, id FROM {table} WHERE transaction_id IN ({marks}) "
+                    f"AND status != 'rejected' AND status != 'pending'", chunk
+                ).fetchall())
+    finally:
+        conn.close()
+    return claims
+
+def settle_deposit_requests(request_ids: List[int], status: str):
+    """Approve or reject pending deposits atomically, returning (request_id, user_id, amount) for each one settled"""
+    settled = []
+    hour = rollup_hour()
+    with db_transaction() as conn:
+        for request_id in request_ids:
+            row = conn.execute(
+                "UPDATE deposit_requests SET status = ? WHERE id = ? AND status = 'pending' RETURNING user_id, amount, method",
+                (status, request_id)
+            ).fetchall()
+            if not row:
+                continue
+            user_id, amount, method = row[0]
+            if status == 'approved' and post_ledger_entry(conn, user_id, to_cents(amount), 'deposit', request_id) is None:
+                # No user row to credit; approving would mark the deposit paid without paying it
+                conn.execute("UPDATE deposit_requests SET status = 'pending' WHERE id = ?", (request_id,))
+                logger.error(f"Deposit request #{request_id} left pending: user {user_id} not found")
+                continue
+            record_rollups(conn, [(hour, f'deposits_{status}', method, 1, 0, to_cents(amount))])
+            settled.append((request_id, user_id, amount))
+    return settled
+
+# Age filters for the pending deposits view: key -> (comparison, sqlite datetime modifier)
+PENDING_AGE_FILTERS = {
+    'all': None,
+    '1h': ('>=', '-1 hours'),
+    '24h': ('>=', '-24 hours'),
+    'old': ('<', '-24 hours'),
+}
+
+def _pending_deposits_filter(method: Optional[str], age: str):
+    """Build the WHERE clause and parameters shared by the pending deposit queries"""
+    where = ["dr.status = 'pending'"]
+    params = []
+    if method:
+        where.append('dr.method = ?')
+        params.append(method)
+    age_filter = PENDING_AGE_FILTERS.get(age)
+    if age_filter:
+        where.append(f"dr.created_at {age_filter[0]} datetime('now', ?)")
+        params.append(age_filter[1])
+    return where, params
+
+def get_pending_deposits_page(after_id: int = 0, before_id: Optional[int] = None, method: Optional[str] = None,
+                              age: str = 'all', limit: int = 10):
+    """Get one keyset page of pending deposits, returning (rows, has_more) in ascending ID order"""
+    where, params = _pending_deposits_filter(method, age)
+    if before_id is not None:
+        where.append('dr.id < ?')
+        params.append(before_id)
+        order = 'DESC'
+    else:
+        where.append('dr.id > ?')
+        params.append(after_id)
+        order = 'ASC'
+    rows = db_execute(f'''SELECT dr.id, dr.user_id, u.username, dr.amount, dr.method, dr.transaction_id, dr.created_at
+                      FROM deposit_requests dr
+                      LEFT JOIN users u ON dr.user_id = u.user_id
+                      WHERE {' AND '.join(where)}
+                      ORDER BY dr.id {order} LIMIT ?''', tuple(params) + (limit + 1,), fetchall=True)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == 'DESC':
+        rows.reverse()
+    return rows, has_more
+
+def iter_pending_deposits(method: Optional[str] = None, age: str = 'all', batch_size: int = 1000):
+    """Yield every matching pending deposit without loading them all into memory"""
+    where, params = _pending_deposits_filter(method, age)
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(f'''SELECT dr.id, dr.user_id, u.username, dr.amount, dr.method, dr.transaction_id, dr.created_at
+                      FROM deposit_requests dr
+                      LEFT JOIN users u ON dr.user_id = u.user_id
+                      WHERE {' AND '.join(where)}
+                      ORDER BY dr.id''', params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def add_restock_subscription(user_id: int, service: str):
+    """Subscribe a user to the next restock of a service; returns False if already subscribed"""
+    with db_transaction() as conn:
+        return conn.execute(
+            'INSERT OR IGNORE INTO restock_subscriptions (user_id, service) VALUES (?, ?)', (user_id, service)
+        ).rowcount == 1
+
+def take_restock_subscribers(service: str):
+    """Remove and return every user subscribed to a service's restock"""
+    with db_transaction() as conn:
+        return [row[0] for row in conn.execute(
+            'DELETE FROM restock_subscriptions WHERE service = ? RETURNING user_id', (service,)
+        )]
 
 def get_all_user_ids():
     """Get all user IDs"""
     return [row[0] for row in db_execute('SELECT user_id FROM users', fetchall=True)]
 
+# User segments: extra filters on top of "has not blocked the bot", each served by a partial index
+USER_SEGMENTS = {
+    'all': '',
+    'active_7d': "AND last_seen >= datetime('now', '-7 days')",
+    'active_30d': "AND last_seen >= datetime('now', '-30 days')",
+    'balance': 'AND balance > 0',
+}
+
+def count_segment(segment: str) -> int:
+    """Number of reachable users in a segment, counted from its index"""
+    return db_execute(f'SELECT COUNT(*) FROM users WHERE blocked_at IS NULL {USER_SEGMENTS[segment]}', fetchone=True)[0]
+
+def get_segment_user_ids(segment: str) -> List[int]:
+    """IDs of the reachable users in a segment"""
+    return [row[0] for row in db_execute(
+        f'SELECT user_id FROM users WHERE blocked_at IS NULL {USER_SEGMENTS[segment]}', fetchall=True
+    )]
+
+def count_blocked_users() -> int:
+    """Number of users the bot can no longer message"""
+    return db_execute('SELECT COUNT(*) FROM users WHERE blocked_at IS NOT NULL', fetchone=True)[0]
+
+def record_activity(conn, seen: List[Tuple[int, str]], blocked: List[Tuple[int, str]]):
+    """Apply batched (user_id, timestamp) sightings and failed-send marks on an open transaction"""
+    # Hearing from a user means they can be reached again
+    conn.executemany('UPDATE users SET last_seen = ?, blocked_at = NULL WHERE user_id = ?',
+                     [(ts, user_id) for user_id, ts in seen])
+    conn.executemany('UPDATE users SET blocked_at = ? WHERE user_id = ?', [(ts, user_id) for user_id, ts in blocked])
+    return len(seen) + len(blocked)
+
 def save_broadcast_message_db(admin_id: int, message_text: str):
     """Save broadcast message"""
     return db_execute('INSERT INTO broadcast_messages (admin_id, message_text) VALUES (?, ?)', 
@@ -213,4 +774,78 @@ def save_broadcast_message_db(admin_id: int, message_text: str):
 
 def update_broadcast_count_db(broadcast_id: int, sent_count: int):
     """Update broadcast count"""
-    db_execute('UPDATE broadcast_messages SET sent_count = ? WHERE id = ?', (sent_count, broadcast_id))
\ No newline at end of file
+    db_execute('UPDATE broadcast_messages SET sent_count = ? WHERE id = ?', (sent_count, broadcast_id))
+
+# Maintenance
+# Archivable table -> (columns copied to <table>_archive, condition for rows that are done with)
+ARCHIVED_TABLES = {
+    'deposit_requests': (('id', 'user_id', 'amount', 'method', 'transaction_id', 'status', 'created_at'),
+                         "status != 'pending'"),
+    'broadcast_messages': (('id', 'admin_id', 'message_text', 'sent_count', 'created_at'), '1'),
+}
+
+def archive_old_rows(table: str, older_than_days: int, batch_size: int, pause: float = 0.0):
+    """Move finished rows older than the cutoff into the table's archive, one short transaction per batch"""
+    columns, condition = ARCHIVED_TABLES[table]
+    column_list = ', '.join(columns)
+    batch = (f"SELECT id FROM {table} WHERE {condition} AND created_at < datetime('now', ?) "
+             f"ORDER BY id LIMIT ?")
+    params = (f'-{older_than_days} days', batch_size)
+    moved = 0
+    while True:
+        with db_transaction() as conn:
+            count = conn.execute(
+                f'INSERT INTO {table}_archive ({column_list}) SELECT {column_list} FROM {table} WHERE id IN ({batch})',
+                params
+            ).rowcount
+            conn.execute(f'DELETE FROM {table} WHERE id IN ({batch})', params)
+        moved += count
+        if count < batch_size:
+            return moved
+        sleep(pause)
+
+def incremental_vacuum(pages_per_step: int, pause: float = 0.0):
+    """Hand free pages back to the filesystem a few at a time; returns the number of pages released"""
+    conn = get_db_connection()
+    conn.isolation_level = None
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0
+        released = 0
+        free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        while free:
+            conn.execute(f'PRAGMA incremental_vacuum({pages_per_step})').fetchall()
+            remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free:
+                break
+            released += free - remaining
+            free = remaining
+            sleep(pause)
+        return released
+    finally:
+        conn.close()
+
+def optimize_database(analysis_limit: int):
+    """Refresh query planner statistics where they are stale, sampling at most `analysis_limit` rows per index"""
+    conn = get_db_connection()
+    conn.isolation_level = None
+    try:
+        conn.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+        conn.execute('PRAGMA optimize')
+    finally:
+        conn.close()
+
+def backup_database(dest_path: str, pages_per_step: int, pause: float = 0.0):
+    """Copy the live database to dest_path with the online backup API, a few pages per step"""
+    src = get_db_connection()
+    src.isolation_level = None
+    dst = sqlite3.connect(dest_path)
+    try:
+        # An open read transaction pins one snapshot: writers carry on (WAL) and the copy never restarts
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        src.backup(dst, pages=pages_per_step, progress=lambda status, remaining, total: sleep(pause))
+        src.execute('COMMIT')
+    finally:
+        dst.close()
+        src.close()
@@ -0,0 +1,105 @@
+"""Streaming delivery of purchased accounts.
+
+Reserved rows are decoded DELIVERY_CHUNK_ROWS at a time on the file pool
+and written into a spooled part file (plain text, or a zip archive).
+Each part is uploaded as soon as it reaches DELIVERY_PART_MAX_BYTES, so
+memory stays bounded by one part, however large the order.
+"""
+import logging
+import tempfile
+import zipfile
+from config import DELIVERY_FORMAT, DELIVERY_PART_MAX_BYTES, DELIVERY_CHUNK_ROWS, DOWNLOAD_SPOOL_MAX_BYTES
+from utils import format_account_lines
+from workers import run_file_job
+
+logger = logging.getLogger(__name__)
+
+class DeliveryError(Exception):
+    """Delivery stopped part-way; `parts_sent` files holding the first `rows_sent` accounts already reached the buyer"""
+
+    def __init__(self, order_id, parts_sent, rows_sent, error):
+        super().__init__(f"Order {order_id} delivery failed after {parts_sent} part(s), {rows_sent} account(s): {error}")
+        self.parts_sent = parts_sent
+        self.rows_sent = rows_sent
+
+class DeliveryPart:
+    """One file of an order being filled with account lines"""
+
+    def __init__(self, fmt):
+        self.fmt = fmt
+        self.rows = 0
+        self.file = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_MAX_BYTES, mode='w+b')
+        if fmt == 'zip':
+            self._archive = zipfile.ZipFile(self.file, 'w', zipfile.ZIP_DEFLATED)
+            self._stream = self._archive.open('accounts.txt', 'w', force_zip64=True)
+        else:
+            self._archive = None
+            self._stream = self.file
+
+    def write(self, rows):
+        self._stream.write(format_account_lines(rows))
+        self.rows += len(rows)
+
+    def size(self):
+        return self.file.tell()
+
+    def finish(self):
+        """Close the archive (if any) and return the part's contents for upload"""
+        if self._archive:
+            self._stream.close()
+            self._archive.close()
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self):
+        self.file.close()
+
+def _next_chunk(chunks):
+    return next(chunks, None)
+
+async def _send_part(bot, chat_id, part, filename, caption):
+    # The Bot API client reads the whole upload into memory anyway, so hand it the bytes of one part
+    content = await run_file_job(part.finish)
+    await bot.send_document(chat_id=chat_id, document=content, filename=filename, caption=caption)
+
+async def deliver_accounts(bot, chat_id, service_key, reserved, order_id, fmt=DELIVERY_FORMAT,
+                           part_max_bytes=DELIVERY_PART_MAX_BYTES, chunk_rows=DELIVERY_CHUNK_ROWS):
+    """Stream reserved accounts to a chat as one or more files; returns the number of parts sent"""
+    chunks = reserved.chunks(chunk_rows)
+    part = None
+    parts_sent = 0
+    first_row = 1
+    try:
+        while True:
+            rows = await run_file_job(_next_chunk, chunks)
+            if rows is not None:
+                if part is None:
+                    part = DeliveryPart(fmt)
+                await run_file_job(part.write, rows)
+                if part.size() < part_max_bytes:
+                    continue
+            elif part is None:
+                break
+
+            # Send the full part, or the last one once the rows run out
+            last = rows is None
+            name = f"{service_key}_order{order_id}" if last and not parts_sent else f"{service_key}_order{order_id}_part{parts_sent + 1}"
+            caption = f"Order #{order_id}: accounts {first_row}-{first_row + part.rows - 1} of {len(reserved)}"
+            await _send_part(bot, chat_id, part, f"{name}.{fmt}", caption)
+            parts_sent += 1
+            first_row += part.rows
+            part.close()
+            part = None
+            if last:
+                break
+    except Exception as e:
+        raise DeliveryError(order_id, parts_sent, first_row - 1, e) from e
+    finally:
+        if part is not None:
+            part.close()
+    logger.info(f"Delivered order {order_id}: {len(reserved)} {service_key} accounts in {parts_sent} part(s)")
+    return parts_sent
+
+def unsent_accounts(reserved, rows_sent, chunk_rows=DELIVERY_CHUNK_ROWS):
+    """Account lines of a reservation that were not delivered, past its first `rows_sent` rows"""
+    return [line for rows in reserved.chunks(chunk_rows, rows_sent) for line in format_account_lines(rows).decode().splitlines()]
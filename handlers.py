@@ -1,54 +1,66 @@
 import os
 import re
-import logging
+import random
 import string
+import asyncio
+import logging
 from datetime import datetime
+from time import perf_counter, time
 from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from functools import wraps
+from telegram.ext import ContextTypes
 
-from config import BOT_TOKEN, ADMIN_IDS, SUPPORT_CONTACTS, HOTMAIL_API_URL, GMAIL_API_URL
-from config import SERVICE_NAMES, SERVICE_FILES, CODE_FORMATS
-from database import init_db, get_user_data, create_user, update_user_balance, get_balance, get_price, set_price
-from database import get_discount_settings, update_discount_settings, remove_discount_setting, get_referral_settings
+from config import ADMIN_IDS, SUPPORT_CONTACTS, HOTMAIL_API_URL, GMAIL_API_URL
+from config import SERVICE_NAMES, CODE_FORMATS, DEPOSIT_METHODS, PENDING_DEPOSITS_PAGE_SIZE, BROADCAST_BATCH_SIZE
+from config import CODE_SESSION_MINUTES, PROFILE_DEFAULT_SECONDS, PROFILE_MAX_SECONDS
+from database import db_execute, get_user_data, register_user, get_balance, get_price, set_price
+from database import get_discount_settings, update_discount_settings, remove_discount_setting
 from database import update_referral_settings_db, save_deposit_request, update_deposit_transaction_id
-from database import process_deposit_decision_db, get_pending_deposits, get_all_user_ids, save_broadcast_message_db
-from database import update_broadcast_count_db
-from keyboards import get_main_keyboard, get_admin_panel_keyboard, get_remove_files_keyboard, get_broadcast_keyboard
+from database import settle_deposit_requests, save_broadcast_message_db
+from database import count_segment, get_segment_user_ids, count_blocked_users
+from database import update_broadcast_count_db, get_pending_deposits_page, iter_pending_deposits
+from database import charge_purchase, settle_purchase, settle_partial_purchase, to_cents, add_restock_subscription
+from database import get_rollup_totals, iter_rollups, rollup_bucket
+from keyboards import get_main_keyboard, get_admin_panel_keyboard, get_broadcast_keyboard
 from keyboards import get_deposit_method_keyboard, get_service_buy_keyboard, get_code_menu_keyboard
 from keyboards import get_code_action_keyboard, get_code_links_keyboard, get_discount_settings_keyboard
-from keyboards import get_referral_settings_keyboard, get_manage_users_keyboard
-from utils import admin_only, user_sessions, session_timeouts, clear_user_session, set_session_timeout
-from utils import get_stock_count, get_rows_for_purchase, remove_purchased_rows, append_excel_data
-from utils import create_user_download_file, calculate_discount, fetch_code_from_api
-from utils import generate_referral_code, get_or_create_referral_code, get_referral_link, handle_referral_signup
-from utils import get_referral_stats
+from keyboards import get_referral_settings_keyboard, get_manage_users_keyboard, get_pending_deposits_keyboard
+from keyboards import get_restock_keyboard, get_services_keyboard, get_code_watch_keyboard, SEGMENT_LABELS
+from keyboards import get_stats_keyboard, PENDING_AGE_LABELS, PENDING_METHOD_KEYS
+from utils import admin_only, user_sessions, clear_user_session, set_session_timeout
+from utils import get_stock_count, fetch_code_from_api, write_export_file, store_service_upload, remove_service_stock
+from utils import get_referral_link, get_referral_stats, calculate_discount, reserve_stock
+from delivery import deliver_accounts, unsent_accounts, DeliveryError
+from ledger import ledger_writer
+from coalescer import write_coalescer
+from code_watch import code_watcher
+from activity import activity_tracker, is_unreachable
+from analytics import stats_recorder
+from workers import run_file_job
+from reconcile import reconcile_statement, normalize_transaction_id, REPORT_HEADER
+from profiler import sampler, profile_for, format_collapsed, top_functions
+from metrics import timed, BROADCAST_MESSAGES, BROADCAST_SECONDS
 
 logger = logging.getLogger(__name__)
 
-# Core Handlers
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle errors in the bot"""
-    logger.error(f"Error occurred for update {update}: {context.error}", exc_info=True)
-    if update and update.effective_message:
-        try:
-            await update.effective_message.reply_text("An error occurred. Please try again.")
-        except Exception as e:
-            logger.error(f"Failed to send error message: {e}")
+# Bounded metric labels for handler branches; free-form input is grouped under 'input'
+MESSAGE_BRANCHES = frozenset([
+    "Buy Accounts", "Get Code", "Balance", "Deposit", "Referral", "Special Offers", "Support", "About",
+    "Admin Panel", "Main Menu", "Back to Services", "Back", "Back to Admin Panel", "Cancel",
+    "Update Stocks", "Set Prices", "Pending Deposits", "Broadcast", "Manage Users", "Discount Settings",
+    "Referral Settings", "Settings", "Confirm Broadcast", "Edit Message", "Cancel Broadcast",
+    "Add Balance", "Send Message", "View User Info", "User Segments", "Stats", "Reconcile Deposits",
+    *(f"Audience: {label}" for label in SEGMENT_LABELS.values())
+])
+CALLBACK_BRANCHES = frozenset([
+    'main_menu', 'get_code_menu', 'get_hotmail_code', 'get_gmail_code', 'code_links', 'show_format',
+    'code_help', 'retry_hotmail', 'retry_gmail', 'contact_support', 'stop_watch'
+])
 
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle the /start command"""
-    user_id = update.effective_user.id
-    username = update.effective_user.username or f"User_{user_id}"
-    create_user(user_id, username)
-    
-    # Check if this is a referral start
-    if context.args and len(context.args) > 0:
-        referral_code = context.args[0]
-        if referral_code.startswith('REF'):
-            handle_referral_signup(user_id, referral_code)
-    
-    welcome_message = f"""Welcome to Account Verification Bot, {update.effective_user.first_name}!
+# Broadcast audience buttons -> user segment
+AUDIENCE_SEGMENTS = {f"Audience: {label}": segment for segment, label in SEGMENT_LABELS.items()}
+
+# Static message bodies, built once at import instead of on every update
+WELCOME_BODY = """
 
 Our services:
 - Hotmail - Premium Hotmail accounts
@@ -64,15 +76,237 @@ Features:
 
 Use Deposit button to add balance
 Use Support button if you need help"""
+
+SERVICES_MESSAGE = "Buy Accounts. Choose an account type to purchase:"
+
+FORMAT_GUIDE_MESSAGE = f"""Code Format Guide
+
+Hotmail/Outlook Format: {CODE_FORMATS['hotmail']}
+
+Gmail Format: {CODE_FORMATS['gmail']}
+
+Note: For Hotmail/Outlook, all information is required. For Gmail, only email is needed."""
+
+CODE_HELP_MESSAGE = f"""Code Help Center
+
+1. How to get codes?
+   - Click Get Code button
+   - Select your required service
+   - Send credentials in the provided format
+   - Bot will automatically fetch the code
+
+2. Session timeout?
+   - Hotmail/Outlook: {CODE_SESSION_MINUTES['hotmail']} minutes
+   - Gmail: {CODE_SESSION_MINUTES['gmail']} minutes
+   - If no code has arrived yet, the bot keeps checking until the session expires
+
+3. Credentials safe?
+   - 100% secure and encrypted
+   - Only used for code retrieval
+   - Never stored permanently
+
+4. Not getting codes?
+   - Check your credentials
+   - Ensure you have active codes
+   - Contact support if needed
+
+Support: {', '.join(SUPPORT_CONTACTS)}"""
+
+HOTMAIL_CODE_MESSAGE = """Email: {email}
+Verification Code: {code}
+Code Validity: 10 minutes
+Tips: Use this code immediately as it will expire soon.
+Security Note: Never share this code with anyone."""
+
+GMAIL_CODE_MESSAGE = """Email: {email}
+Verification Code: {code}
+Code Validity: 10 minutes
+Tips: Use this code immediately for verification.
+Security Note: Protect your code and never share it."""
+
+CONTACT_SUPPORT_MESSAGE = f"""Contact Support
+
+For assistance, please contact our support team:
+{', '.join(SUPPORT_CONTACTS)}
+
+We're here to help you 24/7!"""
+
+SUPPORT_MESSAGE = """Support
+
+For any assistance, please contact our support team:
+Support Contacts:""" + ''.join(f"\n- {support_id}" for support_id in SUPPORT_CONTACTS) + """
+
+24/7 Support: Yes
+We're here to help you!"""
+
+ABOUT_MESSAGE = """About Account Verification Bot
+
+We provide premium accounts and verification codes for:
+- Hotmail Accounts
+- Outlook Accounts
+- FB Gmail Accounts
+- Verification Codes
+
+Features:
+- 24/7 Active Service
+- 100% Guaranteed Accounts
+- Fast Delivery
+- 100% Secure
+
+Contact our support for any questions!"""
+
+# Replies that depend on nothing but the button pressed; served as they are when the bot sheds load
+STATIC_MESSAGE_REPLIES = {"About": ABOUT_MESSAGE, "Support": SUPPORT_MESSAGE}
+STATIC_CALLBACK_REPLIES = {
+    'show_format': FORMAT_GUIDE_MESSAGE, 'code_help': CODE_HELP_MESSAGE, 'contact_support': CONTACT_SUPPORT_MESSAGE
+}
+
+def message_branch(update, context):
+    """Metric label for the handle_message branch an update will take"""
+    text = update.message.text if update.message else None
+    if update.effective_user and update.effective_user.id in user_sessions:
+        return 'code_session'
+    if text in MESSAGE_BRANCHES:
+        return text
+    if text in SERVICE_NAMES.values():
+        return 'service'
+    if text in DEPOSIT_METHODS:
+        return 'deposit_method'
+    if text and text.startswith(("Upload ", "Remove ", "Buy ")):
+        return text.split(' ', 1)[0]
+    return 'input'
+
+def callback_branch(update, context):
+    """Metric label for the handle_callback_query action"""
+    data = update.callback_query.data if update.callback_query else None
+    if data in CALLBACK_BRANCHES:
+        return data
+    if data and data.startswith('pdep:'):
+        return 'pending_deposits'
+    if data and data.startswith('restock:'):
+        return 'restock'
+    if data and data.startswith('stats:'):
+        return 'stats_export'
+    return 'other'
+
+# Purchases
+async def process_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE, service_key: str, text: str):
+    """Charge the buyer, reserve the accounts and stream them as files; refunds whatever could not be delivered"""
+    user_id = update.effective_user.id
+    name = SERVICE_NAMES[service_key]
+    try:
+        quantity = int(text)
+    except ValueError:
+        await update.message.reply_text("Please enter a valid quantity.")
+        return
+    if quantity <= 0:
+        await update.message.reply_text("Quantity must be greater than 0.")
+        return
+    
+    discount = calculate_discount(quantity)
+    total_cents = to_cents(get_price(service_key) * quantity * (100 - discount) / 100)
+    discount_cents = to_cents(get_price(service_key) * quantity) - total_cents
+    charged = await asyncio.to_thread(charge_purchase, user_id, service_key, quantity, total_cents, discount_cents)
+    if charged is None:
+        await update.message.reply_text(
+            f"Insufficient balance. {quantity} {name} accounts cost ${total_cents / 100:.2f}; "
+            f"your balance is ${get_balance(user_id):.2f}."
+        )
+        return
+    purchase_id, balance_cents = charged
+    
+    # The buyer has paid: any failure (or cancellation) before the accounts are delivered refunds the order.
+    # settle_purchase only moves 'paid' orders, so this is a no-op once a branch below has settled it
+    delivered = False
+    try:
+        reserved = await run_file_job(reserve_stock, service_key, quantity)
+        if reserved is None:
+            await asyncio.to_thread(settle_purchase, purchase_id, 'refunded')
+            stock_count = await run_file_job(get_stock_count, service_key)
+            if stock_count < quantity:
+                await update.message.reply_text(f"Not enough stock. Only {stock_count} {name} accounts are available.")
+            else:
+                await update.message.reply_text(
+                    f"Order #{purchase_id} could not be processed right now. ${total_cents / 100:.2f} has been refunded to your balance."
+                )
+            return
+        
+        try:
+            await update.message.reply_text(f"Payment received. Sending {quantity} {name} accounts...")
+        except Exception as e:
+            logger.warning(f"Could not acknowledge order #{purchase_id}: {e}")
+        try:
+            await deliver_accounts(context.bot, update.effective_chat.id, service_key, reserved, purchase_id)
+        except DeliveryError as e:
+            logger.error(str(e))
+            if e.parts_sent == 0:
+                await asyncio.to_thread(settle_purchase, purchase_id, 'refunded')
+                await update.message.reply_text(
+                    f"We could not deliver order #{purchase_id}. ${total_cents / 100:.2f} has been refunded to your balance."
+                )
+            else:
+                undelivered = await run_file_job(unsent_accounts, reserved, e.rows_sent)
+                refund_cents = await asyncio.to_thread(settle_partial_purchase, purchase_id, e.rows_sent, undelivered)
+                await update.message.reply_text(
+                    f"Order #{purchase_id} was only partly delivered ({e.rows_sent} of {quantity} accounts). "
+                    f"${(refund_cents or 0) / 100:.2f} for the rest has been refunded to your balance."
+                )
+            return
+        delivered = True
+        await asyncio.to_thread(settle_purchase, purchase_id, 'delivered')
+    except BaseException as e:
+        if not delivered:
+            logger.error(f"Order #{purchase_id} failed before delivery, refunding: {e!r}")
+            await asyncio.to_thread(settle_purchase, purchase_id, 'refunded')
+        raise
+    discount_line = f"Discount: {discount}%\n" if discount else ""
+    await update.message.reply_text(
+        f"Order #{purchase_id} complete!\n\n"
+        f"{quantity} {name} accounts\n"
+        f"{discount_line}"
+        f"Total: ${total_cents / 100:.2f}\n"
+        f"New balance: ${balance_cents / 100:.2f}"
+    )
+
+# Core Handlers
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle errors in the bot"""
+    update_id = update.update_id if isinstance(update, Update) else None
+    logger.error(f"Error occurred for update {update_id}: {context.error}", exc_info=context.error)
+    if isinstance(update, Update) and update.effective_message:
+        try:
+            await update.effective_message.reply_text("An error occurred. Please try again.")
+        except Exception as e:
+            logger.error(f"Failed to send error message: {e}")
+
+@timed('start')
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle the /start command"""
+    user_id = update.effective_user.id
+    username = update.effective_user.username or f"User_{user_id}"
+    
+    # Check if this is a referral start
+    referral_code = None
+    if context.args and context.args[0].startswith('REF'):
+        referral_code = context.args[0]
+    # Joins arriving together are committed in one transaction
+    await write_coalescer.submit(register_user, user_id, username, referral_code)
+    
+    welcome_message = f"Welcome to Account Verification Bot, {update.effective_user.first_name}!" + WELCOME_BODY
     
     await update.message.reply_text(welcome_message, reply_markup=get_main_keyboard(user_id))
 
+@timed('callback_query', callback_branch)
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle callback queries from inline keyboards"""
     query = update.callback_query
-    await query.answer()
     user_id = query.from_user.id
     data = query.data
+    # Stale or crafted pending deposits buttons are only answered, never handled
+    if data.startswith('pdep:') and parse_pending_deposits_callback(data) is None:
+        await query.answer("Invalid filter")
+        return
+    await query.answer()
     
     if data == 'main_menu':
         await query.message.reply_text("Main Menu", reply_markup=get_main_keyboard(user_id))
@@ -84,7 +318,7 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     elif data in ['get_hotmail_code', 'get_gmail_code']:
         service_type = 'hotmail' if data == 'get_hotmail_code' else 'gmail'
         format_text = CODE_FORMATS[service_type]
-        timeout_minutes = 15 if service_type == 'hotmail' else 10
+        timeout_minutes = CODE_SESSION_MINUTES[service_type]
         
         # Generate a session code
         session_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
@@ -114,45 +348,15 @@ Tips: Please provide your credentials correctly and receive code within {timeout
         await query.message.reply_text(links_message, reply_markup=get_code_links_keyboard())
     
     elif data == 'show_format':
-        format_message = f"""Code Format Guide
-
-Hotmail/Outlook Format: {CODE_FORMATS['hotmail']}
-
-Gmail Format: {CODE_FORMATS['gmail']}
-
-Note: For Hotmail/Outlook, all information is required. For Gmail, only email is needed."""
-        await query.message.reply_text(format_message)
+        await query.message.reply_text(FORMAT_GUIDE_MESSAGE)
     
     elif data == 'code_help':
-        help_message = f"""Code Help Center
-
-1. How to get codes?
-   - Click Get Code button
-   - Select your required service
-   - Send credentials in the provided format
-   - Bot will automatically fetch the code
-
-2. Session timeout?
-   - Hotmail/Outlook: 15 minutes
-   - Gmail: 10 minutes
-
-3. Credentials safe?
-   - 100% secure and encrypted
-   - Only used for code retrieval
-   - Never stored permanently
-
-4. Not getting codes?
-   - Check your credentials
-   - Ensure you have active codes
-   - Contact support if needed
-
-Support: {', '.join(SUPPORT_CONTACTS)}"""
-        await query.message.reply_text(help_message)
+        await query.message.reply_text(CODE_HELP_MESSAGE)
     
     elif data.startswith('retry_'):
         service_type = data.split('_')[1]
         format_text = CODE_FORMATS[service_type]
-        timeout_minutes = 15 if service_type == 'hotmail' else 10
+        timeout_minutes = CODE_SESSION_MINUTES[service_type]
         
         # Generate a new session code
         session_code = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
@@ -175,15 +379,164 @@ Session expires in {timeout_minutes} minutes
 Please send your credentials in the correct format."""
         await query.message.reply_text(format_message)
     
+    elif data.startswith('restock:'):
+        service_key = data.split(':', 1)[1]
+        if service_key in SERVICE_NAMES:
+            if await asyncio.to_thread(add_restock_subscription, user_id, service_key):
+                await query.message.reply_text(f"We'll message you when {SERVICE_NAMES[service_key]} is back in stock.")
+            else:
+                await query.message.reply_text(f"You're already on the list for {SERVICE_NAMES[service_key]}.")
+    
+    elif data.startswith('pdep:') and user_id in ADMIN_IDS:
+        await handle_pending_deposits_callback(query, context, data)
+    
+    elif data.startswith('stats:') and user_id in ADMIN_IDS:
+        _, period, fmt = data.split(':')
+        if period in ('hour', 'day') and fmt in ('csv', 'xlsx'):
+            await stats_recorder.flush()
+            header = ['Bucket (UTC)', 'Metric', 'Dimension', 'Events', 'Quantity', 'Amount']
+            temp_path = await run_file_job(write_export_file, iter_rollups(period), header, fmt)
+            try:
+                with open(temp_path, 'rb') as export_file:
+                    await query.message.reply_document(export_file, filename=f"stats_{'daily' if period == 'day' else 'hourly'}.{fmt}")
+            finally:
+                os.remove(temp_path)
+    
+    elif data == 'stop_watch':
+        if code_watcher.cancel(user_id):
+            await query.message.reply_text("Stopped waiting for your code.", reply_markup=get_code_menu_keyboard())
+    
     elif data == 'contact_support':
-        support_message = f"""Contact Support
+        await query.message.reply_text(CONTACT_SUPPORT_MESSAGE)
 
-For assistance, please contact our support team:
-{', '.join(SUPPORT_CONTACTS)}
+async def watch_for_code(update: Update, session_data, api_url, params, email, success_template):
+    """Hand a lookup that found no code to the code watcher for the rest of the session; False if no time is left"""
+    service_type = session_data['service_type']
+    ttl = CODE_SESSION_MINUTES[service_type] * 60 - (datetime.now() - session_data['created_at']).total_seconds()
+    if ttl <= 0 or not code_watcher.watch(update.effective_user.id, service_type, api_url, params, email, success_template, ttl):
+        return False
+    await update.message.reply_text(
+        f"No code for {email} yet. I'll keep checking for the next {max(1, round(ttl / 60))} minutes "
+        f"and send it here as soon as it arrives.",
+        reply_markup=get_code_watch_keyboard()
+    )
+    return True
 
-We're here to help you 24/7!"""
-        await query.message.reply_text(support_message)
+# Pending deposits admin view
+def parse_pending_deposits_callback(data: str):
+    """Split pdep callback data into (action, cursor_id, method, age); None if it is stale or malformed"""
+    try:
+        _, action, cursor_id, method, age = data.split(':')
+        cursor_id = int(cursor_id)
+    except ValueError:
+        return None
+    if action not in ('f', 'n', 'p', 'csv', 'xlsx') or method not in PENDING_METHOD_KEYS or age not in PENDING_AGE_LABELS:
+        return None
+    return action, cursor_id, method, age
+
+def render_pending_deposits_page(action: str, cursor_id: int, method: str, age: str):
+    """Render one page of pending deposits; action is 'f' (first), 'n' (after cursor_id) or 'p' (before cursor_id)"""
+    method_name = None if method == '-' else DEPOSIT_METHODS[int(method)]
+    if action == 'p':
+        rows, has_more = get_pending_deposits_page(before_id=cursor_id, method=method_name, age=age, limit=PENDING_DEPOSITS_PAGE_SIZE)
+        has_prev, has_next = has_more, True
+    else:
+        after_id = cursor_id if action == 'n' else 0
+        rows, has_more = get_pending_deposits_page(after_id=after_id, method=method_name, age=age, limit=PENDING_DEPOSITS_PAGE_SIZE)
+        has_prev, has_next = action == 'n', has_more
+    
+    if not rows:
+        # Keep the way back from a page that emptied, e.g. once the deposits past the cursor were settled
+        if action == 'n':
+            return "No more pending deposits.", get_pending_deposits_keyboard(cursor_id + 1, 0, True, False, method, age)
+        if action == 'p':
+            return "No earlier pending deposits.", get_pending_deposits_keyboard(0, cursor_id - 1, False, True, method, age)
+        deposits_message = "No pending deposits."
+        return deposits_message, get_pending_deposits_keyboard(0, 0, False, False, method, age)
+    
+    deposits_message = "Pending Deposits:\n\n"
+    for deposit in rows:
+        deposits_message += f"ID: {deposit[0]}\nUser: {deposit[2]} (ID: {deposit[1]})\nAmount: ${deposit[3]:.2f}\nMethod: {deposit[4]}\nTxn ID: {deposit[5] or 'Not provided'}\nCreated: {deposit[6]}\n\n"
+    
+    deposits_message += "Use /approve id or /reject id to process deposits (several IDs can be given at once)."
+    return deposits_message, get_pending_deposits_keyboard(rows[0][0], rows[-1][0], has_prev, has_next, method, age)
+
+async def handle_pending_deposits_callback(query, context: ContextTypes.DEFAULT_TYPE, data: str):
+    """Handle pagination, filter and export buttons of the pending deposits view"""
+    parsed = parse_pending_deposits_callback(data)
+    if parsed is None:
+        return
+    action, cursor_id, method, age = parsed
+    
+    if action in ('csv', 'xlsx'):
+        method_name = None if method == '-' else DEPOSIT_METHODS[int(method)]
+        header = ['ID', 'User ID', 'Username', 'Amount', 'Method', 'Transaction ID', 'Created At']
+        rows = iter_pending_deposits(method=method_name, age=age)
+        temp_path = await run_file_job(write_export_file, rows, header, action)
+        try:
+            with open(temp_path, 'rb') as export_file:
+                await query.message.reply_document(export_file, filename=f"pending_deposits.{action}")
+        finally:
+            os.remove(temp_path)
+        return
+    
+    deposits_message, reply_markup = render_pending_deposits_page(action, cursor_id, method, age)
+    try:
+        await query.edit_message_text(deposits_message, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Failed to update pending deposits view: {e}")
+
+def _stats_section(title: str, totals):
+    """One window of the Stats view from its (metric, dimension) -> (events, quantity, amount_cents) totals"""
+    def total(metric, dimension=None):
+        rows = [value for (name, dim), value in totals.items() if name == metric and dimension in (None, dim)]
+        return tuple(sum(column) for column in zip(*rows)) if rows else (0, 0, 0)
+    
+    orders, accounts, sales_cents = total('sales')
+    refunds, _, refund_cents = total('refunds')
+    lines = [title, f"Sales: {orders} orders, {accounts} accounts, ${sales_cents / 100:.2f}"]
+    for service_key, name in SERVICE_NAMES.items():
+        service_orders, service_accounts, service_cents = total('sales', service_key)
+        if service_orders:
+            lines.append(f"  {name}: {service_orders} orders, {service_accounts} accounts, ${service_cents / 100:.2f}")
+    lines.append(f"Discounts given: ${total('discounts')[2] / 100:.2f}")
+    lines.append(f"Refunds: {refunds} orders, ${refund_cents / 100:.2f}")
+    lines.append(f"Net revenue: ${(sales_cents - refund_cents) / 100:.2f}")
+    
+    requested, _, requested_cents = total('deposit_requests')
+    approved, _, approved_cents = total('deposits_approved')
+    lines.append(f"Deposits requested: {requested}, ${requested_cents / 100:.2f}")
+    lines.append(f"Deposits approved: {approved}, ${approved_cents / 100:.2f} (rejected: {total('deposits_rejected')[0]})")
+    for method in DEPOSIT_METHODS:
+        method_requested, _, _ = total('deposit_requests', method)
+        method_approved, _, method_cents = total('deposits_approved', method)
+        if method_requested or method_approved:
+            lines.append(f"  {method}: {method_requested} requested, {method_approved} approved, ${method_cents / 100:.2f}")
+    
+    for service_type in CODE_FORMATS:
+        sessions, found, _ = total('code_sessions', service_type)
+        if sessions:
+            lines.append(f"{service_type.capitalize()} codes: {found} of {sessions} sessions ({found * 100 / sessions:.0f}%)")
+    lines.append(f"New users: {total('signups')[0]} ({total('signups', 'referral')[0]} referred)")
+    return "\n".join(lines)
+
+def render_stats_message():
+    """Admin Stats view, read from the rollup tables"""
+    now = time()
+    return "Stats (UTC)\n\n" + "\n\n".join([
+        _stats_section("Last 24 hours", get_rollup_totals('hour', rollup_bucket('hour', now - 23 * 3600))),
+        _stats_section("Last 7 days", get_rollup_totals('day', rollup_bucket('day', now - 6 * 86400))),
+        _stats_section("Last 30 days", get_rollup_totals('day', rollup_bucket('day', now - 29 * 86400))),
+    ]) + "\n\nExport the full history below."
+
+def render_broadcast_preview(text: str, segment: str):
+    """Preview of a broadcast with its audience and recipient count"""
+    return (f"Broadcast Message Preview:\n\n{text}\n\n"
+            f"Audience: {SEGMENT_LABELS[segment]}\n"
+            f"Recipients: {count_segment(segment)} users\n\n"
+            f"Please confirm to send this message to these users.")
 
+@timed('message', message_branch)
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle all incoming messages"""
     user_id = update.effective_user.id
@@ -221,13 +574,11 @@ Checking for verification codes via API... Please wait while I fetch the latest
             
             if code:
                 # Success - send the code
-                success_msg = f"""Email: {email}
-Verification Code: {code}
-Code Validity: 10 minutes
-Tips: Use this code immediately as it will expire soon.
-Security Note: Never share this code with anyone."""
+                stats_recorder.record_code_session(service_type, True)
+                success_msg = HOTMAIL_CODE_MESSAGE.format(email=email, code=code)
                 await update.message.reply_text(success_msg, reply_markup=get_code_action_keyboard(service_type))
-            else:
+            elif not await watch_for_code(update, session_data, HOTMAIL_API_URL, params, email, HOTMAIL_CODE_MESSAGE):
+                stats_recorder.record_code_session(service_type, False)
                 # Error - show error message
                 error_msg = api_response.get('message', 'Unknown error occurred')
                 error_response = f"""Error: {error_msg}
@@ -264,13 +615,11 @@ Checking for Gmail codes via API... Please wait while I fetch the latest Gmail v
             
             if code:
                 # Success - send the code
-                success_msg = f"""Email: {email}
-Verification Code: {code}
-Code Validity: 10 minutes
-Tips: Use this code immediately for verification.
-Security Note: Protect your code and never share it."""
+                stats_recorder.record_code_session(service_type, True)
+                success_msg = GMAIL_CODE_MESSAGE.format(email=email, code=code)
                 await update.message.reply_text(success_msg, reply_markup=get_code_action_keyboard(service_type))
-            else:
+            elif not await watch_for_code(update, session_data, GMAIL_API_URL, params, email, GMAIL_CODE_MESSAGE):
+                stats_recorder.record_code_session(service_type, False)
                 # Error - show error message
                 error_msg = api_response.get('message', 'Unknown error occurred')
                 error_response = f"""There was an error accessing your messages. This could be due to:
@@ -289,12 +638,7 @@ Please try again later or contact support if the issue persists."""
     
     # Handle menu options
     if text == "Buy Accounts":
-        services_message = "Buy Accounts. Choose an account type to purchase:"
-        keyboard = [
-            [SERVICE_NAMES['hotmail'], SERVICE_NAMES['outlook']],
-            [SERVICE_NAMES['fb_gmail'], "Back"]
-        ]
-        await update.message.reply_text(services_message, reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+        await update.message.reply_text(SERVICES_MESSAGE, reply_markup=get_services_keyboard())
     
     elif text in SERVICE_NAMES.values():
         # Find the service key from the name
@@ -307,7 +651,24 @@ Please try again later or contact support if the issue persists."""
         if service_key:
             await update.message.reply_text(
                 f"{text} Account Purchase", 
-                reply_markup=get_service_buy_keyboard(service_key)
+                reply_markup=get_service_buy_keyboard(service_key, await run_file_job(get_stock_count, service_key))
+            )
+    
+    elif text.startswith("Buy ") and " - $" in text:
+        name = text[4:].rsplit(" - $", 1)[0]
+        service_key = next((key for key, service_name in SERVICE_NAMES.items() if service_name == name), None)
+        if service_key:
+            stock_count = await run_file_job(get_stock_count, service_key)
+            if stock_count == 0:
+                await update.message.reply_text(
+                    f"{name} is out of stock. Please check back later.", reply_markup=get_restock_keyboard(service_key)
+                )
+                return
+            context.user_data['purchase_service'] = service_key
+            await update.message.reply_text(
+                f"How many {name} accounts would you like to buy?\n"
+                f"Price: ${get_price(service_key):.2f} each\n"
+                f"Stock: {stock_count} available"
             )
     
     elif text == "Get Code":
@@ -322,7 +683,7 @@ Please try again later or contact support if the issue persists."""
         deposit_message = "Deposit Funds. Choose a deposit method:"
         await update.message.reply_text(deposit_message, reply_markup=get_deposit_method_keyboard())
     
-    elif text in ["BKash", "Nagad", "Rocket", "Bank Transfer", "Card"]:
+    elif text in DEPOSIT_METHODS:
         method = text
         await update.message.reply_text(f"Please send the amount you want to deposit via {method}.")
         # Store the deposit method in context for the next message
@@ -365,36 +726,10 @@ Buy more, save more!"""
         await update.message.reply_text(offers_message)
     
     elif text == "Support":
-        support_message = f"""Support
-
-For any assistance, please contact our support team:
-Support Contacts:"""
-        for support_id in SUPPORT_CONTACTS:
-            support_message += f"\n- {support_id}"
-        
-        support_message += """
-
-24/7 Support: Yes
-We're here to help you!"""
-        await update.message.reply_text(support_message)
+        await update.message.reply_text(SUPPORT_MESSAGE)
     
     elif text == "About":
-        about_message = """About Account Verification Bot
-
-We provide premium accounts and verification codes for:
-- Hotmail Accounts
-- Outlook Accounts
-- FB Gmail Accounts
-- Verification Codes
-
-Features:
-- 24/7 Active Service
-- 100% Guaranteed Accounts
-- Fast Delivery
-- 100% Secure
-
-Contact our support for any questions!"""
-        await update.message.reply_text(about_message)
+        await update.message.reply_text(ABOUT_MESSAGE)
     
     elif text == "Admin Panel" and user_id in ADMIN_IDS:
         await update.message.reply_text("Admin Panel", reply_markup=get_admin_panel_keyboard())
@@ -403,12 +738,7 @@ Contact our support for any questions!"""
         await update.message.reply_text("Main Menu", reply_markup=get_main_keyboard(user_id))
     
     elif text == "Back to Services":
-        services_message = "Buy Accounts. Choose an account type to purchase:"
-        keyboard = [
-            [SERVICE_NAMES['hotmail'], SERVICE_NAMES['outlook']],
-            [SERVICE_NAMES['fb_gmail'], "Back"]
-        ]
-        await update.message.reply_text(services_message, reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+        await update.message.reply_text(SERVICES_MESSAGE, reply_markup=get_services_keyboard())
     
     elif text == "Back":
         await update.message.reply_text("Main Menu", reply_markup=get_main_keyboard(user_id))
@@ -430,17 +760,15 @@ Contact our support for any questions!"""
         service = text.replace("Remove ", "").lower()
         if service in SERVICE_NAMES:
             # Remove the file
-            filename = SERVICE_FILES.get(service)
-            if os.path.exists(filename):
-                os.remove(filename)
+            if await run_file_job(remove_service_stock, service):
                 await update.message.reply_text(f"{SERVICE_NAMES[service]} file removed successfully.")
             else:
                 await update.message.reply_text(f"{SERVICE_NAMES[service]} file does not exist.")
     
     elif text == "Update Stocks" and user_id in ADMIN_IDS:
         stocks_message = "Current Stocks:\n"
-        for service, name in SERVICE_NAMES.items():
-            stock_count = get_stock_count(service)
+        stock_counts = await asyncio.gather(*(run_file_job(get_stock_count, service) for service in SERVICE_NAMES))
+        for (service, name), stock_count in zip(SERVICE_NAMES.items(), stock_counts):
             stocks_message += f"- {name}: {stock_count} accounts\n"
         
         await update.message.reply_text(stocks_message)
@@ -455,16 +783,21 @@ Contact our support for any questions!"""
         await update.message.reply_text(prices_message)
     
     elif text == "Pending Deposits" and user_id in ADMIN_IDS:
-        pending_deposits = get_pending_deposits()
-        if not pending_deposits:
-            await update.message.reply_text("No pending deposits.")
-        else:
-            deposits_message = "Pending Deposits:\n\n"
-            for deposit in pending_deposits:
-                deposits_message += f"ID: {deposit[0]}\nUser: {deposit[2]} (ID: {deposit[1]})\nAmount: ${deposit[3]:.2f}\nMethod: {deposit[4]}\nTxn ID: {deposit[5] or 'Not provided'}\n\n"
-            
-            deposits_message += "Use /approve id or /reject id to process deposits."
-            await update.message.reply_text(deposits_message)
+        deposits_message, reply_markup = render_pending_deposits_page('f', 0, '-', 'all')
+        await update.message.reply_text(deposits_message, reply_markup=reply_markup)
+    
+    elif text == "Reconcile Deposits" and user_id in ADMIN_IDS:
+        context.user_data['reconcile_statement'] = True
+        await update.message.reply_text(
+            "Send a bKash, Nagad or Rocket statement export (.csv or .xlsx).\n\n"
+            "Pending deposits whose transaction ID and amount match a statement line are approved; "
+            "everything else is listed in a report."
+        )
+    
+    elif text == "Stats" and user_id in ADMIN_IDS:
+        # Code session counts wait in memory until the next flush
+        await stats_recorder.flush()
+        await update.message.reply_text(render_stats_message(), reply_markup=get_stats_keyboard())
     
     elif text == "Broadcast" and user_id in ADMIN_IDS:
         await update.message.reply_text("Broadcast Message. Please send the message you want to broadcast to all users.", reply_markup=get_broadcast_keyboard())
@@ -486,17 +819,28 @@ Contact our support for any questions!"""
         message_text = context.user_data['broadcast_message']
         broadcast_id = save_broadcast_message_db(user_id, message_text)
         
-        # Get all user IDs
-        all_user_ids = get_all_user_ids()
+        # Get the reachable users in the chosen audience
+        all_user_ids = get_segment_user_ids(context.user_data.pop('broadcast_segment', 'all'))
         sent_count = 0
         
-        # Send broadcast to all users
-        for uid in all_user_ids:
+        async def send(uid):
             try:
-                await context.bot.send_message(chat_id=uid, text=message_text)
-                sent_count += 1
+                await context.bot.send_message(chat_id=uid, text=message_text, rate_limit_args='bulk')
+                BROADCAST_MESSAGES.labels('sent').inc()
+                return 1
             except Exception as e:
-                logger.error(f"Failed to send broadcast to user {uid}: {e}")
+                BROADCAST_MESSAGES.labels('failed').inc()
+                logger.error('Failed to send broadcast to user %s: %s', uid, e, extra={'sample': 'broadcast_failure'})
+                if is_unreachable(e):
+                    # Left out of later broadcasts until the user talks to the bot again
+                    activity_tracker.mark_blocked(uid)
+                return 0
+        
+        # Send broadcast to all users; the outbound scheduler paces the queued sends behind interactive replies
+        broadcast_start = perf_counter()
+        for i in range(0, len(all_user_ids), BROADCAST_BATCH_SIZE):
+            sent_count += sum(await asyncio.gather(*(send(uid) for uid in all_user_ids[i:i + BROADCAST_BATCH_SIZE])))
+        BROADCAST_SECONDS.observe(perf_counter() - broadcast_start)
         
         # Update broadcast count
         update_broadcast_count_db(broadcast_id, sent_count)
@@ -512,8 +856,17 @@ Contact our support for any questions!"""
         await update.message.reply_text("Broadcast cancelled.", reply_markup=get_admin_panel_keyboard())
         if 'broadcast_message' in context.user_data:
             del context.user_data['broadcast_message']
+        context.user_data.pop('broadcast_segment', None)
         del context.user_data['broadcast_mode']
     
+    elif text in AUDIENCE_SEGMENTS and user_id in ADMIN_IDS and 'broadcast_mode' in context.user_data:
+        segment = context.user_data['broadcast_segment'] = AUDIENCE_SEGMENTS[text]
+        if 'broadcast_message' in context.user_data:
+            preview = render_broadcast_preview(context.user_data['broadcast_message'], segment)
+        else:
+            preview = f"Audience: {SEGMENT_LABELS[segment]} ({count_segment(segment)} users). Now send the message to broadcast."
+        await update.message.reply_text(preview, reply_markup=get_broadcast_keyboard())
+    
     elif text == "Add Balance" and user_id in ADMIN_IDS:
         await update.message.reply_text("Please send the user ID and amount in the format: user_id amount\nExample: 123456789 100.50")
         context.user_data['add_balance_mode'] = True
@@ -522,13 +875,25 @@ Contact our support for any questions!"""
         await update.message.reply_text("Please send the user ID and message in the format: user_id message\nExample: 123456789 Hello, how are you?")
         context.user_data['send_message_mode'] = True
     
+    elif text == "User Segments" and user_id in ADMIN_IDS:
+        segments_message = "User Segments (reachable users):\n\n"
+        for segment, label in SEGMENT_LABELS.items():
+            segments_message += f"{label}: {count_segment(segment)}\n"
+        segments_message += f"\nBlocked the bot or unreachable: {count_blocked_users()}"
+        await update.message.reply_text(segments_message, reply_markup=get_manage_users_keyboard())
+    
     elif text == "View User Info" and user_id in ADMIN_IDS:
         await update.message.reply_text("Please send the user ID to view information.")
         context.user_data['view_user_mode'] = True
     
     else:
-        # Handle deposit amount input
-        if 'deposit_method' in context.user_data:
+        # Handle purchase quantity input
+        if 'purchase_service' in context.user_data:
+            service_key = context.user_data.pop('purchase_service')
+            await process_purchase(update, context, service_key, text)
+        
+        # Handle deposit amount input; the method stays set until the transaction ID arrives
+        elif 'deposit_method' in context.user_data and 'awaiting_transaction_id' not in context.user_data:
             try:
                 amount = float(text)
                 if amount <= 0:
@@ -537,6 +902,7 @@ Contact our support for any questions!"""
                 
                 method = context.user_data['deposit_method']
                 save_deposit_request(user_id, amount, method)
+                context.user_data['deposit_amount'] = amount
                 
                 await update.message.reply_text(
                     f"Deposit request submitted!\n\n"
@@ -556,7 +922,6 @@ Contact our support for any questions!"""
         # Handle transaction ID input
         elif 'awaiting_transaction_id' in context.user_data:
             # Get the latest deposit request for this user
-            from database import db_execute
             latest_request = db_execute(
                 'SELECT id FROM deposit_requests WHERE user_id = ? ORDER BY id DESC LIMIT 1', 
                 (user_id,), 
@@ -565,7 +930,13 @@ Contact our support for any questions!"""
             
             if latest_request:
                 request_id = latest_request[0]
-                update_deposit_transaction_id(request_id, text)
+                transaction_id = normalize_transaction_id(text)
+                if not update_deposit_transaction_id(request_id, transaction_id):
+                    await update.message.reply_text(
+                        "This transaction ID has already been submitted for another deposit.\n\n"
+                        "Please check it and send the transaction ID of your payment:"
+                    )
+                    return
                 await update.message.reply_text(
                     "Transaction ID recorded!\n\n"
                     "Your deposit request is now pending approval.\n"
@@ -581,8 +952,9 @@ Contact our support for any questions!"""
                                  f"User: {update.effective_user.username or update.effective_user.first_name} (ID: {user_id})\n"
                                  f"Amount: ${context.user_data.get('deposit_amount', 0):.2f}\n"
                                  f"Method: {context.user_data.get('deposit_method', 'Unknown')}\n"
-                                 f"Transaction ID: {text}\n\n"
-                                 f"Use /approve {request_id} or /reject {request_id} to process."
+                                 f"Transaction ID: {transaction_id}\n\n"
+                                 f"Use /approve {request_id} or /reject {request_id} to process.",
+                            rate_limit_args='admin'
                         )
                     except Exception as e:
                         logger.error(f"Failed to notify admin {admin_id}: {e}")
@@ -599,9 +971,7 @@ Contact our support for any questions!"""
         elif 'broadcast_mode' in context.user_data:
             context.user_data['broadcast_message'] = text
             await update.message.reply_text(
-                f"Broadcast Message Preview:\n\n{text}\n\n"
-                f"Recipients: {len(get_all_user_ids())} users\n\n"
-                f"Please confirm to send this message to all users.",
+                render_broadcast_preview(text, context.user_data.get('broadcast_segment', 'all')),
                 reply_markup=get_broadcast_keyboard()
             )
         
@@ -616,7 +986,10 @@ Contact our support for any questions!"""
                 target_user_id = int(parts[0])
                 amount = float(parts[1])
                 
-                update_user_balance(target_user_id, amount)
+                new_balance = await ledger_writer.post(target_user_id, amount, 'admin_credit')
+                if new_balance is None:
+                    await update.message.reply_text(f"User {target_user_id} not found.")
+                    return
                 
                 await update.message.reply_text(f"Added ${amount:.2f} to user {target_user_id}'s balance.")
                 
@@ -624,7 +997,8 @@ Contact our support for any questions!"""
                 try:
                     await context.bot.send_message(
                         chat_id=target_user_id,
-                        text=f"Admin has added ${amount:.2f} to your balance.\n\nYour new balance: ${get_balance(target_user_id):.2f}"
+                        text=f"Admin has added ${amount:.2f} to your balance.\n\nYour new balance: ${new_balance:.2f}",
+                        rate_limit_args='admin'
                     )
                 except Exception as e:
                     logger.error(f"Failed to notify user {target_user_id}: {e}")
@@ -649,7 +1023,8 @@ Contact our support for any questions!"""
                 try:
                     await context.bot.send_message(
                         chat_id=target_user_id,
-                        text=f"Message from Admin:\n\n{message}"
+                        text=f"Message from Admin:\n\n{message}",
+                        rate_limit_args='admin'
                     )
                     await update.message.reply_text(f"Message sent to user {target_user_id}.")
                 except Exception as e:
@@ -688,6 +1063,7 @@ Total Referrals: {user_data[5]}"""
             await update.message.reply_text("Invalid Command. Please select a valid option from the menu:", reply_markup=get_main_keyboard(user_id))
 
 # Admin command handlers
+@timed('command_setprice')
 @admin_only
 async def set_price_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Set price for a service"""
@@ -707,60 +1083,104 @@ async def set_price_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except ValueError:
         await update.message.reply_text("Please provide a valid price.")
 
-@admin_only
-async def approve_deposit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Approve a deposit request"""
-    if not context.args or len(context.args) < 1:
-        await update.message.reply_text("Usage: /approve <request_id>")
+async def _notify_deposit_users(context, settled, status):
+    """Notify the owners of settled deposit requests concurrently"""
+    async def notify(user_id, amount):
+        if status == 'approved':
+            text = f"Your deposit of ${amount:.2f} has been approved.\n\nYour new balance: ${get_balance(user_id):.2f}"
+        else:
+            text = f"Your deposit request of ${amount:.2f} has been rejected.\n\nPlease contact support if you believe this is an error."
+        try:
+            await context.bot.send_message(chat_id=user_id, text=text, rate_limit_args='admin')
+        except Exception as e:
+            logger.error(f"Failed to notify user {user_id}: {e}")
+    
+    await asyncio.gather(*(notify(user_id, amount) for _, user_id, amount in settled))
+
+async def _settle_deposits_command(update: Update, context: ContextTypes.DEFAULT_TYPE, status: str):
+    """Settle one or more deposit requests given as command arguments"""
+    command = 'approve' if status == 'approved' else 'reject'
+    if not context.args:
+        await update.message.reply_text(f"Usage: /{command} <request_id> [request_id ...]")
         return
     
     try:
-        request_id = int(context.args[0])
-        user_id, amount = process_deposit_decision_db(request_id, 'approved')
-        
-        if user_id and amount:
-            await update.message.reply_text(f"Deposit request #{request_id} approved. ${amount:.2f} added to user {user_id}'s balance.")
-            
-            # Notify the user
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"Your deposit of ${amount:.2f} has been approved.\n\nYour new balance: ${get_balance(user_id):.2f}"
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify user {user_id}: {e}")
-        else:
-            await update.message.reply_text(f"Deposit request #{request_id} not found or already processed.")
+        request_ids = list(dict.fromkeys(int(arg) for arg in context.args))
     except ValueError:
         await update.message.reply_text("Please provide a valid request ID.")
+        return
+    
+    settled = await asyncio.to_thread(settle_deposit_requests, request_ids, status)
+    settled_ids = {request_id for request_id, _, _ in settled}
+    
+    if len(request_ids) == 1:
+        request_id = request_ids[0]
+        if not settled:
+            await update.message.reply_text(f"Deposit request #{request_id} not found or already processed.")
+        elif status == 'approved':
+            _, user_id, amount = settled[0]
+            await update.message.reply_text(f"Deposit request #{request_id} approved. ${amount:.2f} added to user {user_id}'s balance.")
+        else:
+            await update.message.reply_text(f"Deposit request #{request_id} rejected.")
+    else:
+        summary = f"{len(settled)} of {len(request_ids)} deposit requests {status}."
+        if status == 'approved' and settled:
+            summary += f"\nTotal credited: ${sum(amount for _, _, amount in settled):.2f}"
+        skipped = [str(request_id) for request_id in request_ids if request_id not in settled_ids]
+        if skipped:
+            summary += f"\nNot found or already processed: {', '.join(skipped)}"
+        await update.message.reply_text(summary)
+    
+    await _notify_deposit_users(context, settled, status)
 
+@timed('command_approve')
+@admin_only
+async def approve_deposit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Approve one or more deposit requests"""
+    await _settle_deposits_command(update, context, 'approved')
+
+@timed('command_reject')
 @admin_only
 async def reject_deposit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Reject a deposit request"""
-    if not context.args or len(context.args) < 1:
-        await update.message.reply_text("Usage: /reject <request_id>")
+    """Reject one or more deposit requests"""
+    await _settle_deposits_command(update, context, 'rejected')
+
+@timed('command_profile')
+@admin_only
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Profile the running bot and send the sampled stacks and allocation growth as documents"""
+    try:
+        seconds = float(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = 0
+    mode = context.args[1].lower() if len(context.args or ()) > 1 else 'full'
+    if not 0 < seconds <= PROFILE_MAX_SECONDS or mode not in ('full', 'stacks'):
+        await update.message.reply_text(
+            f"Usage: /profile [seconds] [full|stacks]\nSeconds must be between 1 and {PROFILE_MAX_SECONDS}. "
+            "'stacks' skips allocation tracing, which slows handlers down."
+        )
+        return
+    if sampler.running:
+        await update.message.reply_text("A profile is already running.")
         return
     
+    await update.message.reply_text(f"Profiling for {seconds:g}s...")
     try:
-        request_id = int(context.args[0])
-        user_id, amount = process_deposit_decision_db(request_id, 'rejected')
-        
-        if user_id:
-            await update.message.reply_text(f"Deposit request #{request_id} rejected.")
-            
-            # Notify the user
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"Your deposit request of ${amount:.2f} has been rejected.\n\nPlease contact support if you believe this is an error."
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify user {user_id}: {e}")
-        else:
-            await update.message.reply_text(f"Deposit request #{request_id} not found or already processed.")
-    except ValueError:
-        await update.message.reply_text("Please provide a valid request ID.")
+        stacks, allocation_report, samples = await profile_for(seconds, allocations=mode == 'full')
+    except RuntimeError as e:
+        await update.message.reply_text(f"{e}.")
+        return
+    
+    summary = f"Profile: {samples} samples over {seconds:g}s\n\nMost sampled functions:\n"
+    summary += "\n".join(f"- {function}: {count}" for function, count in top_functions(stacks))
+    await update.message.reply_text(summary)
+    stamp = datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    collapsed = await asyncio.to_thread(format_collapsed, stacks)
+    await update.message.reply_document(collapsed.encode(), filename=f"profile-{stamp}.folded")
+    if allocation_report:
+        await update.message.reply_document(allocation_report.encode(), filename=f"allocations-{stamp}.txt")
 
+@timed('command_adddiscount')
 @admin_only
 async def add_discount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Add a discount setting"""
@@ -777,6 +1197,7 @@ async def add_discount_command(update: Update, context: ContextTypes.DEFAULT_TYP
     except ValueError:
         await update.message.reply_text("Please provide valid numbers.")
 
+@timed('command_removediscount')
 @admin_only
 async def remove_discount_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Remove a discount setting"""
@@ -791,6 +1212,7 @@ async def remove_discount_command(update: Update, context: ContextTypes.DEFAULT_
     except ValueError:
         await update.message.reply_text("Please provide a valid quantity.")
 
+@timed('command_setreferral')
 @admin_only
 async def set_referral_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Set referral bonuses"""
@@ -807,7 +1229,46 @@ async def set_referral_command(update: Update, context: ContextTypes.DEFAULT_TYP
     except ValueError:
         await update.message.reply_text("Please provide valid bonus amounts.")
 
+async def _reconcile_statement_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reconcile pending deposits against an uploaded payment statement"""
+    document = update.message.document
+    if not document.file_name.lower().endswith(('.csv', '.xlsx')):
+        await update.message.reply_text("Please upload the statement as a .csv or .xlsx file.")
+        return
+    
+    file = await context.bot.get_file(document.file_id)
+    try:
+        content = await file.download_as_bytearray()
+        result = await run_file_job(reconcile_statement, bytes(content), document.file_name)
+    except ValueError as e:
+        await update.message.reply_text(f"Could not read the statement: {e}")
+        return
+    except Exception as e:
+        logger.error(f"Error reconciling statement {document.file_name}: {e}")
+        await update.message.reply_text("Error reconciling the statement. Please try again.")
+        return
+    
+    summary = (f"Statement: {result.lines_read} lines read, {result.lines_skipped} skipped"
+               f"{f' ({result.method})' if result.method else ''}\n"
+               f"Approved: {len(result.settled)} deposits, ${sum(amount for _, _, amount in result.settled):.2f}\n"
+               f"Pending without a statement line: {result.pending_unmatched}")
+    counts = result.flag_counts()
+    if counts:
+        summary += "\n\nFlagged:\n" + "\n".join(f"- {flag}: {count}" for flag, count in sorted(counts.items()))
+    await update.message.reply_text(summary)
+    
+    if result.flagged:
+        temp_path = await run_file_job(write_export_file, result.flagged, REPORT_HEADER, 'csv')
+        try:
+            with open(temp_path, 'rb') as report_file:
+                await update.message.reply_document(report_file, filename="reconciliation_flags.csv")
+        finally:
+            os.remove(temp_path)
+    
+    await _notify_deposit_users(context, result.settled, 'approved')
+
 # File handler for admin uploads
+@timed('document')
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle document uploads for admin"""
     user_id = update.effective_user.id
@@ -815,6 +1276,10 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Access denied. Admin only feature.")
         return
     
+    if context.user_data.pop('reconcile_statement', None):
+        await _reconcile_statement_upload(update, context)
+        return
+    
     if 'upload_service' not in context.user_data:
         await update.message.reply_text("Please use the admin panel to upload files.")
         return
@@ -827,13 +1292,12 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Please upload an Excel file (.xlsx or .xls).")
         return
     
-    # Download the file
+    # Download into memory, then validate and store it off the event loop
     file = await context.bot.get_file(document.file_id)
-    filename = SERVICE_FILES[service]
     
     try:
-        await file.download_to_drive(filename)
-        stock_count = get_stock_count(service)
+        content = await file.download_as_bytearray()
+        stock_count = await run_file_job(store_service_upload, service, bytes(content))
         await update.message.reply_text(f"{SERVICE_NAMES[service]} file uploaded successfully.\nCurrent stock: {stock_count} accounts.")
     except Exception as e:
         logger.error(f"Error downloading file: {e}")
@@ -0,0 +1,217 @@
+"""Per-service in-memory inventory cache.
+
+Each service's accounts are kept in a single packed UTF-8 buffer: one
+record per account, with cells joined by a unit separator. An array of
+row offsets indexes the buffer. Purchases advance a head index, so taking
+N accounts costs O(N) and does not depend on stock size. Full rows are
+only decoded at delivery time. The popped prefix is compacted away once
+it outgrows the live part.
+
+The workbook itself is not rewritten per purchase. The number of its rows
+already sold is kept next to it (<workbook>.head), keyed by the
+workbook's mtime and size so a replaced workbook starts from zero. The
+workbook is rewritten without the sold rows in the background once they
+outnumber the unsold ones.
+"""
+import os
+import logging
+import threading
+from array import array
+from config import SERVICE_FILES
+from xlsx_import import read_workbook_rows
+
+logger = logging.getLogger(__name__)
+
+SEP = '\x1f'
+
+def _pack_cell(cell):
+    if cell is None:
+        return ''
+    return str(cell).replace(SEP, ' ')
+
+def _decode_rows(buf, offsets, start, stop):
+    return [
+        tuple(cell or None for cell in buf[offsets[i]:offsets[i + 1]].decode().split(SEP))
+        for i in range(start, stop)
+    ]
+
+class ReservedRows:
+    """Accounts taken out of stock for one order, decoded a chunk at a time when delivered"""
+    __slots__ = ('_buf', '_offsets', '_start', '_stop', '_decode')
+
+    def __init__(self, buf, offsets, start, stop, decode=_decode_rows):
+        self._buf, self._offsets, self._start, self._stop, self._decode = buf, offsets, start, stop, decode
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def chunks(self, size, skip=0):
+        """Yield the reserved rows, after the first `skip`, as lists of at most `size` rows"""
+        for start in range(self._start + skip, self._stop, size):
+            yield self._decode(self._buf, self._offsets, start, min(start + size, self._stop))
+
+def _file_stamp(filename):
+    try:
+        st = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def load_sold(filename, stamp):
+    """Rows already sold from the workbook with this stamp, per its .head file"""
+    try:
+        with open(f"{filename}.head") as f:
+            for line in f:
+                mtime_ns, size, sold = map(int, line.split())
+                if (mtime_ns, size) == stamp:
+                    return sold
+    except (OSError, ValueError):
+        pass
+    return 0
+
+def save_sold(filename, counts):
+    """Atomically record {workbook stamp: rows sold} in the workbook's .head file"""
+    temp_path = f"{filename}.head.tmp"
+    with open(temp_path, 'w') as f:
+        for (mtime_ns, size), sold in counts.items():
+            f.write(f"{mtime_ns} {size} {sold}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, f"{filename}.head")
+
+class PackedInventory:
+    """Accounts for one service, packed into one buffer with a row offset index"""
+    __slots__ = ('header', '_buf', '_offsets', '_head', 'stamp', 'sold')
+
+    def __init__(self, header, records, stamp=None, sold=0):
+        self.header = tuple(header)
+        self._buf = buf = bytearray()
+        self._offsets = offsets = array('Q', [0])
+        for record in records:
+            buf += record.encode()
+            offsets.append(len(buf))
+        self._head = 0
+        self.stamp = stamp
+        # Rows of the workbook on disk that have been sold since it was written
+        self.sold = sold
+
+    @classmethod
+    def from_rows(cls, rows, stamp=None, sold=0):
+        """Pack parsed workbook rows, skipping the first `sold` data rows; the first row is the header"""
+        if not rows:
+            return cls((), [], stamp)
+        sold = min(sold, len(rows) - 1)
+        return cls(rows[0], (SEP.join(map(_pack_cell, row)) for row in rows[1 + sold:]), stamp, sold)
+
+    @classmethod
+    def load(cls, filename):
+        """Read a service workbook, less the rows its .head file records as sold, into a packed inventory"""
+        stamp = _file_stamp(filename)
+        rows = []
+        if stamp:
+            try:
+                rows = read_workbook_rows(filename)
+            except Exception as e:
+                logger.error(f"Error reading Excel file {filename}: {e}")
+        return cls.from_rows(rows, stamp, load_sold(filename, stamp) if stamp else 0)
+
+    def __len__(self):
+        return len(self._offsets) - 1 - self._head
+
+    def peek(self, count):
+        """Materialize the next `count` rows without removing them"""
+        start = self._head
+        return _decode_rows(self._buf, self._offsets, start, min(start + count, len(self._offsets) - 1))
+
+    def pop(self, count):
+        """Remove and materialize the next `count` rows (fewer if stock runs out)"""
+        rows = self.peek(count)
+        self._head += len(rows)
+        self.sold += len(rows)
+        if self._head > len(self):
+            self._compact()
+        return rows
+
+    def reserve(self, count):
+        """Take exactly `count` rows out of stock without decoding them; None if there are fewer"""
+        if count > len(self):
+            return None
+        # Compaction swaps in a new buffer rather than trimming this one, so the reservation stays valid
+        reserved = ReservedRows(self._buf, self._offsets, self._head, self._head + count)
+        self._head += count
+        self.sold += count
+        if self._head > len(self):
+            self._compact()
+        return reserved
+
+    def remaining(self):
+        """The unsold rows as of the call, as a view that later purchases and compaction leave intact"""
+        return ReservedRows(self._buf, self._offsets, self._head, len(self._offsets) - 1)
+
+    def iter_rows(self):
+        """Yield the remaining rows, decoding a batch at a time"""
+        for start in range(self._head, len(self._offsets) - 1, 1000):
+            yield from _decode_rows(self._buf, self._offsets, start, min(start + 1000, len(self._offsets) - 1))
+
+    def _compact(self):
+        base = self._offsets[self._head]
+        self._buf = self._buf[base:]
+        self._offsets = array('Q', (offset - base for offset in self._offsets[self._head:]))
+        self._head = 0
+
+    def nbytes(self):
+        """Approximate memory held by the buffer and the offset index"""
+        return len(self._buf) + self._offsets.itemsize * len(self._offsets)
+
+class InventoryCache:
+    """Lazily loaded PackedInventory per service, reloaded when its workbook changes on disk"""
+
+    def __init__(self, files=SERVICE_FILES):
+        self.files = files
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    def get(self, service_key):
+        """Return the service's inventory, loading or reloading it from its workbook if needed"""
+        filename = self.files.get(service_key)
+        if not filename:
+            return None
+        with self._lock:
+            entry = self._entries.get(service_key)
+            if entry is None or entry.stamp != _file_stamp(filename):
+                entry = self._entries[service_key] = PackedInventory.load(filename)
+            return entry
+
+    def record_sold(self, service_key, inventory, count):
+        """Persist that `count` more rows of the service's workbook are sold, before they are taken"""
+        with self._lock:
+            save_sold(self.files[service_key], {inventory.stamp: inventory.sold + count})
+
+    def replace_workbook(self, service_key, inventory, stamp, sold, temp_path):
+        """Swap in a rewrite of the workbook with `stamp` that drops its first `sold` rows; False if it changed meanwhile"""
+        filename = self.files[service_key]
+        with self._lock:
+            if self._entries.get(service_key) is not inventory or inventory.stamp != stamp or _file_stamp(filename) != stamp:
+                return False
+            new_stamp = _file_stamp(temp_path)
+            remaining = inventory.sold - sold
+            # Should the process stop between these steps, either workbook still finds its own sold count
+            save_sold(filename, {stamp: inventory.sold, new_stamp: remaining})
+            os.replace(temp_path, filename)
+            inventory.stamp, inventory.sold = new_stamp, remaining
+            save_sold(filename, {new_stamp: remaining})
+            return True
+
+    def invalidate(self, service_key=None):
+        """Drop one service (or every service) so the next access reloads from disk"""
+        with self._lock:
+            if service_key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(service_key, None)
+
+    @property
+    def lock(self):
+        return self._lock
+
+inventory_cache = InventoryCache()
@@ -1,11 +1,16 @@
+from functools import lru_cache
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from utils import get_stock_count  # Import from utils instead of database
-from database import get_price, get_discount_settings, get_referral_settings
-from config import SERVICE_NAMES, SERVICE_FILES, ADMIN_IDS
+from database import get_price
+from config import SERVICE_NAMES, ADMIN_IDS, DEPOSIT_METHODS
 
+# Keyboards are immutable once built, so every static one is built once and shared between updates
 def get_main_keyboard(user_id: int):
     """Get main keyboard based on user role"""
-    is_admin = user_id in ADMIN_IDS
+    return _main_keyboard(user_id in ADMIN_IDS)
+
+@lru_cache(maxsize=2)
+def _main_keyboard(is_admin: bool):
     items = []
     
     # Common buttons for all users
@@ -20,16 +25,18 @@ def get_main_keyboard(user_id: int):
     
     return ReplyKeyboardMarkup(items, resize_keyboard=True)
 
+@lru_cache(maxsize=None)
 def get_admin_panel_keyboard():
     """Get admin panel keyboard"""
     return ReplyKeyboardMarkup([
         ["Upload Hotmail", "Upload Outlook", "Upload FB Gmail"],
         ["Remove Files", "Update Stocks"],
-        ["Set Prices", "Pending Deposits"],
+        ["Set Prices", "Pending Deposits", "Reconcile Deposits", "Stats"],
         ["Broadcast", "Manage Users"],
         ["Discount Settings", "Referral Settings", "Settings", "Main Menu"]
     ], resize_keyboard=True)
 
+@lru_cache(maxsize=None)
 def get_remove_files_keyboard():
     """Get remove files keyboard"""
     return ReplyKeyboardMarkup([
@@ -37,33 +44,60 @@ def get_remove_files_keyboard():
         ["Back to Admin Panel"]
     ], resize_keyboard=True)
 
+# Broadcast audiences, keyed like database.USER_SEGMENTS
+SEGMENT_LABELS = {'all': 'All users', 'active_7d': 'Active 7 days', 'active_30d': 'Active 30 days', 'balance': 'Has balance'}
+
+@lru_cache(maxsize=None)
 def get_broadcast_keyboard():
     """Get broadcast keyboard"""
+    audiences = [f"Audience: {label}" for label in SEGMENT_LABELS.values()]
     return ReplyKeyboardMarkup([
         ["Confirm Broadcast", "Edit Message"],
+        audiences[:2],
+        audiences[2:],
         ["Cancel Broadcast"]
     ], resize_keyboard=True)
 
+@lru_cache(maxsize=None)
 def get_deposit_method_keyboard():
     """Get deposit method keyboard"""
     return ReplyKeyboardMarkup([
-        ["BKash", "Nagad", "Rocket"],
-        ["Bank Transfer", "Card"],
+        DEPOSIT_METHODS[:3],
+        DEPOSIT_METHODS[3:],
         ["Cancel"]
     ], resize_keyboard=True)
 
-def get_service_buy_keyboard(service_key: str):
-    """Get service buy keyboard"""
+@lru_cache(maxsize=None)
+def get_services_keyboard():
+    """Get account type selection keyboard"""
+    return ReplyKeyboardMarkup([
+        [SERVICE_NAMES['hotmail'], SERVICE_NAMES['outlook']],
+        [SERVICE_NAMES['fb_gmail'], "Back"]
+    ], resize_keyboard=True)
+
+def get_service_buy_keyboard(service_key: str, stock_count: int = None):
+    """Get service buy keyboard; rebuilt only when the price or stock count changes"""
+    if stock_count is None:
+        stock_count = get_stock_count(service_key)
+    return _service_buy_keyboard(service_key, get_price(service_key), stock_count)
+
+@lru_cache(maxsize=64)
+def _service_buy_keyboard(service_key: str, price: float, stock_count: int):
     keyboard = []
-    stock_count = get_stock_count(service_key)
-    price = get_price(service_key)
-    
     keyboard.append([f"Buy {SERVICE_NAMES.get(service_key, service_key)} - ${price}"])
     keyboard.append([f"Stock: {stock_count} available"])
     keyboard.append(["Back to Services"])
     
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+@lru_cache(maxsize=None)
+def get_restock_keyboard(service_key: str):
+    """Get back-in-stock subscription keyboard"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Notify me when it's back", callback_data=f'restock:{service_key}')]
+    ])
+
+@lru_cache(maxsize=None)
 def get_code_menu_keyboard():
     """Get code menu keyboard"""
     return InlineKeyboardMarkup([
@@ -75,6 +109,7 @@ def get_code_menu_keyboard():
         [InlineKeyboardButton("Main Menu", callback_data='main_menu')]
     ])
 
+@lru_cache(maxsize=None)
 def get_code_action_keyboard(service_type: str, is_error: bool = False):
     """Get code action keyboard"""
     buttons = []
@@ -89,6 +124,15 @@ def get_code_action_keyboard(service_type: str, is_error: bool = False):
     
     return InlineKeyboardMarkup(buttons)
 
+@lru_cache(maxsize=None)
+def get_code_watch_keyboard():
+    """Get keyboard shown while a code is being watched for"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Stop Waiting", callback_data='stop_watch')],
+        [InlineKeyboardButton("Main Menu", callback_data='main_menu')]
+    ])
+
+@lru_cache(maxsize=None)
 def get_code_links_keyboard():
     """Get code links keyboard"""
     return InlineKeyboardMarkup([
@@ -98,6 +142,7 @@ def get_code_links_keyboard():
         [InlineKeyboardButton("Back to Code Menu", callback_data='get_code_menu')]
     ])
 
+@lru_cache(maxsize=None)
 def get_discount_settings_keyboard():
     """Get discount settings keyboard"""
     return InlineKeyboardMarkup([
@@ -108,6 +153,7 @@ def get_discount_settings_keyboard():
         [InlineKeyboardButton("Back to Admin", callback_data='back_to_admin')]
     ])
 
+@lru_cache(maxsize=None)
 def get_referral_settings_keyboard():
     """Get referral settings keyboard"""
     return InlineKeyboardMarkup([
@@ -116,9 +162,51 @@ def get_referral_settings_keyboard():
         [InlineKeyboardButton("Back to Admin", callback_data='back_to_admin')]
     ])
 
+@lru_cache(maxsize=None)
 def get_manage_users_keyboard():
     """Get manage users keyboard"""
     return ReplyKeyboardMarkup([
         ["Add Balance", "Send Message"],
-        ["View User Info", "Cancel"]
-    ], resize_keyboard=True)
\ No newline at end of file
+        ["View User Info", "User Segments"],
+        ["Cancel"]
+    ], resize_keyboard=True)
+
+PENDING_AGE_LABELS = {'all': 'Any age', '1h': 'Last hour', '24h': 'Last 24h', 'old': 'Older than 24h'}
+# Method filter keys carried in pdep callback data: '-' for all methods, else an index into DEPOSIT_METHODS
+PENDING_METHOD_KEYS = ('-',) + tuple(str(i) for i in range(len(DEPOSIT_METHODS)))
+
+def get_pending_deposits_keyboard(first_id: int, last_id: int, has_prev: bool, has_next: bool, method: str, age: str):
+    """Get pending deposits pagination, filter and export keyboard"""
+    ages = list(PENDING_AGE_LABELS)
+    methods = PENDING_METHOD_KEYS
+    next_method = methods[(methods.index(method) + 1) % len(methods)]
+    next_age = ages[(ages.index(age) + 1) % len(ages)]
+    method_label = 'All methods' if method == '-' else DEPOSIT_METHODS[int(method)]
+    
+    buttons = []
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("< Prev", callback_data=f'pdep:p:{first_id}:{method}:{age}'))
+    if has_next:
+        nav.append(InlineKeyboardButton("Next >", callback_data=f'pdep:n:{last_id}:{method}:{age}'))
+    if nav:
+        buttons.append(nav)
+    buttons.append([
+        InlineKeyboardButton(method_label, callback_data=f'pdep:f:0:{next_method}:{age}'),
+        InlineKeyboardButton(PENDING_AGE_LABELS[age], callback_data=f'pdep:f:0:{method}:{next_age}')
+    ])
+    buttons.append([
+        InlineKeyboardButton("Export CSV", callback_data=f'pdep:csv:0:{method}:{age}'),
+        InlineKeyboardButton("Export XLSX", callback_data=f'pdep:xlsx:0:{method}:{age}')
+    ])
+    return InlineKeyboardMarkup(buttons)
+
+@lru_cache(maxsize=None)
+def get_stats_keyboard():
+    """Get stats export keyboard"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Daily CSV", callback_data='stats:day:csv'),
+         InlineKeyboardButton("Daily XLSX", callback_data='stats:day:xlsx')],
+        [InlineKeyboardButton("Hourly CSV", callback_data='stats:hour:csv'),
+         InlineKeyboardButton("Hourly XLSX", callback_data='stats:hour:xlsx')]
+    ])
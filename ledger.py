@@ -0,0 +1,32 @@
+import asyncio
+import logging
+from config import LEDGER_MAINTENANCE_INTERVAL
+from database import post_ledger_entry, take_balance_snapshots, reconcile_ledger, to_cents
+from coalescer import write_coalescer
+
+logger = logging.getLogger(__name__)
+
+class LedgerWriter:
+    """Balance changes posted through the write coalescer, so those within a few milliseconds share one transaction"""
+    
+    async def post(self, user_id: int, amount: float, reason: str, ref_id: int = None):
+        """Credit (or debit, if negative) a user's balance and return the new balance, or None for unknown users"""
+        balance_cents = await write_coalescer.submit(post_ledger_entry, user_id, to_cents(amount), reason, ref_id)
+        return None if balance_cents is None else balance_cents / 100
+
+ledger_writer = LedgerWriter()
+
+async def ledger_maintenance_job(interval: float = LEDGER_MAINTENANCE_INTERVAL):
+    """Periodically snapshot balances and reconcile the ledger against the snapshots"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            snapshots = await asyncio.to_thread(take_balance_snapshots)
+            mismatches = await asyncio.to_thread(reconcile_ledger)
+        except Exception as e:
+            logger.error(f"Ledger maintenance failed: {e}")
+            continue
+        if mismatches:
+            logger.error(f"Ledger reconciliation found {len(mismatches)} mismatches: {mismatches[:20]}")
+        else:
+            logger.info(f"Ledger reconciled, {snapshots} balance snapshots taken")
@@ -0,0 +1,119 @@
+import atexit
+import json
+import logging
+import queue
+import re
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+# key=value / "key": "value" pairs whose values must never reach the logs
+_SECRET_PAIR = re.compile(
+    r'(?i)\b(password|passwd|pwd|token|access_token|refresh_token|client_id|client_secret|secret|code)'
+    r'(["\']?\s*[:=]\s*["\']?)([^"\'\s,&|}]+)'
+)
+# Telegram bot tokens: <bot id>:<35 char secret>
+_BOT_TOKEN = re.compile(r'\b\d{6,12}:[A-Za-z0-9_-]{30,}\b')
+# Hotmail credential lines: email|password|token|client_id
+_CREDENTIAL_LINE = re.compile(r'([^\s|]+@[^\s|]+)\|[^\s|]+\|[^\s|]+\|[^\s|]+')
+
+def redact(text: str) -> str:
+    """Mask passwords, tokens, codes and credential lines in a log message"""
+    text = _BOT_TOKEN.sub('***', text)
+    text = _CREDENTIAL_LINE.sub(r'\1|***|***|***', text)
+    return _SECRET_PAIR.sub(r'\1\2***', text)
+
+class RedactingFilter(logging.Filter):
+    """Rewrite the rendered message with secrets masked"""
+    
+    def filter(self, record):
+        record.msg = redact(record.getMessage())
+        record.args = None
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text)
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Keep one in N records tagged with extra={'sample': <event>}; untagged records always pass"""
+    
+    def __init__(self, rates):
+        super().__init__()
+        self.every = {event: max(1, round(1 / rate)) for event, rate in rates.items() if rate > 0}
+        self.dropped = {event for event, rate in rates.items() if rate <= 0}
+        self.counts = dict.fromkeys(self.every, 0)
+    
+    def filter(self, record):
+        event = getattr(record, 'sample', None)
+        if event is None:
+            return True
+        if event in self.dropped:
+            return False
+        every = self.every.get(event)
+        if every is None:
+            return True
+        count = self.counts[event]
+        self.counts[event] = count + 1
+        if count % every:
+            return False
+        record.sample_rate = 1 / every
+        return True
+
+# Attributes every LogRecord has; anything else came in through extra= and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, any extra fields and the traceback"""
+    
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value if isinstance(value, (str, int, float, bool, type(None))) else str(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = redact(self.formatException(record.exc_info))
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+_listener = None
+
+def setup_logging(level=logging.INFO, fmt='json', sample_rates=None, stream=None):
+    """Route all logging through a queue so handlers never block the event loop; returns the listener"""
+    global _listener
+    stop_logging()
+    
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.addFilter(RedactingFilter())
+    if fmt == 'json':
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    if sample_rates:
+        queue_handler.addFilter(SamplingFilter(sample_rates))
+    
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # httpx logs every Bot API request at INFO, including the bot token in the URL
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+def stop_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,132 @@
+"""Event-loop lag measurement and a watchdog for handlers that block the loop.
+
+A task on the loop sleeps LOOP_LAG_INTERVAL at a time and records how
+late each wake-up was in bot_event_loop_lag_seconds. A watchdog thread
+checks the time of the last wake-up. Once the loop has not woken for
+LOOP_STALL_THRESHOLD, the thread captures the loop thread's stack while
+the loop is still blocked. The @timed wrapper frame on that stack names
+the handler and its branch, and holds the update. When the loop
+recovers, the stall is counted in bot_event_loop_stalls_total under
+those labels and logged with the stack. Stalls longer than
+LOOP_STALL_ALERT_SECONDS are sent to the admins.
+
+Between stalls, all this costs one timer per interval and one thread
+wake-up per half interval.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+import types
+from telegram import Update
+from config import ADMIN_IDS, LOOP_LAG_INTERVAL, LOOP_STALL_THRESHOLD, LOOP_STALL_ALERT_SECONDS, LOOP_STALL_ALERT_COOLDOWN
+from metrics import LOOP_LAG_SECONDS, LOOP_STALLS, timed
+
+logger = logging.getLogger(__name__)
+
+def _nested_code(code, name):
+    return next(const for const in code.co_consts if isinstance(const, types.CodeType) and const.co_name == name)
+
+# Code object shared by every @timed handler wrapper
+_TIMED_WRAPPER = _nested_code(_nested_code(timed.__code__, 'decorator'), 'wrapper')
+
+def update_type(update) -> str:
+    """Kind of update, e.g. 'message' or 'callback_query'"""
+    if not isinstance(update, Update):
+        return '-'
+    return next((kind for kind in Update.ALL_TYPES if getattr(update, kind, None) is not None), '-')
+
+def blocking_handler(frame):
+    """(handler, branch, update type) of the innermost @timed handler on a stack; '-' outside handlers"""
+    while frame is not None:
+        if frame.f_code is _TIMED_WRAPPER:
+            local = frame.f_locals
+            return local.get('handler', '-'), local.get('branch', '-'), update_type(local.get('update'))
+        frame = frame.f_back
+    return '-', '-', '-'
+
+class LoopMonitor:
+    """Lag timer on the event loop plus a watchdog thread that catches whatever blocks it"""
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD,
+                 alert_after: float = LOOP_STALL_ALERT_SECONDS, alert_cooldown: float = LOOP_STALL_ALERT_COOLDOWN):
+        self.interval = interval
+        self.threshold = threshold
+        self.alert_after = alert_after
+        self.alert_cooldown = alert_cooldown
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._captured = None
+        self._loop_thread = None
+        self._bot = None
+        self._last_alert = float('-inf')
+        self._stop = threading.Event()
+        self._thread = None
+        self._task = None
+
+    def start(self, bot=None):
+        """Start timing the running loop; stalls are also sent to the admins through bot, if given"""
+        self._bot = bot
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._captured = None
+        self._stop.clear()
+        self._task = asyncio.create_task(self._run())
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        """Stop the timer and the watchdog thread"""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        thread, self._thread = self._thread, None
+        if thread:
+            self._stop.set()
+            thread.join()
+
+    async def _run(self):
+        while True:
+            beat = self._beat
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG_SECONDS.observe(max(0.0, now - beat - self.interval))
+            self._beat = now
+            captured, self._captured = self._captured, None
+            # A capture taken just as the loop woke belongs to no stall
+            if captured and captured[0] == beat:
+                await self._report(now - beat, *captured[1:])
+
+    def _watch(self):
+        captured_beat = None
+        while not self._stop.wait(self.interval / 2):
+            beat = self._beat
+            if beat == captured_beat or time.monotonic() - beat < self.threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            captured_beat = beat
+            self._captured = (beat, *blocking_handler(frame), ''.join(traceback.format_stack(frame)))
+            del frame
+
+    async def _report(self, stalled: float, handler: str, branch: str, kind: str, stack: str):
+        self.stalls += 1
+        LOOP_STALLS.labels(handler, branch, kind).inc()
+        logger.warning(f"Event loop blocked for {stalled:.2f}s by handler {handler} (branch {branch}, {kind}):\n{stack}")
+        now = time.monotonic()
+        if not self._bot or not self.alert_after or stalled < self.alert_after or now - self._last_alert < self.alert_cooldown:
+            return
+        self._last_alert = now
+        # Telegram caps messages at 4096 characters; the innermost frames matter most
+        text = f"Event loop blocked for {stalled:.1f}s\nHandler: {handler} ({branch}, {kind})\n\n{stack[-3500:]}"
+        for admin_id in ADMIN_IDS:
+            try:
+                await self._bot.send_message(chat_id=admin_id, text=text, rate_limit_args='admin')
+            except Exception as e:
+                logger.error(f"Failed to send stall alert to admin {admin_id}: {e}")
+
+loop_monitor = LoopMonitor()
@@ -1,17 +1,86 @@
-import os
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
-from config import BOT_TOKEN
+import asyncio
+from telegram import Update
+from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, TypeHandler, filters
+from config import BOT_TOKEN, METRICS_HOST, METRICS_PORT, LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES, SERVICE_NAMES
+from logging_setup import setup_logging
 from database import init_db
+from utils import ensure_service_files, get_stock_count
 from handlers import start, error_handler, handle_callback_query, handle_message, handle_document
 from handlers import set_price_command, approve_deposit_command, reject_deposit_command
-from handlers import add_discount_command, remove_discount_command, set_referral_command
+from handlers import add_discount_command, remove_discount_command, set_referral_command, profile_command
+from ledger import ledger_maintenance_job
+from maintenance import backup_job, housekeeping_job
+from coalescer import write_coalescer
+from metrics import start_metrics_server
+from xlsx_import import shutdown_import_pool
+from stock_events import stock_monitor
+from workers import run_file_job, drain_file_jobs
+from ratelimit import rate_limit_gate
+from outbound import outbound_scheduler
+from code_watch import code_watcher
+from activity import activity_tracker, track_activity
+from analytics import stats_recorder
+from loop_monitor import loop_monitor
+from admission import admission_controller
 
-def main():
-    # Initialize database
-    init_db()
+background_tasks = []
+servers = []
+
+async def seed_stock_counts():
+    """Give the stock monitor a baseline count per service"""
+    for service in SERVICE_NAMES:
+        stock_monitor.publish(service, await run_file_job(get_stock_count, service))
+
+async def post_init(application):
+    """Start background workers once the event loop is running"""
+    loop_monitor.start(application.bot)
+    write_coalescer.start()
+    activity_tracker.start()
+    stats_recorder.start()
+    background_tasks.append(asyncio.create_task(ledger_maintenance_job()))
+    background_tasks.append(asyncio.create_task(backup_job()))
+    background_tasks.append(asyncio.create_task(housekeeping_job()))
+    stock_monitor.start(application.bot)
+    code_watcher.start(application.bot)
+    background_tasks.append(asyncio.create_task(seed_stock_counts()))
+    if METRICS_PORT:
+        servers.append(await start_metrics_server(METRICS_HOST, METRICS_PORT))
+
+async def post_shutdown(application):
+    """Stop background workers and flush anything still queued"""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    for server in servers:
+        server.close()
+        await server.wait_closed()
+    servers.clear()
+    await loop_monitor.stop()
+    await stock_monitor.stop()
+    await code_watcher.stop()
+    await activity_tracker.stop()
+    await stats_recorder.stop()
+    await write_coalescer.stop()
+    # Workbook rewrites and stock file compactions started by purchases finish before the process exits
+    await asyncio.to_thread(drain_file_jobs)
+    shutdown_import_pool()
+
+def build_application(request=None, rate_limiter=None):
+    """Create the Application and register every handler; request overrides the HTTP transport"""
+    # Every Bot API send goes through the outbound scheduler
+    builder = Application.builder().token(BOT_TOKEN).post_init(post_init).post_shutdown(post_shutdown)
+    builder = builder.rate_limiter(outbound_scheduler if rate_limiter is None else rate_limiter)
+    # Updates are handled concurrently, by priority class and one at a time per user
+    builder = builder.concurrent_updates(admission_controller)
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    application = builder.build()
+    admission_controller.user_data = application.user_data
     
-    # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Activity tracking sees every update, then per-user flood protection runs before every other handler
+    application.add_handler(TypeHandler(Update, track_activity), group=-2)
+    application.add_handler(TypeHandler(Update, rate_limit_gate), group=-1)
     
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -21,6 +90,8 @@ def main():
     application.add_handler(CommandHandler("adddiscount", add_discount_command))
     application.add_handler(CommandHandler("removediscount", remove_discount_command))
     application.add_handler(CommandHandler("setreferral", set_referral_command))
+    # Runs for the whole profile, so other updates must not wait behind it
+    application.add_handler(CommandHandler("profile", profile_command, block=False))
     
     application.add_handler(CallbackQueryHandler(handle_callback_query))
     
@@ -28,26 +99,20 @@ def main():
     application.add_handler(MessageHandler(filters.Document.ALL, handle_document))
     
     application.add_error_handler(error_handler)
+    return application
+
+def main():
+    # Non-blocking, redacted logging
+    setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATES)
     
-    # Create xlsx_files directory if it doesn't exist
-    if not os.path.exists('xlsx_files'):
-        os.makedirs('xlsx_files')
+    # Initialize database
+    init_db()
+    
+    # Create application
+    application = build_application()
     
     # Create empty Excel files if they don't exist
-    from config import SERVICE_FILES
-    from openpyxl import Workbook
-    
-    for service, filename in SERVICE_FILES.items():
-        if not os.path.exists(filename):
-            wb = Workbook()
-            ws = wb.active
-            if service == 'hotmail':
-                ws.append(['Email', 'Password', 'Recovery Email', 'Phone'])
-            elif service == 'outlook':
-                ws.append(['Email', 'Password', 'First Name', 'Last Name', 'Country'])
-            elif service == 'fb_gmail':
-                ws.append(['Email', 'Password', 'Recovery Email', 'DOB'])
-            wb.save(filename)
+    ensure_service_files()
     
     # Start the bot
     print("Bot is running...")
@@ -0,0 +1,98 @@
+"""Online backups and database housekeeping that run alongside the bot.
+
+Every job runs on a worker thread in small steps with a pause between
+them, so handlers keep getting the database while it works:
+
+  backup       the database is copied page by page from one pinned snapshot
+               (WAL lets writers carry on meanwhile), and the stock files are
+               copied under their locks, into BACKUP_DIR/<UTC timestamp>/
+  archive      settled deposits and old broadcasts move to *_archive tables
+  vacuum       free pages go back to the filesystem through incremental vacuum
+  optimize     planner statistics are refreshed with PRAGMA optimize
+"""
+import asyncio
+import logging
+import os
+import shutil
+import time
+import database
+from config import (SERVICE_NAMES, SERVICE_FILES, STOCK_FORMAT, BACKUP_DIR, BACKUP_INTERVAL, BACKUP_KEEP,
+                    BACKUP_PAGES_PER_STEP, MAINTENANCE_INTERVAL, MAINTENANCE_STEP_PAUSE, ARCHIVE_AFTER_DAYS,
+                    ARCHIVE_BATCH_SIZE, VACUUM_PAGES_PER_STEP, ANALYSIS_LIMIT)
+from inventory import inventory_cache
+from stockfile import get_stock_file
+
+logger = logging.getLogger(__name__)
+
+def backup_inventories(dest_dir: str):
+    """Copy each service's stock into dest_dir while no purchase is changing it; returns the files copied"""
+    copied = []
+    for service_key in SERVICE_NAMES:
+        if STOCK_FORMAT == 'text':
+            stock = get_stock_file(service_key)
+            dest = os.path.join(dest_dir, os.path.basename(stock.path))
+            if stock.copy_to(dest):
+                copied.append(dest)
+            continue
+        filename = SERVICE_FILES[service_key]
+        with inventory_cache.lock:
+            # copy2 keeps the mtime, so the copied .head file still matches the copied workbook
+            for path in (filename, f"{filename}.head"):
+                if os.path.exists(path):
+                    dest = os.path.join(dest_dir, os.path.basename(path))
+                    shutil.copy2(path, dest)
+                    copied.append(dest)
+    return copied
+
+def run_backup(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP, pages_per_step: int = BACKUP_PAGES_PER_STEP,
+               pause: float = MAINTENANCE_STEP_PAUSE):
+    """Write a complete backup folder and drop the oldest beyond `keep`; returns its path"""
+    final_dir = os.path.join(backup_dir, time.strftime('%Y%m%d-%H%M%S', time.gmtime()))
+    partial_dir = f"{final_dir}.partial"
+    os.makedirs(partial_dir, exist_ok=True)
+    try:
+        database.backup_database(os.path.join(partial_dir, os.path.basename(database.DB_PATH)),
+                                 pages_per_step, pause)
+        backup_inventories(partial_dir)
+        # Only finished backups carry a plain timestamp name
+        os.replace(partial_dir, final_dir)
+    except Exception:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+    finished = sorted(name for name in os.listdir(backup_dir) if not name.endswith('.partial'))
+    for name in finished[:-keep]:
+        shutil.rmtree(os.path.join(backup_dir, name), ignore_errors=True)
+    return final_dir
+
+def run_housekeeping(pause: float = MAINTENANCE_STEP_PAUSE):
+    """Archive, vacuum and optimize in turn; returns what each step did"""
+    archived = {table: database.archive_old_rows(table, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, pause)
+                for table in database.ARCHIVED_TABLES}
+    released = database.incremental_vacuum(VACUUM_PAGES_PER_STEP, pause)
+    database.optimize_database(ANALYSIS_LIMIT)
+    return archived, released
+
+async def backup_job(interval: float = BACKUP_INTERVAL):
+    """Periodically back up the database and the stock files"""
+    while True:
+        await asyncio.sleep(interval)
+        start = time.perf_counter()
+        try:
+            path = await asyncio.to_thread(run_backup)
+        except Exception as e:
+            logger.error(f"Backup failed: {e}")
+            continue
+        logger.info(f"Backup written to {path} in {time.perf_counter() - start:.1f}s")
+
+async def housekeeping_job(interval: float = MAINTENANCE_INTERVAL):
+    """Periodically archive settled rows, release free pages and refresh planner statistics"""
+    while True:
+        await asyncio.sleep(interval)
+        start = time.perf_counter()
+        try:
+            archived, released = await asyncio.to_thread(run_housekeeping)
+        except Exception as e:
+            logger.error(f"Database maintenance failed: {e}")
+            continue
+        logger.info(f"Database maintenance: archived {archived}, released {released} pages "
+                    f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _CounterChild:
+    __slots__ = ('value',)
+    
+    def __init__(self):
+        self.value = 0
+    
+    def inc(self, amount=1):
+        self.value += amount
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+    
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class _Metric:
+    """Base for labelled metrics; children for known label values are created once and reused"""
+    kind = ''
+    
+    def __init__(self, name, documentation, labelnames=(), labelvalues=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+        for values in labelvalues:
+            self.labels(*self._label_values(values))
+    
+    def labels(self, *values):
+        """Return the child for these label values; single-label lookups do not build a key tuple"""
+        key = values[0] if len(values) == 1 else values
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+    
+    def _label_values(self, key):
+        return key if isinstance(key, tuple) else (key,)
+
+class Counter(_Metric):
+    kind = 'counter'
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount=1):
+        self._default.value += amount
+    
+    def render(self):
+        for key, child in self._children.items():
+            yield f'{self.name}{_format_labels(self.labelnames, self._label_values(key))} {child.value}'
+
+class Histogram(_Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), labelvalues=(), buckets=DEFAULT_BUCKETS):
+        self.bounds = tuple(buckets)
+        super().__init__(name, documentation, labelnames, labelvalues)
+    
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+    
+    def observe(self, value):
+        self._default.observe(value)
+    
+    def render(self):
+        for key, child in self._children.items():
+            values = self._label_values(key)
+            cumulative = 0
+            for bound, count in zip(self.bounds + ('+Inf',), child.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}'
+            labels = _format_labels(self.labelnames, values)
+            yield f'{self.name}_sum{labels} {child.sum}'
+            yield f'{self.name}_count{labels} {child.count}'
+
+class GaugeFunc:
+    """Gauge whose value is read from a callback at scrape time"""
+    kind = 'gauge'
+    
+    def __init__(self, name, documentation, func):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+    
+    def render(self):
+        yield f'{self.name} {self.func()}'
+
+REGISTRY = []
+
+def register(metric):
+    """Add a metric to the exposition registry and return it"""
+    REGISTRY.append(metric)
+    return metric
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        try:
+            lines.extend(metric.render())
+        except Exception as e:
+            logger.error(f"Failed to render metric {metric.name}: {e}")
+    return '\n'.join(lines) + '\n'
+
+# Bot metrics
+HANDLER_SECONDS = register(Histogram(
+    'bot_handler_seconds', 'Update handler latency by handler and branch', ('handler', 'branch')
+))
+DB_QUERY_SECONDS = register(Histogram('bot_db_query_seconds', 'db_execute latency'))
+DB_QUERY_ERRORS = register(Counter('bot_db_query_errors_total', 'db_execute calls that raised'))
+API_SECONDS = register(Histogram(
+    'bot_upstream_api_seconds', 'Code API request latency', ('api',), ('hotmail', 'gmail')
+))
+API_RESULTS = register(Counter(
+    'bot_upstream_api_results_total', 'Code API results by outcome', ('api', 'outcome'),
+    [(api, outcome) for api in ('hotmail', 'gmail') for outcome in ('code', 'no_code', 'http_error', 'timeout', 'error')]
+))
+BROADCAST_MESSAGES = register(Counter(
+    'bot_broadcast_messages_total', 'Broadcast deliveries by result', ('result',), ('sent', 'failed')
+))
+RATE_LIMITED = register(Counter(
+    'bot_rate_limited_total', 'Updates dropped by the per-user rate limiter', ('action',), ('start', 'code', 'default')
+))
+STOCK_NOTIFICATIONS = register(Counter(
+    'bot_stock_notifications_total', 'Low-stock alerts and restock notices by result', ('kind', 'result'),
+    [(kind, result) for kind in ('low_stock', 'restock') for result in ('sent', 'failed')]
+))
+OUTBOUND_REQUESTS = register(Counter(
+    'bot_outbound_requests_total', 'Paced Bot API sends by priority and result', ('priority', 'result'),
+    [(priority, result) for priority in ('interactive', 'admin', 'bulk') for result in ('sent', 'failed', 'retry_after')]
+))
+OUTBOUND_WAIT_SECONDS = register(Histogram(
+    'bot_outbound_wait_seconds', 'Time a send waited in the outbound scheduler', ('priority',), ('interactive', 'admin', 'bulk')
+))
+CODE_WATCH_RESULTS = register(Counter(
+    'bot_code_watch_results_total', 'Code watches by how they ended', ('result',), ('code', 'expired', 'cancelled')
+))
+BROADCAST_SECONDS = register(Histogram(
+    'bot_broadcast_seconds', 'Wall time of a whole broadcast', buckets=(1, 10, 60, 300, 900, 1800, 3600, 7200)
+))
+LOOP_LAG_SECONDS = register(Histogram(
+    'bot_event_loop_lag_seconds', 'How late the event loop ran a timer it was due to run',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+))
+LOOP_STALLS = register(Counter(
+    'bot_event_loop_stalls_total', 'Event-loop stalls past the threshold by the handler that blocked the loop',
+    ('handler', 'branch', 'update_type')
+))
+ADMISSION_CLASSES = ('admin', 'money', 'code', 'default', 'static')
+ADMISSION_UPDATES = register(Counter(
+    'bot_admission_updates_total', 'Updates by admission class and what became of them', ('class', 'outcome'),
+    [(cls, outcome) for cls in ADMISSION_CLASSES for outcome in ('processed', 'shed', 'expired', 'degraded')]
+))
+ADMISSION_WAIT_SECONDS = register(Histogram(
+    'bot_admission_wait_seconds', 'Time an update queued before a worker took it', ('class',), ADMISSION_CLASSES
+))
+
+def timed(handler, branch_func=None):
+    """Record handler latency under (handler, branch); branch_func maps (update, context) to a bounded label"""
+    static_child = HANDLER_SECONDS.labels(handler, '-') if branch_func is None else None
+    branch_children = {}
+    
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            child = static_child
+            if child is None:
+                branch = branch_func(update, context)
+                child = branch_children.get(branch)
+                if child is None:
+                    child = branch_children[branch] = HANDLER_SECONDS.labels(handler, branch)
+            start = perf_counter()
+            try:
+                return await func(update, context, *args, **kwargs)
+            finally:
+                child.observe(perf_counter() - start)
+        return wrapper
+    return decorator
+
+async def start_metrics_server(host: str, port: int):
+    """Serve GET /metrics over plain HTTP on host:port"""
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.split()
+            if len(parts) >= 2 and parts[1].split(b'?')[0] == b'/metrics':
+                status, body = '200 OK', render_metrics().encode()
+            else:
+                status, body = '404 Not Found', b'Not Found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+    
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,162 @@
+"""Central outbound scheduler for Bot API sends.
+
+It is installed as the Application's rate limiter, so every send_message,
+reply_text, send_document and edit passes through it, wherever in the
+code it is made. A send first waits for its chat's budget. It then queues
+for the global budget in priority order: interactive replies, then admin
+messages, then bulk sends. A reply therefore overtakes any backlog of
+broadcast messages. A RetryAfter pauses every send for the time Telegram
+asks for, after which the send is retried.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import OUTBOUND_GLOBAL_LIMIT, OUTBOUND_PRIVATE_CHAT_LIMIT, OUTBOUND_GROUP_CHAT_LIMIT, OUTBOUND_MAX_RETRIES
+from metrics import OUTBOUND_REQUESTS, OUTBOUND_WAIT_SECONDS, GaugeFunc, register
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, passed as rate_limit_args; anything else counts as interactive
+PRIORITIES = {'interactive': 0, 'admin': 1, 'bulk': 2}
+
+PACED_ENDPOINTS = frozenset([
+    'sendMessage', 'sendDocument', 'sendPhoto', 'sendVideo', 'sendAudio', 'sendVoice', 'sendAnimation',
+    'sendSticker', 'sendMediaGroup', 'sendLocation', 'sendContact', 'copyMessage', 'forwardMessage',
+    'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup', 'editMessageMedia',
+])
+
+class _Pacer:
+    """Token bucket kept as a theoretical arrival time, so an idle bucket costs one float"""
+    __slots__ = ('interval', 'tolerance', 'tat')
+
+    def __init__(self, rate, burst):
+        self.interval = 1 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0
+
+    def delay(self, now):
+        """Seconds until the next send is within budget"""
+        return max(0.0, self.tat - self.tolerance - now)
+
+    def reserve(self, now):
+        """Book the next send and return how long to wait for it"""
+        delay = self.delay(now)
+        self.tat = max(self.tat, now) + self.interval
+        return delay
+
+class OutboundScheduler(BaseRateLimiter):
+    """Global and per-chat pacing of Bot API sends with priority classes and RetryAfter handling"""
+
+    def __init__(self, global_limit=OUTBOUND_GLOBAL_LIMIT, private_limit=OUTBOUND_PRIVATE_CHAT_LIMIT,
+                 group_limit=OUTBOUND_GROUP_CHAT_LIMIT, max_retries=OUTBOUND_MAX_RETRIES):
+        self.global_limit = global_limit
+        self.private_limit = private_limit
+        self.group_limit = group_limit
+        self.max_retries = max_retries
+        self._global = _Pacer(*global_limit)
+        self._chats = {}
+        self._sweep_at = 1024
+        self._heap = []
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._task = None
+
+    def queued(self):
+        """Sends waiting for the global budget"""
+        return len(self._heap)
+
+    async def initialize(self):
+        """Start the dispatcher on the running loop"""
+        if self._task is not None:
+            # The Application and its Updater both initialize the shared bot
+            return
+        self._global = _Pacer(*self.global_limit)
+        self._chats.clear()
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        """Stop the dispatcher and let queued sends go out unpaced"""
+        task, self._task = self._task, None
+        if task:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        while self._heap:
+            future = heapq.heappop(self._heap)[2]
+            if not future.done():
+                future.set_result(None)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in PACED_ENDPOINTS or self._task is None:
+            return await callback(*args, **kwargs)
+        priority = rate_limit_args if rate_limit_args in PRIORITIES else 'interactive'
+        chat_id = data.get('chat_id')
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.max_retries + 1):
+            queued = loop.time()
+            if chat_id is not None:
+                delay = self._chat_pacer(chat_id, queued).reserve(queued)
+                if delay:
+                    await asyncio.sleep(delay)
+            await self._acquire(priority)
+            OUTBOUND_WAIT_SECONDS.labels(priority).observe(loop.time() - queued)
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                OUTBOUND_REQUESTS.labels(priority, 'retry_after').inc()
+                self._paused_until = max(self._paused_until, loop.time() + e.retry_after)
+                logger.warning(f"Flood control on {endpoint} to {chat_id}: pausing sends for {e.retry_after}s "
+                               f"(attempt {attempt + 1} of {self.max_retries + 1})")
+                if attempt == self.max_retries:
+                    OUTBOUND_REQUESTS.labels(priority, 'failed').inc()
+                    raise
+                continue
+            except Exception:
+                OUTBOUND_REQUESTS.labels(priority, 'failed').inc()
+                raise
+            OUTBOUND_REQUESTS.labels(priority, 'sent').inc()
+            return result
+
+    def _chat_pacer(self, chat_id, now):
+        pacer = self._chats.get(chat_id)
+        if pacer is None:
+            if len(self._chats) >= self._sweep_at:
+                # Chats whose budget has fully refilled carry no state worth keeping
+                self._chats = {cid: p for cid, p in self._chats.items() if p.tat > now}
+                self._sweep_at = max(1024, 2 * len(self._chats))
+            is_group = str(chat_id).startswith(('-', '@'))
+            pacer = self._chats[chat_id] = _Pacer(*(self.group_limit if is_group else self.private_limit))
+        return pacer
+
+    async def _acquire(self, priority):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (PRIORITIES[priority], next(self._seq), future))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = loop.time()
+            delay = max(self._global.delay(now), self._paused_until - now)
+            if delay > 0:
+                # Sends queued meanwhile compete again, so a late reply still beats a waiting broadcast
+                await asyncio.sleep(delay)
+                continue
+            future = heapq.heappop(self._heap)[2]
+            if future.done():
+                continue
+            self._global.reserve(now)
+            future.set_result(None)
+
+outbound_scheduler = OutboundScheduler()
+register(GaugeFunc('bot_outbound_queue_depth', 'Sends waiting for the global outbound budget', outbound_scheduler.queued))
@@ -0,0 +1,145 @@
+"""On-demand stack sampling and allocation tracing for the running bot.
+
+While a profile runs, a timer thread reads every thread's current stack
+through sys._current_frames() every PROFILE_SAMPLE_INTERVAL and counts
+each distinct stack. It does not hook function calls, so handlers run at
+full speed, and between profiles there is no thread, hook or tracing at
+all. tracemalloc is started for the same window, unless something else
+already runs it, and the growth between the first and last snapshot
+becomes the allocation report. Tracing every allocation roughly doubles
+the CPU cost of a handler, so a busy bot can be profiled for stacks
+alone.
+
+Stacks are written in the collapsed format that flamegraph.pl,
+speedscope and inferno read: one line per stack, frames root-first
+separated by ';', then the sample count. The first frame is the thread
+name, so the event loop and the file and import pools show up as separate
+towers.
+"""
+import asyncio
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from config import PROFILE_SAMPLE_INTERVAL, PROFILE_TRACEMALLOC_FRAMES, PROFILE_TOP_ALLOCATIONS
+
+# Pool workers are named <pool>_<n>; samples from one pool are merged
+_WORKER_SUFFIX = re.compile(r'_\d+$')
+
+class SamplingProfiler:
+    """Counts the stacks of every thread, sampled on a timer thread"""
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._labels = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        """Start sampling from a fresh set of counts"""
+        self.samples = 0
+        self._stacks = Counter()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling and return {collapsed stack: samples}"""
+        thread, self._thread = self._thread, None
+        if thread:
+            self._stop.set()
+            thread.join()
+        self._labels.clear()
+        return self._stacks
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            module = code.co_filename.rsplit('/', 1)[-1].rsplit('\\', 1)[-1]
+            label = self._labels[code] = f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+        return label
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: _WORKER_SUFFIX.sub('', thread.name) for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                frames.append(names.get(thread_id, str(thread_id)))
+                self._stacks[';'.join(reversed(frames))] += 1
+            self.samples += 1
+
+def format_collapsed(stacks):
+    """Collapsed stack text, heaviest stack first"""
+    return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+def top_functions(stacks, limit: int = 10):
+    """(function, samples) of the functions most often on top of a stack"""
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(';', 1)[-1]] += count
+    return leaves.most_common(limit)
+
+def format_allocations(before, after, elapsed: float, limit: int = PROFILE_TOP_ALLOCATIONS):
+    """Top allocation growth and top live allocations between two tracemalloc snapshots"""
+    lines = [f"Allocations over {elapsed:.1f}s, traced {PROFILE_TRACEMALLOC_FRAMES} frame(s) deep", '',
+             f"Top {limit} by growth:"]
+    for stat in after.compare_to(before, 'lineno')[:limit]:
+        lines.append(f"  {stat.size_diff / 1024:+10.1f} KiB {stat.count_diff:+8d} blocks  {stat.traceback}")
+    lines += ['', f"Top {limit} live at the end:"]
+    for stat in after.statistics('lineno')[:limit]:
+        lines.append(f"  {stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback}")
+    return '\n'.join(lines) + '\n'
+
+def _snapshot():
+    # The profiler's own bookkeeping would otherwise top the report
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+
+async def profile_for(seconds: float, allocations: bool = True, top: int = PROFILE_TOP_ALLOCATIONS):
+    """Sample stacks, and allocations unless told not to, for `seconds`; returns (stacks, allocation report or None, samples)"""
+    if sampler.running:
+        raise RuntimeError("A profile is already running")
+    if not allocations:
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stacks = sampler.stop()
+        return stacks, None, sampler.samples
+
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+    try:
+        sampler.start()
+        started = time.perf_counter()
+        before = await asyncio.to_thread(_snapshot)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            stacks = sampler.stop()
+        after = await asyncio.to_thread(_snapshot)
+        elapsed = time.perf_counter() - started
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    report = await asyncio.to_thread(format_allocations, before, after, elapsed, top)
+    return stacks, report, sampler.samples
+
+sampler = SamplingProfiler()
@@ -0,0 +1,108 @@
+"""Per-user flood protection, run ahead of every other handler.
+
+Each active user gets one record holding a token bucket per action class
+in RATE_LIMITS, plus a single last-seen timestamp. The records sit in an
+OrderedDict in last-seen order, so idle users are evicted from the front
+without scanning the whole table.
+"""
+import time
+from collections import OrderedDict
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+from config import ADMIN_IDS, RATE_LIMITS, RATE_LIMIT_IDLE_SECONDS, RATE_LIMIT_NOTICE_COOLDOWN
+from metrics import RATE_LIMITED
+from utils import user_sessions
+
+CODE_CALLBACKS = frozenset(['get_hotmail_code', 'get_gmail_code', 'retry_hotmail', 'retry_gmail'])
+
+class _UserBuckets:
+    __slots__ = ('tokens', 'updated', 'noticed')
+
+    def __init__(self, capacities, now):
+        self.tokens = list(capacities)
+        self.updated = now
+        self.noticed = float('-inf')
+
+class TokenBucketLimiter:
+    """Token buckets per (user, action class) with idle eviction"""
+
+    def __init__(self, limits=RATE_LIMITS, idle_seconds=RATE_LIMIT_IDLE_SECONDS,
+                 notice_cooldown=RATE_LIMIT_NOTICE_COOLDOWN, clock=time.monotonic):
+        self._index = {action: i for i, action in enumerate(limits)}
+        self._capacities = [capacity for capacity, _ in limits.values()]
+        self._rates = [rate for _, rate in limits.values()]
+        self.idle_seconds = idle_seconds
+        self.notice_cooldown = notice_cooldown
+        self.clock = clock
+        self._users = OrderedDict()
+
+    def __len__(self):
+        return len(self._users)
+
+    def allow(self, user_id: int, action: str) -> bool:
+        """Spend one token from the user's bucket for this action; False if it is empty"""
+        now = self.clock()
+        self._evict(now)
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = _UserBuckets(self._capacities, now)
+        else:
+            self._users.move_to_end(user_id)
+            elapsed = now - entry.updated
+            tokens = entry.tokens
+            for i, rate in enumerate(self._rates):
+                tokens[i] = min(self._capacities[i], tokens[i] + elapsed * rate)
+            entry.updated = now
+        i = self._index.get(action, self._index['default'])
+        if entry.tokens[i] >= 1:
+            entry.tokens[i] -= 1
+            return True
+        return False
+
+    def should_notify(self, user_id: int) -> bool:
+        """True at most once per cooldown per user, so rejections stay cheap"""
+        entry = self._users.get(user_id)
+        now = self.clock()
+        if entry is None or now - entry.noticed < self.notice_cooldown:
+            return False
+        entry.noticed = now
+        return True
+
+    def _evict(self, now):
+        users = self._users
+        while users:
+            user_id, entry = next(iter(users.items()))
+            if now - entry.updated < self.idle_seconds:
+                return
+            users.popitem(last=False)
+
+def classify(update: Update) -> str:
+    """Action class an update is charged to"""
+    if update.callback_query:
+        return 'code' if update.callback_query.data in CODE_CALLBACKS else 'default'
+    message = update.effective_message
+    text = message.text if message else None
+    if text and text.split(maxsplit=1)[0].split('@', 1)[0] == '/start':
+        return 'start'
+    if update.effective_user and update.effective_user.id in user_sessions:
+        # Credentials for an open Get Code session turn into an upstream API call
+        return 'code'
+    return 'default'
+
+limiter = TokenBucketLimiter()
+
+async def rate_limit_gate(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Drop updates from users over their budget before any handler runs"""
+    user = update.effective_user
+    if user is None or user.id in ADMIN_IDS:
+        return
+    action = classify(update)
+    if limiter.allow(user.id, action):
+        return
+    RATE_LIMITED.labels(action).inc()
+    if limiter.should_notify(user.id):
+        if update.callback_query:
+            await update.callback_query.answer("Too many requests. Please slow down.")
+        elif update.effective_message:
+            await update.effective_message.reply_text("Too many requests. Please wait a moment and try again.")
+    raise ApplicationHandlerStop
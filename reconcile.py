@@ -0,0 +1,153 @@
+"""Bulk deposit reconciliation against bKash / Nagad / Rocket statement exports.
+
+A statement (CSV or XLSX) is read into a hash table keyed by transaction
+ID. Pending deposit requests that carry a transaction ID are then probed
+against it in a single pass. Requests whose amount matches their
+statement line exactly are approved together, in one transaction.
+Everything else is flagged for the admin in a report:
+
+  amount_mismatch          the statement amount differs from the request
+  method_mismatch          the statement is for another payment method
+  duplicate_in_statement   the transaction ID appears more than once in the statement
+  duplicate_claim          several pending requests claim the same transaction ID
+  already_approved         the transaction ID already backs an approved deposit
+  unclaimed                money arrived but no request claims it
+"""
+import csv
+import io
+import os
+import re
+import tempfile
+from collections import defaultdict
+from config import DEPOSIT_METHODS
+from database import get_pending_claims, get_approved_claims, settle_deposit_requests, to_cents
+from xlsx_import import iter_workbook_batches
+
+# Normalized header names of the transaction ID and amount columns in the wallets' exports
+TRANSACTION_ID_HEADERS = frozenset(['trxid', 'txnid', 'txid', 'transactionid', 'transactionno', 'transactionnumber',
+                                    'trxno', 'reference', 'referenceno', 'referenceid'])
+AMOUNT_HEADERS = frozenset(['amount', 'amountbdt', 'amounttk', 'credit', 'creditamount', 'received', 'receivedamount'])
+HEADER_SCAN_ROWS = 20
+
+REPORT_HEADER = ['Flag', 'Transaction ID', 'Statement Amount', 'Request ID', 'User ID', 'Requested Amount', 'Method']
+
+_NOT_ALNUM = re.compile(r'[^a-z0-9]')
+_NOT_NUMBER = re.compile(r'[^0-9.\-]')
+
+def normalize_transaction_id(value) -> str:
+    """Canonical form of a transaction ID as typed by a user or read from a statement cell"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip().upper() if value is not None else ''
+
+def _parse_amount(value):
+    if isinstance(value, (int, float)):
+        return to_cents(value)
+    text = _NOT_NUMBER.sub('', str(value or '').replace(',', ''))
+    try:
+        return to_cents(float(text))
+    except ValueError:
+        return None
+
+def statement_method(filename: str):
+    """Payment method named in the statement's file name, or None"""
+    name = _NOT_ALNUM.sub('', filename.lower())
+    return next((method for method in DEPOSIT_METHODS if _NOT_ALNUM.sub('', method.lower()) in name), None)
+
+def read_statement_rows(content: bytes, filename: str):
+    """Rows of a CSV or XLSX statement"""
+    if filename.lower().endswith('.csv'):
+        text = content.decode('utf-8-sig', errors='replace')
+        return list(csv.reader(io.StringIO(text)))
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(content)
+        return [row for _, batch in iter_workbook_batches(path, all_sheets=True) for row in batch]
+    finally:
+        os.remove(path)
+
+def parse_statement(rows):
+    """Find the header row and return ({transaction_id: [amount_cents, ...]}, lines read, lines skipped)"""
+    for index, row in enumerate(rows[:HEADER_SCAN_ROWS]):
+        names = [_NOT_ALNUM.sub('', str(cell or '').lower()) for cell in row]
+        txid_column = next((i for i, name in enumerate(names) if name in TRANSACTION_ID_HEADERS), None)
+        amount_column = next((i for i, name in enumerate(names) if name in AMOUNT_HEADERS), None)
+        if txid_column is not None and amount_column is not None:
+            break
+    else:
+        raise ValueError("No transaction ID and amount columns found in the statement")
+
+    lines = defaultdict(list)
+    read = skipped = 0
+    for row in rows[index + 1:]:
+        if len(row) <= max(txid_column, amount_column):
+            skipped += 1
+            continue
+        transaction_id = normalize_transaction_id(row[txid_column])
+        amount_cents = _parse_amount(row[amount_column])
+        if not transaction_id or amount_cents is None:
+            skipped += 1
+            continue
+        lines[transaction_id].append(amount_cents)
+        read += 1
+    return lines, read, skipped
+
+class ReconcileResult:
+    """Outcome of one statement: approved requests, flagged lines and counts"""
+
+    def __init__(self, method, lines_read, lines_skipped):
+        self.method = method
+        self.lines_read = lines_read
+        self.lines_skipped = lines_skipped
+        self.settled = []
+        self.flagged = []
+        self.pending_unmatched = 0
+
+    def flag_counts(self):
+        counts = defaultdict(int)
+        for row in self.flagged:
+            counts[row[0]] += 1
+        return dict(counts)
+
+def reconcile_statement(content: bytes, filename: str):
+    """Match a statement against pending deposits, approve the exact matches and flag the rest"""
+    method = statement_method(filename)
+    lines, read, skipped = parse_statement(read_statement_rows(content, filename))
+    result = ReconcileResult(method, read, skipped)
+
+    claims = defaultdict(list)
+    for request_id, user_id, amount, request_method, transaction_id in get_pending_claims():
+        claims[normalize_transaction_id(transaction_id)].append((request_id, user_id, amount, request_method))
+
+    approve = []
+    for transaction_id, requests in claims.items():
+        amounts = lines.get(transaction_id)
+        if amounts is None:
+            result.pending_unmatched += len(requests)
+            continue
+        statement_amount = amounts[0] / 100
+        if len(amounts) > 1:
+            flag = 'duplicate_in_statement'
+        elif len(requests) > 1:
+            flag = 'duplicate_claim'
+        elif method and requests[0][3] != method:
+            flag = 'method_mismatch'
+        elif to_cents(requests[0][2]) != amounts[0]:
+            flag = 'amount_mismatch'
+        else:
+            approve.append(requests[0][0])
+            continue
+        for request_id, user_id, amount, request_method in requests:
+            result.flagged.append((flag, transaction_id, statement_amount, request_id, user_id, amount, request_method))
+
+    unclaimed = [transaction_id for transaction_id in lines if transaction_id not in claims]
+    approved = get_approved_claims(unclaimed)
+    for transaction_id in unclaimed:
+        flag = 'already_approved' if transaction_id in approved else 'unclaimed'
+        for amount_cents in lines[transaction_id]:
+            result.flagged.append((flag, transaction_id, amount_cents / 100, approved.get(transaction_id), None, None, method))
+
+    # One transaction for every exact match; requests settled meanwhile by an admin are skipped
+    result.settled = settle_deposit_requests(approve, 'approved') if approve else []
+    return result
@@ -0,0 +1,134 @@
+"""Stock change events: low-stock alerts for admins and back-in-stock notices for subscribers.
+
+Every inventory mutation publishes the service's new count, from whichever
+thread made it. A task on the event loop compares each count with the
+previous one and reacts only to threshold crossings, so nothing polls the
+stock files. Restock fan-out goes through a paced notifier to stay under
+Telegram's flood limits.
+"""
+import asyncio
+import logging
+from telegram.error import Forbidden, BadRequest
+from activity import activity_tracker, is_unreachable
+from config import ADMIN_IDS, SERVICE_NAMES, LOW_STOCK_THRESHOLDS, NOTIFY_MESSAGES_PER_SECOND
+from database import take_restock_subscribers
+from metrics import STOCK_NOTIFICATIONS
+
+logger = logging.getLogger(__name__)
+
+class RateLimitedNotifier:
+    """Sends one text to many chats at no more than `rate` messages per second"""
+
+    def __init__(self, rate: float = NOTIFY_MESSAGES_PER_SECOND):
+        self.interval = 1 / rate
+        self._lock = asyncio.Lock()
+
+    async def send_many(self, bot, chat_ids, text, kind, priority='bulk'):
+        """Deliver `text` to every chat in turn; returns the number sent"""
+        sent = 0
+        loop = asyncio.get_running_loop()
+        # One fan-out at a time, so concurrent restocks share the same budget
+        async with self._lock:
+            next_at = loop.time()
+            for chat_id in chat_ids:
+                delay = next_at - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                next_at = max(next_at, loop.time()) + self.interval
+                if await self._send(bot, chat_id, text, priority):
+                    sent += 1
+                    STOCK_NOTIFICATIONS.labels(kind, 'sent').inc()
+                else:
+                    STOCK_NOTIFICATIONS.labels(kind, 'failed').inc()
+        return sent
+
+    async def _send(self, bot, chat_id, text, priority):
+        # The outbound scheduler already waits out and retries RetryAfter
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, rate_limit_args=priority)
+            return True
+        except (Forbidden, BadRequest) as e:
+            if is_unreachable(e):
+                activity_tracker.mark_blocked(chat_id)
+            return False
+        except Exception as e:
+            logger.error(f"Failed to send stock notification to {chat_id}: {e}")
+            return False
+
+class StockMonitor:
+    """Turns published stock counts into low-stock alerts and restock notices"""
+
+    def __init__(self, thresholds=LOW_STOCK_THRESHOLDS, admin_ids=ADMIN_IDS, notifier=None):
+        self.thresholds = thresholds
+        self.admin_ids = admin_ids
+        self.notifier = notifier or RateLimitedNotifier()
+        self.admin_notifier = RateLimitedNotifier()
+        self.counts = {}
+        self._bot = None
+        self._loop = None
+        self._queue = None
+        self._task = None
+        self._fanouts = set()
+
+    def start(self, bot):
+        """Start consuming stock events on the running loop"""
+        self._bot = bot
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the consumer and any fan-out still in flight"""
+        self._loop = None
+        tasks = [task for task in (self._task, *self._fanouts) if task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._fanouts.clear()
+
+    def publish(self, service_key: str, count: int):
+        """Report a service's current stock count; safe to call from any thread"""
+        loop = self._loop
+        if loop is None:
+            self.counts[service_key] = count
+            return
+        try:
+            loop.call_soon_threadsafe(self._queue.put_nowait, (service_key, count))
+        except RuntimeError:
+            # Loop already closed during shutdown
+            pass
+
+    async def _run(self):
+        while True:
+            service_key, count = await self._queue.get()
+            try:
+                await self._handle(service_key, count)
+            except Exception as e:
+                logger.error(f"Error handling stock event for {service_key}: {e}")
+
+    async def _handle(self, service_key, count):
+        previous = self.counts.get(service_key)
+        self.counts[service_key] = count
+        if previous is None or previous == count:
+            return
+        name = SERVICE_NAMES.get(service_key, service_key)
+        threshold = self.thresholds.get(service_key, 0)
+
+        if count < threshold <= previous or (count == 0 < previous):
+            text = f"{name} is out of stock." if count == 0 else f"Low stock: {name} has {count} accounts left (threshold {threshold})."
+            self._fan_out(self.admin_notifier, self.admin_ids, text, 'low_stock', 'admin')
+
+        if previous == 0 and count > 0:
+            subscribers = await asyncio.to_thread(take_restock_subscribers, service_key)
+            logger.info(f"{name} restocked with {count} accounts; notifying {len(subscribers)} subscribers")
+            if subscribers:
+                self._fan_out(self.notifier, subscribers, f"{name} is back in stock! {count} accounts available.", 'restock', 'bulk')
+
+    def _fan_out(self, notifier, chat_ids, text, kind, priority):
+        # Admin alerts use their own notifier so they never queue behind a large restock fan-out
+        task = asyncio.create_task(notifier.send_many(self._bot, chat_ids, text, kind, priority))
+        self._fanouts.add(task)
+        task.add_done_callback(self._fanouts.discard)
+
+stock_monitor = StockMonitor()
@@ -0,0 +1,316 @@
+"""Line-oriented stock files: a fast alternative to keeping stock in XLSX.
+
+Layout of a stock file:
+
+    #stock head=0000000000000058
+    Email|Password|Recovery Email|Phone
+    a@hotmail.com|pw|r@mail.com|+1555
+    ...
+
+The first line holds a fixed-width byte offset: where the next unsold
+record starts. A purchase reads the records through mmap and rewrites
+that offset in place, so the file itself is never rewritten on the
+purchase path. The record offsets are also saved next to the file
+(<file>.idx), so a restart does not have to rescan it. Once the sold
+prefix grows large, the file is compacted on the file pool and
+atomically swapped in.
+"""
+import os
+import mmap
+import shutil
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from config import STOCK_TEXT_FILES, STOCK_COMPACT_MIN_BYTES
+from inventory import ReservedRows
+from workers import submit_file_job
+
+logger = logging.getLogger(__name__)
+
+SEP = '|'
+HEAD_PREFIX = b'#stock head='
+HEAD_DIGITS = 16
+PREAMBLE_LEN = len(HEAD_PREFIX) + HEAD_DIGITS + 1
+_IDX_HEADER = struct.Struct('<QQ')
+_COPY_CHUNK = 1024 * 1024
+
+def _preamble(head):
+    return HEAD_PREFIX + b'%0*d\n' % (HEAD_DIGITS, head)
+
+def _line(row):
+    return (SEP.join(
+        '' if cell is None else str(cell).replace(SEP, ' ').replace('\r', ' ').replace('\n', ' ') for cell in row
+    ) + '\n').encode()
+
+def write_stock_file(path, header, rows):
+    """Atomically write a new stock file from a header and an iterable of rows; returns the record count"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    header_line = _line(header)
+    data_start = PREAMBLE_LEN + len(header_line)
+    offsets = array('Q', [data_start])
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(_preamble(data_start))
+        f.write(header_line)
+        position = data_start
+        for row in rows:
+            line = _line(row)
+            f.write(line)
+            position += len(line)
+            offsets.append(position)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    _save_index(path, offsets)
+    return len(offsets) - 1
+
+def _save_index(path, offsets):
+    temp_path = f"{path}.idx.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(_IDX_HEADER.pack(offsets[-1], offsets[0]))
+        offsets.tofile(f)
+    os.replace(temp_path, f"{path}.idx")
+
+def _load_index(path, size, data_start):
+    """Return the saved record offsets if they still describe the file, else None"""
+    try:
+        with open(f"{path}.idx", 'rb') as f:
+            saved_size, saved_start = _IDX_HEADER.unpack(f.read(_IDX_HEADER.size))
+            if (saved_size, saved_start) != (size, data_start):
+                return None
+            offsets = array('Q')
+            offsets.frombytes(f.read())
+    except (OSError, struct.error, ValueError):
+        return None
+    if not offsets or offsets[0] != data_start or offsets[-1] != size:
+        return None
+    return offsets
+
+def _scan_offsets(mm, data_start, size):
+    offsets = array('Q', [data_start])
+    find = mm.find
+    position = data_start
+    while position < size:
+        end = find(b'\n', position)
+        if end < 0:
+            end = size - 1
+        position = end + 1
+        offsets.append(position)
+    return offsets
+
+def _decode_rows(mm, offsets, start, stop):
+    return [
+        tuple(cell or None for cell in mm[offsets[i]:offsets[i + 1]].rstrip(b'\n').decode().split(SEP))
+        for i in range(start, stop)
+    ]
+
+class StockFile:
+    """Memory-mapped view of one service's stock file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.header = ()
+        self._lock = threading.RLock()
+        self._mm = None
+        self._offsets = array('Q', [0])
+        self._head = 0
+        self._stamp = None
+        self._compacting = False
+
+    # Loading
+    def _current(self):
+        """Map the file, (re)loading it when it was replaced or grown by someone else"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._mm, self._offsets, self._head, self._stamp, self.header = None, array('Q', [0]), 0, None, ()
+            return None
+        if self._mm is not None and self._stamp == (st.st_ino, st.st_size):
+            return self._mm
+        with open(self.path, 'r+b') as f:
+            mm = mmap.mmap(f.fileno(), 0)
+        if mm[:len(HEAD_PREFIX)] != HEAD_PREFIX:
+            raise ValueError(f"{self.path} is not a stock file")
+        head_byte = int(mm[len(HEAD_PREFIX):PREAMBLE_LEN - 1])
+        header_end = mm.find(b'\n', PREAMBLE_LEN)
+        data_start = header_end + 1 if header_end >= 0 else len(mm)
+        self.header = tuple(mm[PREAMBLE_LEN:max(header_end, PREAMBLE_LEN)].decode().split(SEP))
+        offsets = _load_index(self.path, len(mm), data_start)
+        if offsets is None:
+            offsets = _scan_offsets(mm, data_start, len(mm))
+            _save_index(self.path, offsets)
+        self._mm, self._offsets, self._stamp = mm, offsets, (st.st_ino, st.st_size)
+        self._head = min(bisect_left(offsets, head_byte), len(offsets) - 1)
+        return mm
+
+    # Reading and purchasing
+    def __len__(self):
+        with self._lock:
+            self._current()
+            return len(self._offsets) - 1 - self._head
+
+    def peek(self, count):
+        """Return the next `count` rows without consuming them"""
+        with self._lock:
+            mm = self._current()
+            if mm is None:
+                return []
+            return _decode_rows(mm, self._offsets, self._head, min(self._head + count, len(self._offsets) - 1))
+
+    def take(self, count):
+        """Consume and return the next `count` rows (fewer if stock runs out); only the head pointer is written"""
+        with self._lock:
+            mm = self._current()
+            if mm is None:
+                return []
+            stop = min(self._head + count, len(self._offsets) - 1)
+            rows = _decode_rows(mm, self._offsets, self._head, stop)
+            self._advance(mm, stop)
+            return rows
+
+    def _advance(self, mm, head):
+        self._head = head
+        mm[len(HEAD_PREFIX):PREAMBLE_LEN - 1] = b'%0*d' % (HEAD_DIGITS, self._offsets[head])
+        mm.flush(0, min(mmap.PAGESIZE, len(mm)))
+        self._maybe_compact()
+
+    def reserve(self, count):
+        """Take exactly `count` rows out of stock without decoding them; None if there are fewer"""
+        with self._lock:
+            mm = self._current()
+            if mm is None or count > len(self._offsets) - 1 - self._head:
+                return None
+            # The mapping and offsets are never mutated in place, so the reservation survives compaction
+            reserved = ReservedRows(mm, self._offsets, self._head, self._head + count, _decode_rows)
+            self._advance(mm, self._head + count)
+            return reserved
+
+    def iter_rows(self, batch_size=1000):
+        """Yield the unsold rows as of the call, decoding a batch at a time"""
+        with self._lock:
+            mm = self._current()
+            if mm is None:
+                return
+            # Appends and compaction build new offset arrays and mappings, so this snapshot stays valid
+            offsets, head = self._offsets, self._head
+        end = len(offsets) - 1
+        for start in range(head, end, batch_size):
+            yield from _decode_rows(mm, offsets, start, min(start + batch_size, end))
+
+    def append(self, rows):
+        """Append rows to the end of the stock; returns the new stock count"""
+        with self._lock:
+            if self._current() is None:
+                write_stock_file(self.path, self.header, rows)
+                return len(self)
+            offsets = array('Q', self._offsets)
+            with open(self.path, 'ab') as f:
+                position = offsets[-1]
+                for row in rows:
+                    line = _line(row)
+                    f.write(line)
+                    position += len(line)
+                    offsets.append(position)
+            _save_index(self.path, offsets)
+            self._mm = None
+            return len(self)
+
+    def copy_to(self, dest_path):
+        """Copy the file as it stands between purchases, head pointer included; False if it does not exist"""
+        with self._lock:
+            if not os.path.exists(self.path):
+                return False
+            shutil.copyfile(self.path, dest_path)
+            return True
+
+    # Compaction
+    def consumed_bytes(self):
+        return self._offsets[self._head] - self._offsets[0]
+
+    def _maybe_compact(self):
+        consumed = self.consumed_bytes()
+        live = self._offsets[-1] - self._offsets[self._head]
+        if self._compacting or consumed < max(STOCK_COMPACT_MIN_BYTES, live):
+            return
+        self._compacting = True
+        submit_file_job(self.compact)
+
+    def compact(self):
+        """Rewrite the file without the sold prefix; purchases continue while the bulk of the copy runs"""
+        temp_path = f"{self.path}.compact"
+        try:
+            with self._lock:
+                mm = self._current()
+                if mm is None:
+                    return
+                header_line = _line(self.header)
+                data_start = PREAMBLE_LEN + len(header_line)
+                start_index = self._head
+                start, end = self._offsets[start_index], self._offsets[-1]
+            with open(temp_path, 'wb') as f:
+                f.write(_preamble(data_start))
+                f.write(header_line)
+                for position in range(start, end, _COPY_CHUNK):
+                    f.write(mm[position:min(position + _COPY_CHUNK, end)])
+                with self._lock:
+                    if self._current() is not mm:
+                        # Replaced or appended to meanwhile; the next purchase will trigger another attempt
+                        return
+                    dropped = start - self._offsets[0]
+                    shift = start - data_start
+                    head_byte = self._offsets[self._head] - shift
+                    f.seek(0)
+                    f.write(_preamble(head_byte))
+                    f.flush()
+                    os.fsync(f.fileno())
+                    offsets = array('Q', (offset - shift for offset in self._offsets[start_index:]))
+                    os.replace(temp_path, self.path)
+                    _save_index(self.path, offsets)
+                    self._mm = None
+                    logger.info(f"Compacted {self.path}: dropped {dropped} sold bytes")
+        except Exception as e:
+            logger.error(f"Error compacting stock file {self.path}: {e}")
+        finally:
+            self._compacting = False
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+# Per-service stock files
+_stock_files = {}
+_registry_lock = threading.Lock()
+
+def get_stock_file(service_key):
+    """Return the StockFile for a service (None for unknown services)"""
+    path = STOCK_TEXT_FILES.get(service_key)
+    if not path:
+        return None
+    with _registry_lock:
+        stock = _stock_files.get(path)
+        if stock is None:
+            stock = _stock_files[path] = StockFile(path)
+        return stock
+
+# Converters
+def workbook_to_stock(workbook_path, stock_path):
+    """Convert an XLSX workbook (first row = header) into a stock file; returns the record count"""
+    from xlsx_import import read_workbook_rows
+    rows = read_workbook_rows(workbook_path)
+    if not rows:
+        return write_stock_file(stock_path, (), [])
+    return write_stock_file(stock_path, rows[0], rows[1:])
+
+def stock_to_workbook(stock_path, workbook_path):
+    """Write the unsold rows of a stock file to an XLSX workbook; returns the record count"""
+    from openpyxl import Workbook
+    stock = StockFile(stock_path)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(stock.header))
+    count = 0
+    for row in stock.iter_rows():
+        ws.append(list(row))
+        count += 1
+    wb.save(workbook_path)
+    return count
@@ -1,22 +1,31 @@
 import os
+import csv
 import logging
 import asyncio
-import aiohttp
 import random
-import string
-import re
-from datetime import datetime
+import tempfile
+from contextlib import AsyncExitStack
 from functools import wraps
-from openpyxl import load_workbook, Workbook
-from config import SERVICE_FILES, CODE_FORMATS, ADMIN_IDS
+from time import perf_counter
+from config import SERVICE_FILES, ADMIN_IDS, HOTMAIL_API_URL, GMAIL_API_URL, STOCK_FORMAT, STOCK_TEXT_FILES
+from config import STOCK_REWRITE_MIN_ROWS
+from database import get_discount_settings, get_user_data, db_execute, get_referral_settings
+from metrics import API_SECONDS, API_RESULTS, GaugeFunc, register
+from xlsx_import import read_workbook_rows
+from inventory import inventory_cache
+from stockfile import get_stock_file, workbook_to_stock, write_stock_file
+from stock_events import stock_monitor
+from workers import submit_file_job
 
-# Logging setup
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Global data & state
 user_sessions = {}
 session_timeouts = {}
+# Services whose workbook is being rewritten without its sold rows
+_rewriting = set()
+
+register(GaugeFunc('bot_code_sessions', 'Active Get Code sessions', lambda: len(user_sessions)))
 
 # Decorators
 def admin_only(func):
@@ -31,117 +40,199 @@ def admin_only(func):
     return wrapper
 
 # XLSX File Handling
-def _read_excel(filename):
-    """Read data from Excel file"""
-    if not load_workbook or not os.path.exists(filename):
-        return []
-    
+def _openpyxl():
+    """Import openpyxl on first use; only the XLSX paths need it"""
     try:
-        wb = load_workbook(filename)
-        ws = wb.active
-        data = []
-        for row in ws.iter_rows(values_only=True):
-            data.append(row)
-        return data
-    except Exception as e:
-        logger.error(f"Error reading Excel file {filename}: {e}")
-        return []
+        import openpyxl
+    except ImportError:
+        return None
+    return openpyxl
+
+def _save_workbook_temp(filename, data):
+    """Write rows to a new workbook next to filename and return its path"""
+    fd, temp_path = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(filename) or '.')
+    os.close(fd)
+    try:
+        wb = _openpyxl().Workbook(write_only=True)
+        ws = wb.create_sheet()
+        for row in data:
+            ws.append(row)
+        wb.save(temp_path)
+        return temp_path
+    except Exception:
+        os.remove(temp_path)
+        raise
 
 def _write_excel(filename, data):
-    """Write data to Excel file"""
-    if not Workbook:
+    """Atomically write data to Excel file"""
+    if not _openpyxl():
         logger.error("openpyxl not found. Cannot write XLSX.")
         return False
     
     try:
-        wb = Workbook()
-        ws = wb.active
-        for row in data:
-            ws.append(row)
-        wb.save(filename)
+        os.replace(_save_workbook_temp(filename, data), filename)
         return True
     except Exception as e:
         logger.error(f"Error writing Excel file {filename}: {e}")
         return False
 
+SERVICE_HEADERS = {
+    'hotmail': ['Email', 'Password', 'Recovery Email', 'Phone'],
+    'outlook': ['Email', 'Password', 'First Name', 'Last Name', 'Country'],
+    'fb_gmail': ['Email', 'Password', 'Recovery Email', 'DOB'],
+}
+
+def ensure_service_files():
+    """Create header-only stock for services without any; openpyxl is only loaded if a workbook is missing"""
+    for service, filename in SERVICE_FILES.items():
+        if STOCK_FORMAT == 'text':
+            stock_path = STOCK_TEXT_FILES[service]
+            if os.path.exists(stock_path):
+                continue
+            if os.path.exists(filename):
+                count = workbook_to_stock(filename, stock_path)
+                logger.info(f"Converted {filename} to stock file {stock_path} ({count} accounts)")
+            else:
+                write_stock_file(stock_path, SERVICE_HEADERS[service], [])
+            continue
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        if not os.path.exists(filename):
+            _write_excel(filename, [SERVICE_HEADERS[service]])
+
+def _service_stock(service_key):
+    """The service's inventory: its text stock file or its cached workbook, depending on STOCK_FORMAT"""
+    if STOCK_FORMAT == 'text':
+        return get_stock_file(service_key)
+    return inventory_cache.get(service_key)
+
 def get_stock_count(service_key):
     """Get stock count for a service"""
-    filename = SERVICE_FILES.get(service_key)
-    if not filename:
-        return 0
-    data = _read_excel(filename)
-    return max(0, len(data) - 1)  # Subtract header row
-
-def get_rows_for_purchase(service_key, count):
-    """Get rows for purchase from Excel file"""
-    filename = SERVICE_FILES.get(service_key)
-    if not filename:
-        return None
-    
-    data = _read_excel(filename)
-    if len(data) <= 1:  # Only header or empty
-        return None
-    
-    # Return requested count of rows (excluding header)
-    return data[1:count+1] if count <= len(data)-1 else data[1:]
+    inventory = _service_stock(service_key)
+    return len(inventory) if inventory is not None else 0
 
-def remove_purchased_rows(service_key, count):
-    """Remove purchased rows from Excel file"""
-    filename = SERVICE_FILES.get(service_key)
-    if not filename:
-        return False
-    
-    data = _read_excel(filename)
-    if len(data) <= 1:  # Only header or empty
-        return False
-    
-    # Keep header and rows after the purchased ones
-    new_data = [data[0]] + data[count+1:]
-    return _write_excel(filename, new_data)
-
-def append_excel_data(service_key, new_rows_with_header):
-    """Append data to Excel file"""
-    filename = SERVICE_FILES.get(service_key)
-    if not filename:
+def _publish_stock(service_key, count=None):
+    """Tell the stock monitor a service's count after a change"""
+    stock_monitor.publish(service_key, get_stock_count(service_key) if count is None else count)
+
+def _record_sold(service_key, inventory, count):
+    """Save the workbook's new sold-row count before `count` rows are taken; False if it could not be saved"""
+    try:
+        inventory_cache.record_sold(service_key, inventory, count)
+        return True
+    except OSError as e:
+        logger.error(f"Error saving sold rows for {service_key}: {e}")
         return False
-    
-    # If file doesn't exist, create with the provided data
-    if not os.path.exists(filename):
-        return _write_excel(filename, new_rows_with_header)
-    
-    # Read existing data and append new rows
-    existing_data = _read_excel(filename)
-    # Skip header from new data if existing file already has one
-    if existing_data and new_rows_with_header:
-        new_data = existing_data + new_rows_with_header[1:]
+
+def _maybe_rewrite_workbook(service_key, inventory):
+    """Rewrite the workbook on the file pool once its sold rows outnumber the unsold ones"""
+    if service_key in _rewriting or inventory.sold < max(STOCK_REWRITE_MIN_ROWS, len(inventory)):
+        return
+    _rewriting.add(service_key)
+    submit_file_job(rewrite_workbook, service_key)
+
+def rewrite_workbook(service_key):
+    """Rewrite a service workbook without its sold rows; purchases continue while the bulk of the write runs"""
+    filename = SERVICE_FILES[service_key]
+    temp_path = None
+    try:
+        with inventory_cache.lock:
+            inventory = inventory_cache.get(service_key)
+            if inventory is None or not inventory.sold:
+                return
+            stamp, sold, remaining = inventory.stamp, inventory.sold, inventory.remaining()
+        temp_path = _save_workbook_temp(filename, [inventory.header, *(row for rows in remaining.chunks(1000) for row in rows)])
+        if inventory_cache.replace_workbook(service_key, inventory, stamp, sold, temp_path):
+            temp_path = None
+            logger.info(f"Rewrote {filename}: dropped {sold} sold rows")
+    except Exception as e:
+        logger.error(f"Error rewriting Excel file {filename}: {e}")
+    finally:
+        _rewriting.discard(service_key)
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def reserve_stock(service_key, count):
+    """Take `count` accounts out of stock for one order; returns ReservedRows, or None if stock is short or could not be saved"""
+    if STOCK_FORMAT == 'text':
+        stock = get_stock_file(service_key)
+        reserved = stock.reserve(count) if stock else None
+        if reserved is not None:
+            _publish_stock(service_key, len(stock))
+        return reserved
+    with inventory_cache.lock:
+        inventory = inventory_cache.get(service_key)
+        # Save the sold-row count first, so a failed save leaves the order's rows in stock
+        if inventory is None or count > len(inventory) or not _record_sold(service_key, inventory, count):
+            return None
+        reserved = inventory.reserve(count)
+        _publish_stock(service_key, len(inventory))
+        _maybe_rewrite_workbook(service_key, inventory)
+        return reserved
+
+def format_account_lines(rows):
+    """Render account rows as the pipe-delimited lines buyers receive"""
+    return ''.join('|'.join('' if cell is None else str(cell) for cell in row) + '\n' for row in rows).encode()
+
+def store_service_upload(service_key, content: bytes):
+    """Validate an uploaded workbook and atomically replace the service file, returning the new stock count"""
+    filename = SERVICE_FILES[service_key]
+    fd, temp_path = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(filename) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(content)
+        rows = read_workbook_rows(temp_path)
+        if STOCK_FORMAT == 'text':
+            write_stock_file(STOCK_TEXT_FILES[service_key], rows[0] if rows else SERVICE_HEADERS[service_key], rows[1:])
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, filename)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    inventory_cache.invalidate(service_key)
+    _publish_stock(service_key, max(0, len(rows) - 1))
+    return max(0, len(rows) - 1)
+
+def remove_service_stock(service_key):
+    """Delete a service's stock (its workbook, or its stock file and index); returns False if there was none"""
+    if STOCK_FORMAT == 'text':
+        paths = [STOCK_TEXT_FILES[service_key], f"{STOCK_TEXT_FILES[service_key]}.idx"]
     else:
-        new_data = existing_data + new_rows_with_header
-    
-    return _write_excel(filename, new_data)
+        paths = [SERVICE_FILES[service_key], f"{SERVICE_FILES[service_key]}.head"]
+    if not os.path.exists(paths[0]):
+        return False
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    inventory_cache.invalidate(service_key)
+    _publish_stock(service_key, 0)
+    return True
 
-def create_user_download_file(rows_data, service_key):
-    """Create a download file for user"""
-    import tempfile
-    import os
-    
-    # Create a temporary file
-    fd, temp_path = tempfile.mkstemp(suffix='.txt')
-    
+def write_export_file(rows, header, fmt):
+    """Stream rows into a temporary CSV or XLSX file and return its path"""
+    fd, temp_path = tempfile.mkstemp(suffix=f'.{fmt}')
     try:
-        with os.fdopen(fd, 'w') as tmp:
-            for row in rows_data:
-                line = '|'.join(str(cell) for cell in row)
-                tmp.write(line + '\n')
-        
+        if fmt == 'csv':
+            with os.fdopen(fd, 'w', newline='') as tmp:
+                writer = csv.writer(tmp)
+                writer.writerow(header)
+                writer.writerows(rows)
+        else:
+            os.close(fd)
+            wb = _openpyxl().Workbook(write_only=True)
+            ws = wb.create_sheet()
+            ws.append(header)
+            for row in rows:
+                ws.append(row)
+            wb.save(temp_path)
         return temp_path
-    except Exception as e:
-        logger.error(f"Error creating download file: {e}")
-        return None
+    except Exception:
+        os.remove(temp_path)
+        raise
 
 def calculate_discount(quantity):
     """Calculate discount based on quantity"""
-    from database import get_discount_settings
-    
     discounts = get_discount_settings()
     applicable_discount = 0
     
@@ -153,41 +244,61 @@ def calculate_discount(quantity):
     return applicable_discount
 
 # API Functions
-async def fetch_code_from_api(api_url, params):
-    """Fetch code from API"""
+API_LABELS = {HOTMAIL_API_URL: 'hotmail', GMAIL_API_URL: 'gmail'}
+
+async def fetch_code_from_api(api_url, params, session=None):
+    """Fetch code from API; pass a shared aiohttp session to reuse its connections"""
+    import aiohttp
+    
+    api = API_LABELS.get(api_url, 'other')
+    outcome = 'error'
+    start = perf_counter()
     try:
-        async with aiohttp.ClientSession() as session:
+        async with AsyncExitStack() as stack:
+            if session is None:
+                session = await stack.enter_async_context(aiohttp.ClientSession())
             async with session.get(api_url, params=params, timeout=30) as response:
                 response.raise_for_status()
                 data = await response.json()
-                logger.info(f'API Response from {api_url}: {data}')
+                # High volume: lazy arguments and sampling, and never the response body (it carries the code)
+                logger.info('API response from %s: status=%s', api, data.get('status'),
+                            extra={'sample': 'api_response', 'api': api})
+                outcome = 'code' if data.get('code') else 'no_code'
                 return data.get('code'), data
     except aiohttp.ClientError as ce:
+        outcome = 'http_error'
         logger.error(f'API connection error for {api_url}: {ce}')
         return None, {'status': 'error', 'message': f'API connection error: {ce}'}
     except asyncio.TimeoutError:
+        outcome = 'timeout'
         logger.error(f'API request timed out for {api_url}')
         return None, {'status': 'error', 'message': 'API request timed out.'}
     except Exception as e:
         logger.error(f'Unexpected API error for {api_url}: {e}')
         return None, {'status': 'error', 'message': f'Unexpected API error: {e}'}
+    finally:
+        API_SECONDS.labels(api).observe(perf_counter() - start)
+        API_RESULTS.labels(api, outcome).inc()
 
 # Session Management
 def clear_user_session(user_id):
-    """Clear user session"""
+    """Clear user session and its pending timeout"""
     if user_id in user_sessions:
         del user_sessions[user_id]
+    task = session_timeouts.pop(user_id, None)
+    if task:
+        task.cancel()
 
 async def set_session_timeout(user_id, context, minutes=15):
     """Set session timeout"""
-    clear_user_session(user_id)
-    
     # Cancel any existing timeout for this user
     if user_id in session_timeouts:
         session_timeouts[user_id].cancel()
     
     # Set new timeout
     async def timeout_callback():
+        await asyncio.sleep(minutes * 60)
+        session_timeouts.pop(user_id, None)
         if user_id in user_sessions:
             del user_sessions[user_id]
             try:
@@ -199,9 +310,7 @@ async def set_session_timeout(user_id, context, minutes=15):
                 logger.error(f"Error sending timeout message: {e}")
     
     # Schedule the timeout
-    task = asyncio.create_task(asyncio.sleep(minutes * 60))
-    session_timeouts[user_id] = task
-    task.add_done_callback(lambda _: timeout_callback())
+    session_timeouts[user_id] = asyncio.create_task(timeout_callback())
 
 # Referral Functions
 def generate_referral_code(user_id):
@@ -210,8 +319,6 @@ def generate_referral_code(user_id):
 
 def get_or_create_referral_code(user_id):
     """Get or create a referral code for user"""
-    from database import get_user_data, db_execute
-    
     user_data = get_user_data(user_id)
     if user_data and user_data[3]:  # referral_code field
         return user_data[3]
@@ -225,20 +332,8 @@ def get_referral_link(user_id, bot_username="your_bot_username"):
     referral_code = get_or_create_referral_code(user_id)
     return f"https://t.me/{bot_username}?start={referral_code}"
 
-def handle_referral_signup(user_id, referral_code):
-    """Handle referral signup"""
-    from database import db_execute
-    
-    referrer_info = db_execute('SELECT user_id FROM users WHERE referral_code = ?', (referral_code,), fetchone=True)
-    if referrer_info:
-        referrer_id = referrer_info[0]
-        db_execute('UPDATE users SET total_referrals = total_referrals + 1 WHERE user_id = ?', (referrer_id,))
-        db_execute('UPDATE users SET referred_by = ? WHERE user_id = ?', (referrer_id, user_id))
-
 def get_referral_stats(user_id):
     """Get referral stats"""
-    from database import db_execute, get_referral_settings
-    
     total_refs = db_execute('SELECT total_referrals FROM users WHERE user_id = ?', (user_id,), fetchone=True)
     total_earnings = db_execute('SELECT SUM(reward_amount) FROM referral_rewards WHERE referrer_id = ? AND status = "approved"', (user_id,), fetchone=True)
     pending_rewards = db_execute('SELECT COUNT(*) FROM referral_rewards WHERE referrer_id = ? AND status = "pending"', (user_id,), fetchone=True)
@@ -0,0 +1,34 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from config import FILE_WORKER_THREADS, FILE_MAX_PENDING
+
+# File parsing and generation run here instead of on the event loop
+file_pool = ThreadPoolExecutor(max_workers=FILE_WORKER_THREADS, thread_name_prefix='file-io')
+_file_slots = {}
+_background_jobs = set()
+
+def _slots_for_loop(loop):
+    slots = _file_slots.get(loop)
+    if slots is None:
+        _file_slots.clear()
+        slots = _file_slots[loop] = asyncio.Semaphore(FILE_MAX_PENDING)
+    return slots
+
+async def run_file_job(func, *args, **kwargs):
+    """Run blocking file work on the file pool; callers wait for a slot once FILE_MAX_PENDING jobs are in flight"""
+    loop = asyncio.get_running_loop()
+    async with _slots_for_loop(loop):
+        return await loop.run_in_executor(file_pool, partial(func, *args, **kwargs))
+
+def submit_file_job(func, *args):
+    """Start blocking file work on the file pool without waiting for it; drain_file_jobs waits for it at shutdown"""
+    future = file_pool.submit(func, *args)
+    _background_jobs.add(future)
+    future.add_done_callback(_background_jobs.discard)
+    return future
+
+def drain_file_jobs():
+    """Block until every job started with submit_file_job has finished, including any they started"""
+    while _background_jobs:
+        wait(list(_background_jobs))
@@ -0,0 +1,318 @@
+"""Parallel XLSX parsing for large uploads and service workbooks.
+
+Each worksheet's XML is inflated once, as a stream, in the parent. It is
+cut on <row> boundaries into ranges of about IMPORT_CHUNK_BYTES, and each
+range is parsed in a worker process. Workers send their rows back packed
+as one flat tuple per chunk. openpyxl is only used
+as a fallback for sheets the lean parser does not understand.
+
+Like openpyxl's wb.active, only the active sheet is read unless a caller
+asks for every sheet with all_sheets (payment statements do).
+"""
+import io
+import multiprocessing
+import os
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from config import IMPORT_WORKER_PROCESSES, IMPORT_CHUNK_BYTES
+
+MAIN_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_N = '{%s}' % MAIN_NS
+_ROW, _CELL, _VALUE, _TEXT, _RUN, _SI = (_N + tag for tag in ('row', 'c', 'v', 't', 'r', 'si'))
+_XMLNS = re.compile(rb'xmlns(?::[\w.-]+)?="[^"]*"')
+
+class UnsupportedSheet(Exception):
+    """The lean parser cannot read this sheet; fall back to openpyxl"""
+
+# Workbook structure
+def list_sheets(path):
+    """Return [(sheet name, zip member, uncompressed size)] in workbook order"""
+    with zipfile.ZipFile(path) as z:
+        workbook = ET.fromstring(z.read('xl/workbook.xml'))
+        rels = ET.fromstring(z.read('xl/_rels/workbook.xml.rels'))
+        targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+        sheets = []
+        for sheet in workbook.iter(_N + 'sheet'):
+            target = targets.get(sheet.get(f'{{{REL_NS}}}id'))
+            if not target:
+                continue
+            member = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+            sheets.append((sheet.get('name'), member, z.getinfo(member).file_size))
+        return sheets
+
+def active_sheet(path):
+    """Return the list_sheets entry of the workbook's active tab (what openpyxl's wb.active opens), else the first sheet; None if there is none"""
+    sheets = list_sheets(path)
+    with zipfile.ZipFile(path) as z:
+        workbook = ET.fromstring(z.read('xl/workbook.xml'))
+    view = workbook.find(f'{_N}bookViews/{_N}workbookView')
+    names = [sheet.get('name') for sheet in workbook.iter(_N + 'sheet')]
+    try:
+        index = int(view.get('activeTab', 0)) if view is not None else 0
+    except ValueError:
+        index = 0
+    if 0 <= index < len(names):
+        for sheet in sheets:
+            if sheet[0] == names[index]:
+                return sheet
+    return sheets[0] if sheets else None
+
+# Worker side
+_workbook_cache = {}
+
+def _shared_strings(z):
+    try:
+        data = z.read('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    strings = []
+    for _, elem in ET.iterparse(io.BytesIO(data)):
+        if elem.tag == _SI:
+            # Plain text or rich-text runs; phonetic hints (rPh) are not part of the value
+            parts = [child.text or '' for child in elem if child.tag == _TEXT]
+            for run in elem.iter(_RUN):
+                parts.extend(t.text or '' for t in run.iter(_TEXT))
+            strings.append(''.join(parts))
+            elem.clear()
+    return strings
+
+def _date_styles(z):
+    try:
+        styles = ET.fromstring(z.read('xl/styles.xml'))
+    except KeyError:
+        return frozenset()
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+    formats = dict(BUILTIN_FORMATS)
+    for fmt in styles.iter(_N + 'numFmt'):
+        formats[int(fmt.get('numFmtId'))] = fmt.get('formatCode')
+    cell_xfs = styles.find(_N + 'cellXfs')
+    if cell_xfs is None:
+        return frozenset()
+    return frozenset(
+        i for i, xf in enumerate(cell_xfs)
+        if is_date_format(formats.get(int(xf.get('numFmtId', 0)), 'General'))
+    )
+
+def _workbook_parts(path):
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    cached = _workbook_cache.get(key)
+    if cached is None:
+        with zipfile.ZipFile(path) as z:
+            cached = (_shared_strings(z), _date_styles(z))
+        _workbook_cache.clear()
+        _workbook_cache[key] = cached
+    return cached
+
+def _last_row_start(data):
+    """Offset of the last complete <row tag in data, or 0 if there is none past the start"""
+    pos = len(data)
+    while True:
+        pos = data.rfind(b'<row', 0, pos)
+        if pos <= 0:
+            return 0
+        if data[pos + 4:pos + 5] in (b' ', b'>', b'/'):
+            return pos
+
+def iter_sheet_parts(z, member, chunk_bytes=IMPORT_CHUNK_BYTES):
+    """Inflate a worksheet once and yield (namespaces, part): its <row> elements cut into ranges of about chunk_bytes"""
+    with z.open(member) as stream:
+        data = b''
+        while True:
+            block = stream.read(chunk_bytes)
+            data += block
+            root_start = data.find(b'<worksheet')
+            sheet_data = data.find(b'<sheetData')
+            begin = data.find(b'>', sheet_data) + 1 if sheet_data >= 0 else 0
+            if begin:
+                break
+            if not block:
+                raise UnsupportedSheet(member)
+        if root_start < 0:
+            raise UnsupportedSheet(member)
+        if data[begin - 2:begin] == b'/>':
+            return
+        namespaces = b' '.join(_XMLNS.findall(data[root_start:data.find(b'>', root_start)]))
+        data = data[begin:]
+        searched = 0
+        while True:
+            end = data.find(b'</sheetData>', searched)
+            if end >= 0:
+                part = data[:end]
+                if part.strip():
+                    yield namespaces, part
+                return
+            searched = max(0, len(data) - len(b'</sheetData>'))
+            if len(data) >= chunk_bytes:
+                cut = _last_row_start(data)
+                if cut:
+                    yield namespaces, data[:cut]
+                    data = data[cut:]
+                    searched = 0
+            block = stream.read(chunk_bytes)
+            if not block:
+                raise ValueError(f"{member} ends inside <sheetData>")
+            data += block
+
+_column_cache = {}
+
+def _column_index(ref):
+    letters = ref.rstrip('0123456789')
+    index = _column_cache.get(letters)
+    if index is None:
+        index = 0
+        for char in letters:
+            index = index * 26 + ord(char) - 64
+        index = _column_cache[letters] = index - 1
+    return index
+
+def _number(text):
+    if '.' in text or 'E' in text or 'e' in text:
+        return float(text)
+    return int(text)
+
+def parse_sheet_part(path, namespaces, part):
+    """Parse one range of <row> elements of a worksheet and return (width, rows flattened into one tuple)"""
+    shared, date_styles = _workbook_parts(path)
+    fragment = ET.fromstring(b'<sheetData ' + namespaces + b'>' + part + b'</sheetData>')
+    del part
+    
+    from_excel = None
+    rows = []
+    width = 0
+    for elem in fragment:
+        if elem.tag != _ROW:
+            continue
+        row = []
+        for position, cell in enumerate(elem):
+            ref = cell.get('r')
+            column = _column_index(ref) if ref else position
+            if column > len(row):
+                row.extend([None] * (column - len(row)))
+            kind = cell.get('t', 'n')
+            if kind == 'inlineStr':
+                value = ''.join(t.text or '' for t in cell.iter(_TEXT))
+            else:
+                v = cell.find(_VALUE)
+                value = v.text if v is not None else None
+                if value is not None:
+                    if kind == 's':
+                        value = shared[int(value)]
+                    elif kind == 'n':
+                        value = _number(value)
+                        if date_styles and int(cell.get('s', 0)) in date_styles:
+                            if from_excel is None:
+                                from openpyxl.utils.datetime import from_excel
+                            value = from_excel(value)
+                    elif kind == 'b':
+                        value = value == '1'
+            row.append(value)
+        width = max(width, len(row))
+        rows.append(row)
+    del fragment
+    
+    flat = []
+    for row in rows:
+        flat.extend(row)
+        flat.extend([None] * (width - len(row)))
+    return width, tuple(flat)
+
+# Parent side
+def unpack_chunk(chunk):
+    """Turn a (width, flat tuple) chunk back into a list of row tuples"""
+    width, flat = chunk
+    if not width:
+        return []
+    return [flat[i:i + width] for i in range(0, len(flat), width)]
+
+def _openpyxl_sheet_rows(path, sheet_name):
+    from openpyxl import load_workbook
+    wb = load_workbook(path, read_only=True)
+    try:
+        return [tuple(row) for row in wb[sheet_name].iter_rows(values_only=True)]
+    finally:
+        wb.close()
+
+_import_pool = None
+IMPORT_WORKERS = IMPORT_WORKER_PROCESSES or os.cpu_count() or 1
+
+def get_import_pool():
+    """Process pool used for parsing, created on first use"""
+    global _import_pool
+    if _import_pool is None:
+        _import_pool = ProcessPoolExecutor(max_workers=IMPORT_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _import_pool
+
+def shutdown_import_pool():
+    """Stop the worker processes"""
+    global _import_pool
+    if _import_pool is not None:
+        _import_pool.shutdown(cancel_futures=True)
+        _import_pool = None
+
+def iter_workbook_batches(path, chunk_bytes=IMPORT_CHUNK_BYTES, pool=None, workers=None, all_sheets=False):
+    """Yield (sheet name, row batch) of the active sheet, or of every sheet in order with all_sheets; large sheets are parsed in worker processes"""
+    if all_sheets:
+        sheets = list_sheets(path)
+    else:
+        sheets = [sheet for sheet in [active_sheet(path)] if sheet]
+    if sum(size for _, _, size in sheets) <= chunk_bytes and pool is None:
+        # Not worth a round trip through the pool
+        with zipfile.ZipFile(path) as z:
+            for name, member, _ in sheets:
+                try:
+                    batches = [unpack_chunk(parse_sheet_part(path, *part)) for part in iter_sheet_parts(z, member, chunk_bytes)]
+                except UnsupportedSheet:
+                    batches = [_openpyxl_sheet_rows(path, name)]
+                for batch in batches:
+                    yield name, batch
+        return
+    
+    pool = pool or get_import_pool()
+    window = 2 * (workers or IMPORT_WORKERS)
+    pending = []
+    with zipfile.ZipFile(path) as z:
+        for name, member, _ in sheets:
+            try:
+                for part in iter_sheet_parts(z, member, chunk_bytes):
+                    pending.append((name, pool.submit(parse_sheet_part, path, *part)))
+                    if len(pending) >= window:
+                        yield from _drain_first(pending)
+            except UnsupportedSheet:
+                # Raised before any of the sheet's parts were cut
+                while pending:
+                    yield from _drain_first(pending)
+                yield name, _openpyxl_sheet_rows(path, name)
+    while pending:
+        yield from _drain_first(pending)
+
+def _drain_first(pending):
+    name, future = pending.pop(0)
+    yield name, unpack_chunk(future.result())
+
+def _trim(row):
+    end = len(row)
+    while end and row[end - 1] is None:
+        end -= 1
+    return row[:end]
+
+def read_workbook_rows(path, pool=None, workers=None, all_sheets=False):
+    """Header plus data rows of the active sheet; with all_sheets, of every sheet, dropping a first row that repeats the first header"""
+    rows = []
+    header = None
+    checked_sheets = set()
+    for name, batch in iter_workbook_batches(path, pool=pool, workers=workers, all_sheets=all_sheets):
+        if batch and name not in checked_sheets:
+            checked_sheets.add(name)
+            if header is None:
+                header = _trim(batch[0])
+                rows.append(batch[0])
+                batch = batch[1:]
+            elif _trim(batch[0]) == header:
+                batch = batch[1:]
+        rows.extend(batch)
+    return rows